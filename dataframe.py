@@ -9,21 +9,39 @@ __github__ = "github.com/ojas-chaturvedi"
 __license__ = "MIT"
 
 import os
+import sys
 import json
 import re
+import asyncio
+import argparse
+import threading
+import fnmatch
 import pandas as pd
-from pydrive2.auth import GoogleAuth
-from pydrive2.drive import GoogleDrive
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from googleapiclient.http import build_http
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from time import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from storage import FOLDER_MIME, ClientPool, DriveBackend, call_with_retries, call_with_retries_async
+
+CRAWL_WORKERS = 8  # Folder pages listed at once
+DOWNLOAD_WORKERS = 16  # Threads for the "threads" download engine
+ASYNC_CONCURRENCY = 64  # Requests in flight (and pooled connections) for the "async" engine
+SYNC_MANIFEST = "sync_manifest.json"  # In the local directory: Drive file ID -> local name, md5Checksum, modifiedDate
+PARSED_DIR = ".parsed"  # In the local directory: parsed rows per results file
+OUTPUTS_DIR = "outputs"  # In the local directory: archived outputs fetched with --outputs, per model/dataset folder
+OUTPUT_FOLDER = "Model Output"  # upload.py's subfolder for outputs (and their archives) in each model/dataset folder
+
 
 # Google Drive functions
 
 
 def authenticate_service_account():
     """Authenticate with Google Drive using a service account."""
+    # Only the Drive backend needs pydrive2; the local stand-in runs without it
+    from pydrive2.auth import GoogleAuth
+    from pydrive2.drive import GoogleDrive
+    from googleapiclient.http import build_http
+
     gauth = GoogleAuth()
     gauth.settings = {
         "client_config_backend": "service",
@@ -42,68 +60,318 @@ def authenticate_service_account():
     return GoogleDrive(gauth)
 
 
-def download_details_files(folder_id, local_directory):
-    """Download all .txt files containing 'details' from a Google Drive folder and subfolders using concurrency."""
-    drive = authenticate_service_account()
+def drive_backend():
+    """A Drive backend with its own authorized client (one per download thread)."""
+    return DriveBackend(authenticate_service_account())
 
-    if not os.path.exists(local_directory):
-        os.makedirs(local_directory)
 
-    downloaded_files = []
-    folders_to_search = [(folder_id, None)]  # (folder_id, folder_name)
-    download_tasks = []
+def is_details_file(file_name):
+    """Whether a Drive file is a details results file (.txt with 'details' in its name)."""
+    return file_name.lower().endswith(".txt") and "details" in file_name.lower()
 
-    while folders_to_search:
-        current_folder_id, parent_folder_name = folders_to_search.pop(0)
-        query = f"'{current_folder_id}' in parents and trashed=false"
-        file_list = drive.ListFile({"q": query}).GetList()
 
-        for file in file_list:
-            file_name = file["title"]
-            mime_type = file["mimeType"]
+def clean_folder_name(folder_name):
+    """Local name for a Drive folder: "Model - Dataset" -> Model_Dataset."""
+    return folder_name.replace(" - ", "_").replace(" ", "_").replace("-", "_")
 
-            # Add subfolders to search queue
-            if mime_type == "application/vnd.google-apps.folder":
-                folders_to_search.append((file["id"], file_name))
 
-            # Download .txt files containing 'details'
-            elif file_name.lower().endswith(".txt") and "details" in file_name.lower():
-                download_tasks.append((file, parent_folder_name))
+def details_filename(file, parent_folder_name):
+    """Local name for a details file: its folder's name ("Model - Dataset" -> Model_Dataset.txt), else its title."""
+    if parent_folder_name:
+        return f"{clean_folder_name(parent_folder_name)}.txt"
+    return file["title"].replace("/", "_").replace("\\", "_")
 
-    print(f"Found {len(download_tasks)} files to download...")
 
-    def download_file(file_info):
-        file, parent_folder_name = file_info
-        try:
-            drive_file = drive.CreateFile({"id": file["id"]})
-            if parent_folder_name:
-                clean_folder_name = (
-                    parent_folder_name.replace(" - ", "_")
-                    .replace(" ", "_")
-                    .replace("-", "_")
-                )
-                new_filename = f"{clean_folder_name}.txt"
-            else:
-                new_filename = file["title"].replace("/", "_").replace("\\", "_")
+def load_sync_manifest(local_directory):
+    """{Drive file ID: {"name", "md5", "modified"}} for the details files already in `local_directory`."""
+    path = os.path.join(local_directory, SYNC_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_sync_manifest(local_directory, manifest):
+    path = os.path.join(local_directory, SYNC_MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
 
+def start_thread_downloads(pool, local_directory, workers):
+    """
+    Start the thread download engine: each file is saved by its thread's client
+    on up to `workers` threads. Returns (submit, close) like start_async_downloads.
+    """
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def download_file(file, new_filename):
+        try:
+            # Written beside the old copy and renamed, so a failed download keeps the last good version
             local_file_path = os.path.join(local_directory, new_filename)
-            drive_file.GetContentFile(local_file_path)
+            call_with_retries(pool.get().download_file, file["id"], local_file_path + ".part")
+            os.replace(local_file_path + ".part", local_file_path)
             print(f"Downloaded: {new_filename}")
-            return new_filename
+            return file, new_filename
         except Exception as e:
             print(f"Error downloading {file['title']}: {str(e)}")
-            return None
+            return file, None
 
-    with ThreadPoolExecutor() as executor:
-        futures = {
-            executor.submit(download_file, task): task for task in download_tasks
-        }
-        for future in as_completed(futures):
-            result = future.result()
-            if result:
-                downloaded_files.append(result)
+    def submit(file, new_filename):
+        return executor.submit(download_file, file, new_filename)
+
+    return submit, executor.shutdown
+
+
+def start_async_downloads(pool, local_directory, concurrency):
+    """
+    Start the async download engine: an event loop on a background thread with
+    one pooled keep-alive session and at most `concurrency` requests in flight.
+    Bodies are parsed in memory and saved with their parsed rows, so
+    process_folder() does not parse them again. Returns (submit, close):
+    submit(file, new_filename) returns a concurrent.futures.Future of
+    (file, new_filename or None on failure).
+    """
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+
+    def stop_loop():
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        loop.close()
+
+    async def open_session():
+        return pool.get().async_session(concurrency), asyncio.Semaphore(concurrency)
+
+    try:
+        session, semaphore = asyncio.run_coroutine_threadsafe(open_session(), loop).result()
+    except BaseException:
+        stop_loop()
+        raise
+
+    def store(body, new_filename):
+        local_file_path = os.path.join(local_directory, new_filename)
+        with open(local_file_path + ".part", "wb") as f:
+            f.write(body)
+        os.replace(local_file_path + ".part", local_file_path)
+        save_parsed_rows(local_directory, new_filename, parse_results_text(body.decode("utf-8")))
+
+    async def fetch(file, new_filename):
+        try:
+            async with semaphore:
+                body = await call_with_retries_async(session.download_bytes, file["id"])
+            # File writes and parsing run off the loop so they do not stall other transfers
+            await asyncio.to_thread(store, body, new_filename)
+            print(f"Downloaded: {new_filename}")
+            return file, new_filename
+        except Exception as e:
+            print(f"Error downloading {file['title']}: {str(e)}")
+            return file, None
+
+    def submit(file, new_filename):
+        return asyncio.run_coroutine_threadsafe(fetch(file, new_filename), loop)
+
+    def close():
+        asyncio.run_coroutine_threadsafe(session.close(), loop).result()
+        stop_loop()
 
-    return len(downloaded_files)
+    return submit, close
+
+
+def download_details_files(folder_id, local_directory, pool=None, engine="threads", concurrency=None, outputs=None):
+    """
+    Sync all .txt files containing 'details' from a Google Drive folder and
+    subfolders into `local_directory`. `pool` supplies per-thread storage
+    clients (Drive by default; a LocalDriveBackend stand-in for offline runs).
+    Returns the number of files downloaded.
+
+    Files whose md5Checksum and modifiedDate match the sync manifest are kept
+    as they are, so only new or changed files are downloaded; local copies of
+    files removed from Drive are deleted (unless part of the crawl failed).
+
+    The crawl lists up to CRAWL_WORKERS folder pages at once, following each
+    folder's page tokens, and hands every details file to the download pool as
+    soon as its page is listed, so listing and downloading overlap. Rate limits
+    and transient errors are retried; a folder that still cannot be listed is
+    reported and skipped.
+
+    `engine` picks how files are fetched: "threads" downloads each file through
+    the client on DOWNLOAD_WORKERS threads, "async" streams them into memory on
+    one event loop (see start_async_downloads; needs aiohttp for Drive, and
+    falls back to threads without it). `concurrency` overrides either width.
+
+    `outputs` is a filename pattern (e.g. "*.mid") for bundled outputs to fetch
+    as well. A folder holding archive indexes (*.index.json, see upload.py
+    --archive) has each matching member range-read from its archive into
+    {local_directory}/outputs/{Model_Dataset}/, without downloading the archive.
+    """
+    pool = pool or ClientPool(drive_backend)
+
+    if not os.path.exists(local_directory):
+        os.makedirs(local_directory)
+
+    def list_page(current_folder_id, page_token):
+        return call_with_retries(pool.get().list_page, current_folder_id, page_token)
+
+    if engine == "async":
+        try:
+            submit_download, close_downloads = start_async_downloads(
+                pool, local_directory, concurrency or ASYNC_CONCURRENCY
+            )
+        except ImportError as e:
+            print(f"Async downloads unavailable ({e}); using threads")
+            engine = "threads"
+    if engine == "threads":
+        submit_download, close_downloads = start_thread_downloads(
+            pool, local_directory, concurrency or DOWNLOAD_WORKERS
+        )
+
+    def fetch_outputs(current_folder_id, target_directory):
+        """Range-read the members matching `outputs` from one folder's archives; returns how many were saved."""
+        try:
+            drive = pool.get()
+            members = call_with_retries(load_archive_indexes, drive, current_folder_id)
+            matches = sorted(name for name in members if fnmatch.fnmatch(name, outputs))
+            os.makedirs(target_directory, exist_ok=True)
+            for name in matches:
+                local_path = os.path.join(target_directory, name)
+                call_with_retries(download_archive_member, drive, current_folder_id, name, local_path, members)
+            return len(matches)
+        except Exception as e:
+            print(f"Error reading archived outputs in {target_directory}: {str(e)}")
+            return 0
+
+    manifest = load_sync_manifest(local_directory)
+    seen = {}  # Drive file ID -> local name, for every details file found
+    unchanged = 0
+    listing_failed = False
+    folders = 1
+    fetched = 0
+    try:
+        with ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as crawler:
+            # In-flight page listings: future -> (folder_id, folder_name, parent folder name)
+            listings = {crawler.submit(list_page, folder_id, None): (folder_id, None, None)}
+            downloads = []
+            archived = {}  # Folder ID -> future of its archived outputs, once an index is listed there
+            while listings:
+                done, _ = wait(listings, return_when=FIRST_COMPLETED)
+                for future in done:
+                    current_folder_id, folder_name, parent_name = listings.pop(future)
+                    try:
+                        items, next_token = future.result()
+                    except Exception as e:
+                        print(f"Error listing folder {folder_name or current_folder_id}: {str(e)}")
+                        listing_failed = True
+                        continue
+                    if next_token:
+                        listings[crawler.submit(list_page, current_folder_id, next_token)] = (
+                            current_folder_id, folder_name, parent_name
+                        )
+                    for file in items:
+                        # Search subfolders as they are found
+                        if file["mimeType"] == FOLDER_MIME:
+                            folders += 1
+                            listings[crawler.submit(list_page, file["id"], None)] = (
+                                file["id"], file["title"], folder_name
+                            )
+                        # Read archived outputs once per folder with an index, named after their model/dataset folder
+                        elif (
+                            outputs
+                            and file["title"].endswith(ARCHIVE_INDEX_SUFFIX)
+                            and current_folder_id not in archived
+                        ):
+                            owner = parent_name if folder_name == OUTPUT_FOLDER else folder_name
+                            target = os.path.join(local_directory, OUTPUTS_DIR, clean_folder_name(owner or "root"))
+                            archived[current_folder_id] = crawler.submit(fetch_outputs, current_folder_id, target)
+                        # Download details files while the crawl continues
+                        elif is_details_file(file["title"]):
+                            new_filename = details_filename(file, folder_name)
+                            seen[file["id"]] = new_filename
+                            entry = manifest.get(file["id"], {})
+                            if (
+                                entry.get("name") == new_filename
+                                and entry.get("md5") == file["md5Checksum"]
+                                and entry.get("modified") == file["modifiedDate"]
+                                and os.path.exists(os.path.join(local_directory, new_filename))
+                            ):
+                                unchanged += 1
+                            else:
+                                downloads.append(submit_download(file, new_filename))
+
+            print(f"Crawled {folders} folders, found {len(downloads)} new or changed files to download...")
+            downloaded = 0
+            for future in as_completed(downloads):
+                file, new_filename = future.result()
+                if new_filename:
+                    manifest[file["id"]] = {"name": new_filename, "md5": file["md5Checksum"], "modified": file["modifiedDate"]}
+                    downloaded += 1
+            fetched = sum(future.result() for future in archived.values())
+    finally:
+        close_downloads()
+
+    # A failed listing may have hidden files that still exist, so nothing is removed then
+    removed = 0
+    if not listing_failed:
+        current_names = set(seen.values())
+        for file_id in [file_id for file_id in manifest if file_id not in seen]:
+            name = manifest.pop(file_id)["name"]
+            if name not in current_names and os.path.exists(os.path.join(local_directory, name)):
+                os.remove(os.path.join(local_directory, name))
+                removed += 1
+                parsed_path = os.path.join(local_directory, PARSED_DIR, f"{name}.json")
+                if os.path.exists(parsed_path):
+                    os.remove(parsed_path)
+    save_sync_manifest(local_directory, manifest)
+
+    print(f"Sync finished: {downloaded} downloaded, {unchanged} unchanged, {removed} removed")
+    if outputs:
+        print(f"Read {fetched} archived outputs matching {outputs!r} into {os.path.join(local_directory, OUTPUTS_DIR)}")
+    return downloaded
+
+
+# Archive functions (upload.py --archive bundles outputs into a zip/tar with a member index)
+
+ARCHIVE_INDEX_SUFFIX = ".index.json"
+
+
+def load_archive_indexes(drive, folder_id):
+    """
+    Map every member of the archives in a Drive folder to where its bytes are:
+    {member name: (archive file ID, offset, size)}. Only the small index files
+    are downloaded.
+    """
+    files = drive.list_children(folder_id, files_only=True)
+    ids_by_title = {file["title"]: file["id"] for file in files}
+
+    members = {}
+    for file in files:
+        if not file["title"].endswith(ARCHIVE_INDEX_SUFFIX):
+            continue
+        index = json.loads(drive.download_bytes(file["id"]))
+        archive_id = ids_by_title.get(index["archive"])
+        if archive_id is None:
+            print(f"Archive {index['archive']} for index {file['title']} is missing")
+            continue
+        for member in index["members"]:
+            members[member["name"]] = (archive_id, member["offset"], member["size"])
+    return members
+
+
+def read_archive_member(drive, archive_id, offset, size):
+    """Fetch one archive member's bytes with a range read instead of downloading the archive."""
+    return drive.download_bytes(archive_id, offset, size)
+
+
+def download_archive_member(drive, folder_id, member_name, local_path, members=None):
+    """Save one bundled output (e.g. a transcription .mid) from a folder's archives to `local_path`."""
+    members = members if members is not None else load_archive_indexes(drive, folder_id)
+    if member_name not in members:
+        raise KeyError(f"{member_name} is not in any archive in folder {folder_id}")
+    with open(local_path + ".part", "wb") as f:
+        f.write(read_archive_member(drive, *members[member_name]))
+    os.replace(local_path + ".part", local_path)
+    return local_path
 
 
 # Dataframe processing functions
@@ -146,8 +414,19 @@ def parse_results_file(file_path: str) -> list:
         List of dictionaries, each representing one MIDI file's results
     """
     with open(file_path, "r", encoding="utf-8") as file:
-        content = file.read()
+        return parse_results_text(file.read())
+
 
+def parse_results_text(content: str) -> list:
+    """
+    Parse the contents of a results file (already in memory).
+
+    Args:
+        content: Text of the results file
+
+    Returns:
+        List of dictionaries, each representing one MIDI file's results
+    """
     # Extract model and dataset info
     model_match = re.search(r"Model Name:\s*(.+)", content)
     dataset_match = re.search(r"Dataset Name:\s*(.+)", content)
@@ -224,10 +503,59 @@ def parse_results_file(file_path: str) -> list:
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
+def parse_results_cached(folder_path: str, filename: str) -> list:
+    """
+    Parse a results file, reusing its rows from PARSED_DIR while the file's
+    size and modification time are unchanged.
+
+    Args:
+        folder_path: Path to the folder containing the text file
+        filename: Name of the text file
+
+    Returns:
+        List of dictionaries, each representing one MIDI file's results
+    """
+    file_path = os.path.join(folder_path, filename)
+    stat = os.stat(file_path)
+    key = [stat.st_size, stat.st_mtime_ns]
+    cache_path = os.path.join(folder_path, PARSED_DIR, f"{filename}.json")
+
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["key"] == key:
+            return cached["rows"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    rows = parse_results_file(file_path)
+    save_parsed_rows(folder_path, filename, rows)
+    return rows
+
+
+def save_parsed_rows(folder_path: str, filename: str, rows: list):
+    """
+    Store a results file's parsed rows in PARSED_DIR, keyed by the file's
+    current size and modification time.
+
+    Args:
+        folder_path: Path to the folder containing the text file
+        filename: Name of the text file
+        rows: Parsed rows of the file
+    """
+    stat = os.stat(os.path.join(folder_path, filename))
+    cache_path = os.path.join(folder_path, PARSED_DIR, f"{filename}.json")
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"key": [stat.st_size, stat.st_mtime_ns], "rows": rows}, f)
+    os.replace(cache_path + ".tmp", cache_path)
+
+
 def process_folder(folder_path: str) -> pd.DataFrame:
     """
     Process all text files in the local folder and create a pandas DataFrame.
-    Uses concurrency to process files in parallel.
+    Uses concurrency to process files in parallel, and reuses the parsed rows
+    of files that have not changed since the last run.
 
     Args:
         folder_path: Path to the folder containing text files
@@ -251,10 +579,16 @@ def process_folder(folder_path: str) -> pd.DataFrame:
 
     print(f"Found {len(txt_files)} text files to process...")
 
+    # Drop parsed rows of results files that no longer exist
+    parsed_dir = os.path.join(folder_path, PARSED_DIR)
+    if os.path.isdir(parsed_dir):
+        for name in os.listdir(parsed_dir):
+            if name[: -len(".json")] not in txt_files:
+                os.remove(os.path.join(parsed_dir, name))
+
     def parse_file_concurrently(filename):
-        file_path = os.path.join(folder_path, filename)
         try:
-            midi_results = parse_results_file(file_path)
+            midi_results = parse_results_cached(folder_path, filename)
             return (filename, midi_results)
         except Exception as e:
             print(f"Error processing {filename}: {str(e)}")
@@ -340,13 +674,27 @@ def print_dataframe_info(df: pd.DataFrame):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync details files from Drive and build the results DataFrame.")
+    parser.add_argument(
+        "--engine", choices=["async", "threads"], default="async", help="Download engine (async needs aiohttp)"
+    )
+    parser.add_argument("--concurrency", type=int, help="Downloads in flight (default: per engine)")
+    parser.add_argument(
+        "--outputs",
+        metavar="PATTERN",
+        help='Also range-read archived outputs matching PATTERN (e.g. "*.mid") into data/outputs/',
+    )
+    args = parser.parse_args()
+
     start_time = time()
     print("Downloading details files from cloud...")
     print("=" * 60)
 
     folder_id = "11zBLIit-Cg7Tu5KHJXZBvaUauFr5Dtbc"
     local_directory = "./data"
-    count = download_details_files(folder_id, local_directory)
+    count = download_details_files(
+        folder_id, local_directory, engine=args.engine, concurrency=args.concurrency, outputs=args.outputs
+    )
     print(f"Downloaded {count} files")
 
     print("=" * 60)
@@ -373,10 +721,6 @@ if __name__ == "__main__":
             f"No data processed. Please check your '{local_directory}' folder and file formats."
         )
 
-    # Delete all .txt files in the local directory
-    for file in os.listdir(local_directory):
-        if file.endswith(".txt"):
-            os.remove(os.path.join(local_directory, file))
-
+    # The .txt files, sync manifest and parsed rows stay, so the next run only fetches and parses what changed
     end_time = time()
     print(f"\nTotal processing time: {end_time - start_time:.2f}")
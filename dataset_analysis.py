@@ -6,6 +6,7 @@ Purpose: Analyze MIDI files in datasets for use in music transcription survey pa
 
 import json
 import os
+import sys
 import statistics
 import mido
 import pandas as pd
@@ -15,9 +16,24 @@ from collections import Counter
 from tqdm import tqdm
 from pathlib import Path
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from manifest import load_manifest
+
 
 def get_midi_files(dataset_path):
-    """Find all MIDI files in a dataset directory using pathlib."""
+    """Find all MIDI files in a dataset, from its audio manifest when available, else using pathlib."""
+    manifest_rows = load_manifest(dataset_path)
+    if manifest_rows is not None:
+        # Reference MIDI sits next to each rendered WAV (see run.sh scoring)
+        midi_files = []
+        for row in manifest_rows:
+            stem = os.path.splitext(row["path"])[0]
+            for ext in (".mid", ".midi"):
+                if os.path.isfile(stem + ext):
+                    midi_files.append(stem + ext)
+                    break
+        return sorted(midi_files)
+
     path = Path(dataset_path)
     if not path.exists():
         return []
@@ -8,9 +8,10 @@
 
 module load conda
 
-rm -rf /scratch/gilbreth/ochaturv/.conda/envs/analysis
-conda create -y -q --prefix /scratch/gilbreth/ochaturv/.conda/envs/analysis python=3.10 pip mido tqdm pandas > /dev/null
-source activate /scratch/gilbreth/ochaturv/.conda/envs/analysis
+# Cached environment, built once and unpacked to node-local scratch (scripts/envs.py)
+envs_py=$([ -f envs.py ] && echo envs.py || echo scripts/envs.py)
+analysis_env=$(python "$envs_py" analysis) || exit 1
+source activate "$analysis_env"
 
 python dataset_analysis.py datasets.json --generate-tex
 
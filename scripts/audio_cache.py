@@ -0,0 +1,198 @@
+#!/opt/homebrew/bin/python3
+"""
+Name: audio_cache.py
+Purpose: Decode each dataset once per model sample rate into memory-mapped float32 .npy caches
+"""
+
+__author__ = "Ojas Chaturvedi"
+__github__ = "github.com/ojas-chaturvedi"
+__license__ = "MIT"
+
+import os
+import json
+import glob
+import math
+import hashlib
+import argparse
+import numpy as np
+import soundfile as sf
+from math import gcd
+from scipy.signal import resample_poly
+from numpy.lib.format import open_memmap
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DATASETS_FILE = "datasets.json"
+CACHE_ROOT = os.environ.get("AUDIO_CACHE_ROOT", "/scratch/gilbreth/ochaturv/audio_cache")
+SAMPLE_RATES = [16000, 22050]  # MT3/Basic Pitch/CREPE and the 22.05 kHz models
+
+
+def cache_dir_for(list_file, sample_rate, cache_root=CACHE_ROOT):
+    """Cache directory for a dataset list file ({dataset_path}.txt) at a sample rate."""
+    name = os.path.splitext(os.path.basename(list_file))[0]
+    return os.path.join(cache_root, f"{name}_{sample_rate}")
+
+
+def list_digest(list_file):
+    with open(list_file, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def resampled_length(frames, source_rate, sample_rate):
+    """Number of samples resample_poly produces for a clip."""
+    if source_rate == sample_rate:
+        return frames
+    divisor = gcd(sample_rate, source_rate)
+    return math.ceil(frames * (sample_rate // divisor) / (source_rate // divisor))
+
+
+def decode(path, sample_rate):
+    """Decode a file to mono float32 at the target sample rate."""
+    audio, source_rate = sf.read(path, dtype="float32", always_2d=True)
+    audio = audio.mean(axis=1)
+    if source_rate != sample_rate:
+        divisor = gcd(sample_rate, source_rate)
+        audio = resample_poly(audio, sample_rate // divisor, source_rate // divisor)
+    return audio.astype(np.float32, copy=False)
+
+
+def build_cache(list_file, sample_rate, cache_root=CACHE_ROOT, workers=None):
+    """
+    Decode every file in a dataset list into one contiguous float32 .npy plus an
+    index of (offset, length) per path. Skips work if the list is unchanged.
+    """
+    cache_dir = cache_dir_for(list_file, sample_rate, cache_root)
+    index_path = os.path.join(cache_dir, "index.json")
+    digest = list_digest(list_file)
+
+    if os.path.exists(index_path):
+        with open(index_path, "r") as f:
+            if json.load(f).get("list_digest") == digest:
+                print(f"\t- Cache up to date: {cache_dir}")
+                return cache_dir
+        # The index is written last, so readers never see a half-built cache
+        os.remove(index_path)
+
+    with open(list_file, "r") as f:
+        paths = [line.strip() for line in f if line.strip()]
+
+    # First pass reads headers only to lay out the array
+    offsets = {}
+    total = 0
+    for path in paths:
+        try:
+            info = sf.info(path)
+        except RuntimeError as e:
+            print(f"\t- Skipping unreadable file {path}: {e}")
+            continue
+        length = resampled_length(info.frames, info.samplerate, sample_rate)
+        offsets[path] = [total, length]
+        total += length
+
+    os.makedirs(cache_dir, exist_ok=True)
+    samples_path = os.path.join(cache_dir, "audio.npy")
+    samples = open_memmap(samples_path, mode="w+", dtype=np.float32, shape=(total,))
+
+    def fill(path):
+        offset, length = offsets[path]
+        audio = decode(path, sample_rate)[:length]
+        samples[offset : offset + len(audio)] = audio
+        return path
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fill, path): path for path in offsets}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"\t- Failed to decode {futures[future]}: {e}")
+                offsets.pop(futures[future], None)
+                failed += 1
+
+    samples.flush()
+    del samples
+
+    with open(index_path, "w") as f:
+        json.dump(
+            {"list_file": list_file, "list_digest": digest, "sample_rate": sample_rate, "files": offsets},
+            f,
+        )
+    print(f"\t- Cached {len(offsets)} files ({total / sample_rate / 3600:.1f} h, {failed} failed) to {cache_dir}")
+    return cache_dir
+
+
+class AudioCache:
+    """Read-only view of one (dataset, sample rate) cache; get() returns zero-copy slices."""
+
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, "index.json"), "r") as f:
+            index = json.load(f)
+        self.sample_rate = index["sample_rate"]
+        self.files = index["files"]
+        self.samples = np.load(os.path.join(cache_dir, "audio.npy"), mmap_mode="r")
+
+    def __contains__(self, path):
+        return path in self.files
+
+    def get(self, path):
+        offset, length = self.files[path]
+        return self.samples[offset : offset + length]
+
+
+_open_caches = {}
+
+
+def file_stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def load_audio(path, sample_rate, cache_root=CACHE_ROOT, original=None):
+    """
+    Return mono float32 audio for `path` at `sample_rate`, as a memory-mapped view
+    when any cache under `cache_root` holds it and freshly decoded otherwise.
+
+    Caches are keyed by the dataset list's paths, while run.sh hands models a
+    staged copy or a temporary WAV. `original` (default: $ORIGINAL_INPUT, set
+    by run.sh for each file) names the list path and is looked up first when it
+    is the same file, i.e. has the same name up to the extension.
+    """
+    original = original or os.environ.get("ORIGINAL_INPUT")
+    candidates = [os.path.realpath(path)]
+    if original and file_stem(original) == file_stem(path):
+        candidates[:0] = [original, os.path.realpath(original)]
+
+    if sample_rate not in _open_caches:
+        _open_caches[sample_rate] = [
+            AudioCache(os.path.dirname(index_path))
+            for index_path in glob.glob(os.path.join(cache_root, f"*_{sample_rate}", "index.json"))
+        ]
+    for candidate in candidates:
+        for cache in _open_caches[sample_rate]:
+            if candidate in cache:
+                return cache.get(candidate)
+    return decode(path, sample_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build decoded-audio caches per dataset and sample rate.")
+    parser.add_argument("config", nargs="?", default=DATASETS_FILE, help="Path to datasets.json")
+    parser.add_argument("--sample-rates", type=int, nargs="+", default=SAMPLE_RATES)
+    parser.add_argument("--cache-root", default=CACHE_ROOT)
+    parser.add_argument("--workers", type=int, default=None, help="Decode threads (default: all cores)")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        dataset_rows = json.load(f)["values"][1:]
+
+    for dataset_name, dataset_path, *_ in dataset_rows:
+        list_file = f"{dataset_path}.txt"
+        if not os.path.isfile(list_file):
+            print(f"Missing file list: {list_file}, skipping {dataset_name}.")
+            continue
+        print(f"\nCaching dataset: {dataset_name}")
+        for sample_rate in args.sample_rates:
+            build_cache(list_file, sample_rate, args.cache_root, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+#!/bin/bash
+#SBATCH -A standby
+#SBATCH --nodes=1
+#SBATCH --ntasks-per-node=1
+#SBATCH --cpus-per-task=32
+#SBATCH --time=04:00:00
+#SBATCH -J audio_cache
+#SBATCH -o audio_cache_output.out
+
+# Decode every dataset list once per model sample rate (see audio_cache.py)
+
+module load conda
+
+SCRATCH_ROOT="${SCRATCH_ROOT:-/scratch/gilbreth/ochaturv}"
+
+export SCRATCH_ROOT
+cache_env=$(python envs.py audio-cache) || exit 1
+source activate "$cache_env"
+
+export AUDIO_CACHE_ROOT="$SCRATCH_ROOT/audio_cache"
+python audio_cache.py datasets.json --sample-rates 16000 22050 --workers "$SLURM_CPUS_PER_TASK"
+
+conda deactivate
@@ -10,8 +10,13 @@ __license__ = "MIT"
 
 import time
 import os
+import errno
+import fcntl
 import shutil
 import json
+import hashlib
+import argparse
+import threading
 from git import Repo
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import subprocess
@@ -19,6 +24,22 @@ import subprocess
 KEYS_FILE = "keys.json"
 MODELS_FILE = "models.json"
 
+# Bare mirrors and LFS objects live outside research/ so they survive redeploys
+SCRATCH_ROOT = os.environ.get("SCRATCH_ROOT", "/scratch/gilbreth/ochaturv")
+MIRROR_ROOT = os.environ.get("GIT_MIRROR_ROOT", os.path.join(SCRATCH_ROOT, "git_mirrors"))
+LFS_STORE = os.path.join(MIRROR_ROOT, "lfs")
+
+# Gilbreth-path copies: weights are never written by the models, so they can be shared
+WEIGHT_EXTENSIONS = {".pt", ".pth", ".ckpt", ".h5", ".hdf5", ".bin", ".onnx", ".safetensors", ".pb", ".npz", ".npy", ".tflite"}
+COPY_WORKERS = 8
+FICLONE = 0x40049409  # Linux ioctl that makes dst a copy-on-write clone of src
+
+# Content-addressed weight store: checkouts hardlink to one blob per unique weight file
+WEIGHT_STORE = os.environ.get("WEIGHT_STORE", os.path.join(SCRATCH_ROOT, "weight_store"))
+LARGE_FILE_BYTES = 50 * 1024 * 1024  # Other files this large are treated as weights too
+_store_lock = threading.Lock()
+_store_index = None  # {"dev:inode:size:mtime_ns": sha256} so files already linked to a blob are not hashed again
+
 
 def load_json(path):
     if not os.path.exists(path):
@@ -33,7 +54,268 @@ def load_json(path):
         return None
 
 
-def clone_repo(entry):
+def reflink(src, dst):
+    """Clone src to dst as copy-on-write extents; raises OSError where the filesystem cannot."""
+    with open(src, "rb") as source, open(dst, "wb") as target:
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError:
+            target.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def place_file(src, dst, mode):
+    """
+    Put one file at dst and return how: reflinked where the filesystem allows,
+    hardlinked for weights in link mode, otherwise copied.
+    """
+    if mode == "link":
+        try:
+            reflink(src, dst)
+            return "reflinked"
+        except OSError:
+            pass
+        if os.path.splitext(src)[1].lower() in WEIGHT_EXTENSIONS:
+            try:
+                os.link(src, dst)
+                return "hardlinked"
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+    shutil.copy2(src, dst)
+    return "copied"
+
+
+def copy_checkout(src_root, dst_root, mode="link", workers=COPY_WORKERS):
+    """
+    Recreate src_root at dst_root with files placed in parallel by place_file,
+    largest first. Returns {method: [files, bytes]} plus the elapsed seconds.
+    """
+    start = time.time()
+    files = []
+    for dirpath, dirnames, filenames in os.walk(src_root):
+        target_dir = os.path.join(dst_root, os.path.relpath(dirpath, src_root))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in dirnames + filenames:
+            src = os.path.join(dirpath, name)
+            dst = os.path.join(target_dir, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+                if name in dirnames:
+                    dirnames.remove(name)  # Do not walk into linked directories
+            elif name in filenames:
+                files.append((os.path.getsize(src), src, dst))
+
+    report = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(place_file, src, dst, mode): size for size, src, dst in sorted(files, reverse=True)}
+        for future in as_completed(futures):
+            method = future.result()
+            counts = report.setdefault(method, [0, 0])
+            counts[0] += 1
+            counts[1] += futures[future]
+    return report, time.time() - start
+
+
+def blob_path(digest):
+    return os.path.join(WEIGHT_STORE, "sha256", digest[:2], digest)
+
+
+def load_store_index():
+    global _store_index
+    index_path = os.path.join(WEIGHT_STORE, "index.json")
+    if _store_index is None:
+        _store_index = {}
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                _store_index = json.load(f)
+    return _store_index
+
+
+def index_key(stat):
+    """Index key of a file; size and mtime make in-place edits miss instead of reusing a stale digest."""
+    return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def save_store_index():
+    if _store_index is None:
+        return
+    os.makedirs(WEIGHT_STORE, exist_ok=True)
+    index_path = os.path.join(WEIGHT_STORE, "index.json")
+    with _store_lock:
+        # Drop inodes whose blob is gone (collected or replaced)
+        live = {key: digest for key, digest in _store_index.items() if os.path.exists(blob_path(digest))}
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(live, f)
+    os.replace(index_path + ".tmp", index_path)
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(8 * 1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def lfs_oids(checkout_path):
+    """
+    {relative path: (sha256, size)} of a git checkout's checked-out LFS files;
+    LFS object IDs are content SHA-256s. Files still holding their pointer are
+    left out, as is everything when git-lfs is too old for --json.
+    """
+    if not os.path.isdir(os.path.join(checkout_path, ".git")):
+        return {}
+    result = subprocess.run(
+        ["git", "lfs", "ls-files", "--json"], cwd=checkout_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    try:
+        entries = json.loads(result.stdout.decode()).get("files") or []
+    except ValueError:
+        return {}
+    return {
+        entry["name"]: (entry["oid"], entry["size"])
+        for entry in entries
+        if entry.get("checkout") and entry.get("oid_type", "sha256") == "sha256"
+    }
+
+
+def is_weight(path, size):
+    return os.path.splitext(path)[1].lower() in WEIGHT_EXTENSIONS or size >= LARGE_FILE_BYTES
+
+
+def intern_weights(checkout_path, external_root=None):
+    """
+    Replace every weight file in a checkout with a hardlink to its blob in the
+    store, adding blobs for content not seen before. Returns (files, bytes in
+    checkout, bytes newly stored).
+
+    A file that is still the inode of its original under `external_root` (a
+    Gilbreth path copied by copy_checkout in link mode) never becomes a blob,
+    so the store does not own files outside it; it is only relinked when the
+    store already holds its content.
+    """
+    index = load_store_index()
+    oids = lfs_oids(checkout_path)
+    files = checkout_bytes = stored_bytes = 0
+
+    for dirpath, dirnames, filenames in os.walk(checkout_path):
+        if ".git" in dirnames:
+            dirnames.remove(".git")
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                continue
+            stat = os.stat(path)
+            if not is_weight(path, stat.st_size):
+                continue
+
+            relative = os.path.relpath(path, checkout_path)
+            key = index_key(stat)
+            oid, lfs_size = oids.get(relative, (None, None))
+            if lfs_size != stat.st_size:
+                oid = None  # A pointer or partial download must not be stored under the object's ID
+            digest = oid or index.get(key) or sha256_file(path)
+            blob = blob_path(digest)
+            files += 1
+            checkout_bytes += stat.st_size
+
+            with _store_lock:
+                try:
+                    if not os.path.exists(blob):
+                        external = os.path.join(external_root, relative) if external_root else ""
+                        if stat.st_nlink > 1 and os.path.isfile(external) and os.path.samefile(path, external):
+                            continue  # Stays shared with the original, as copy_checkout linked it
+                        # The checkout's file becomes the blob; no data is moved
+                        os.makedirs(os.path.dirname(blob), exist_ok=True)
+                        os.link(path, blob + ".tmp")
+                        os.replace(blob + ".tmp", blob)
+                        stored_bytes += stat.st_size
+                    if not os.path.samefile(path, blob):
+                        os.link(blob, path + ".tmp")
+                        os.replace(path + ".tmp", path)
+                except OSError as e:
+                    # Usually a checkout on another filesystem than the store
+                    print(f"\t- Could not link {path} to the weight store: {e}")
+                    continue
+                index[key] = digest
+                index[index_key(os.stat(blob))] = digest
+
+    return files, checkout_bytes, stored_bytes
+
+
+def collect_garbage():
+    """Delete blobs no checkout links to any more (link count 1) and report what was freed."""
+    freed_files = freed_bytes = kept_bytes = 0
+    for dirpath, _, filenames in os.walk(os.path.join(WEIGHT_STORE, "sha256")):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            stat = os.stat(path)
+            if stat.st_nlink == 1:
+                os.remove(path)
+                freed_files += 1
+                freed_bytes += stat.st_size
+            else:
+                kept_bytes += stat.st_size
+    load_store_index()
+    save_store_index()
+    print(f"Removed {freed_files} unused blobs ({freed_bytes / 1e9:.2f} GB), {kept_bytes / 1e9:.2f} GB still in use")
+
+
+def update_mirror(safe_name, remote_url):
+    """
+    Create or update the bare mirror of a repo, then fetch the LFS objects its
+    HEAD needs into the shared store. Unchanged repos only cost a ref check.
+    """
+    mirror_path = os.path.join(MIRROR_ROOT, f"{safe_name}.git")
+    if os.path.isdir(mirror_path):
+        mirror = Repo(mirror_path)
+        mirror.remotes.origin.set_url(remote_url)  # Tokens rotate
+        mirror.git.fetch("origin", prune=True)
+    else:
+        os.makedirs(MIRROR_ROOT, exist_ok=True)
+        Repo.clone_from(remote_url, mirror_path, mirror=True)
+
+    subprocess.run(
+        ["git", "-c", f"lfs.storage={LFS_STORE}", "lfs", "fetch", "origin", "HEAD"],
+        cwd=mirror_path,
+        check=True,
+    )
+    return mirror_path
+
+
+def checkout_from_mirror(mirror_path, local_path, remote_url):
+    """
+    Make a shallow local clone of the mirror and fill its LFS files from the
+    shared store, with origin pointing upstream for later `git lfs pull`s.
+    """
+    Repo.clone_from(
+        f"file://{os.path.abspath(mirror_path)}",
+        local_path,
+        depth=1,
+        env={**os.environ, "GIT_LFS_SKIP_SMUDGE": "1"},  # Smudging would download from the file:// remote
+    )
+    checkout = Repo(local_path)
+    with checkout.config_writer() as config:
+        config.set_value("lfs", "storage", LFS_STORE)
+    checkout.remotes.origin.set_url(remote_url)
+    subprocess.run(["git", "lfs", "checkout"], cwd=local_path, check=True)
+
+
+def store_weights(model_name, local_path, external_root=None):
+    """Intern a checkout's weights, printing how much was deduplicated."""
+    start = time.time()
+    files, checkout_bytes, stored_bytes = intern_weights(local_path, external_root)
+    if files:
+        print(
+            f"Weight store for {model_name}: {files} files, {checkout_bytes / 1e9:.2f} GB linked, "
+            f"{stored_bytes / 1e9:.2f} GB new, in {time.time() - start:.1f} seconds"
+        )
+
+
+def clone_repo(entry, copy_mode="link", use_store=True):
     model_name, github_url, username, token, gilbreth_path = entry
     safe_name = model_name.replace("/", "_")
     github_link = github_url.replace("https://", "")
@@ -46,8 +328,16 @@ def clone_repo(entry):
     # If the Gilbreth path exists, copy it instead of cloning
     if gilbreth_path and os.path.exists(gilbreth_path):
         try:
-            print(f"Copying: {gilbreth_path} to {local_path}")
-            shutil.copytree(gilbreth_path, local_path)
+            print(f"Copying: {gilbreth_path} to {local_path} ({copy_mode} mode)")
+            if os.path.exists(local_path):
+                shutil.rmtree(local_path)
+            report, seconds = copy_checkout(gilbreth_path, local_path, copy_mode)
+            summary = ", ".join(
+                f"{method} {count} files ({size / 1e9:.2f} GB)" for method, (count, size) in sorted(report.items())
+            )
+            print(f"Copied {model_name} in {seconds:.1f} seconds: {summary}")
+            if use_store:
+                store_weights(model_name, local_path, gilbreth_path)
             return (model_name, True, None)
         except Exception as e:
             return (
@@ -61,16 +351,21 @@ def clone_repo(entry):
         shutil.rmtree(local_path)
 
     try:
-        print(f"Cloning: {github_link} to {local_path}")
-        Repo.clone_from(f"https://{username}:{token}@{github_link}", local_path)
-
         subprocess.run(
             ["git", "lfs", "install"],
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
             check=True,
         )
-        subprocess.run(["git", "lfs", "pull"], cwd=local_path, check=True)
+        remote_url = f"https://{username}:{token}@{github_link}"
+
+        print(f"Updating mirror: {github_link}")
+        mirror_path = update_mirror(safe_name, remote_url)
+
+        print(f"Checking out: {mirror_path} to {local_path}")
+        checkout_from_mirror(mirror_path, local_path, remote_url)
+        if use_store:
+            store_weights(model_name, local_path)
 
         return (model_name, True, None)
     except Exception as e:
@@ -79,6 +374,29 @@ def clone_repo(entry):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Clone or copy model repositories listed in models.json.")
+    parser.add_argument(
+        "--copy-mode",
+        choices=["link", "copy"],
+        default="link",
+        help="How to copy Gilbreth-path checkouts: link shares weights via reflinks/hardlinks, copy duplicates every byte",
+    )
+    parser.add_argument(
+        "--no-weight-store",
+        action="store_true",
+        help="Leave weight files in each checkout instead of linking them to the shared store",
+    )
+    parser.add_argument(
+        "--gc",
+        action="store_true",
+        help="Only remove weight-store blobs that no checkout links to, then exit",
+    )
+    args = parser.parse_args()
+
+    if args.gc:
+        collect_garbage()
+        return
+
     start_time = time.time()
 
     keys_data = load_json(KEYS_FILE)
@@ -112,13 +430,16 @@ def main():
     successful_names = set()
 
     with ThreadPoolExecutor() as executor:
-        futures = [executor.submit(clone_repo, row) for row in entries_to_clone]
+        futures = [
+            executor.submit(clone_repo, row, args.copy_mode, not args.no_weight_store) for row in entries_to_clone
+        ]
         for future in as_completed(futures):
             model_name, success, error = future.result()
             if success:
                 successful_names.add(model_name)
             else:
                 print(f"Failed to clone for {model_name}: {error}")
+    save_store_index()
 
     # Save only the successful models back into models.json (preserve original order)
     for name in desired_models:
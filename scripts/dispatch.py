@@ -0,0 +1,216 @@
+#!/opt/homebrew/bin/python3
+"""
+Name: dispatch.py
+Purpose: Split run.py's job plan between clusters (Gilbreth, Anvil) by queue backlog and pull each share's results back
+"""
+
+__author__ = "Ojas Chaturvedi"
+__github__ = "github.com/ojas-chaturvedi"
+__license__ = "MIT"
+
+import os
+import json
+import socket
+import argparse
+import subprocess
+from scheduler import SlurmScheduler
+
+CLUSTERS_FILE = "clusters.json"
+SHARES_FILE = "cluster_shares.json"
+STAGING_DIR = "clusters"  # Rewritten chunk lists for remote clusters, mirrored to their research dirs
+
+
+def load_clusters(path=CLUSTERS_FILE):
+    """Return {name: profile} from clusters.json (same header-row layout as models.json)."""
+    with open(path, "r") as f:
+        rows = json.load(f)["values"][1:]
+
+    clusters = {}
+    for name, hostname, username, scratch_root, account, utility_account, partition, data_root in rows:
+        clusters[name] = {
+            "name": name,
+            "hostname": hostname,
+            "username": username,
+            "scratch_root": scratch_root,
+            "research_dir": f"{scratch_root}/research",
+            "account": account,
+            "utility_account": utility_account or account,
+            "partition": partition,
+            "data_root": data_root,
+        }
+    return clusters
+
+
+def home_cluster(clusters):
+    """The profile of the cluster this process runs on, matched by hostname, or None."""
+    host = socket.getfqdn()
+    return next((profile for profile in clusters.values() if profile["name"] in host), None)
+
+
+def cluster_scheduler(profile, home):
+    """SLURM scheduler for a cluster: direct on the home cluster, over ssh elsewhere."""
+    if home and profile["name"] == home["name"]:
+        return SlurmScheduler()
+    return SlurmScheduler(profile["hostname"], profile["research_dir"], profile["username"])
+
+
+def assign_groups(plan, backlogs):
+    """
+    Assign each (model, dataset) group of a plan to a cluster, largest first, to
+    whichever cluster's backlog plus already assigned jobs is smallest. Keeping a
+    group together means its upload job sees all of its outputs.
+    """
+    sizes = {}
+    for job in plan:
+        if job["group"] is not None:
+            sizes[job["group"]] = sizes.get(job["group"], 0) + 1
+
+    load = {name: depth for name, depth in backlogs.items() if depth != float("inf")}
+    if not load:
+        return {}
+
+    assignment = {}
+    for group in sorted(sizes, key=lambda g: -sizes[g]):
+        name = min(load, key=lambda n: (load[n], n))
+        assignment[group] = name
+        load[name] += sizes[group]
+    return assignment
+
+
+def _replace_flag(command, flag, value):
+    """Set `flag value` (or `flag=value` for long flags) on an sbatch command, removing it when value is None."""
+    args = command[1:]
+    if flag.startswith("--"):
+        args = [arg for arg in args if not arg.startswith(flag + "=")]
+        added = [f"{flag}={value}"] if value else []
+    else:
+        cleaned = []
+        skip = False
+        for arg in args:
+            if skip:
+                skip = False
+            elif arg == flag:
+                skip = True
+            else:
+                cleaned.append(arg)
+        args = cleaned
+        added = [flag, value] if value else []
+    return command[:1] + added + args
+
+
+def _with_export(command, name, value):
+    """Add NAME=value to an sbatch command's --export, creating --export=ALL if it has none."""
+    for i, arg in enumerate(command):
+        if arg.startswith("--export="):
+            return command[:i] + [f"{arg},{name}={value}"] + command[i + 1 :]
+    return command[:1] + [f"--export=ALL,{name}={value}"] + command[1:]
+
+
+def localize_plan(plan, profile, home):
+    """
+    Copy a plan's jobs for one cluster: set its account, partition and
+    SCRATCH_ROOT, and on a remote cluster point research and data paths at its
+    scratch and data roots, writing rewritten chunk lists under clusters/{name}/.
+    """
+    remote = home is None or profile["name"] != home["name"]
+    research_dir = os.getcwd()
+    home_data_root = home["data_root"] if home else None
+
+    def rewrite(path):
+        if remote and path.startswith(research_dir + os.sep):
+            return profile["research_dir"] + path[len(research_dir) :]
+        if remote and home_data_root and path.startswith(home_data_root):
+            return profile["data_root"] + path[len(home_data_root) :]
+        return path
+
+    localized = []
+    for job in plan:
+        command = list(job["command"])
+        if job["kind"] in ("chunk", "pack"):
+            command = _replace_flag(command, "-A", profile["account"])
+            if profile["partition"]:
+                command = _replace_flag(command, "--partition", profile["partition"])
+        else:
+            command = _replace_flag(command, "-A", profile["utility_account"])
+        command = _with_export(command, "SCRATCH_ROOT", profile["scratch_root"])
+
+        if remote:
+            for arg in command:
+                if arg.startswith(research_dir + os.sep) and arg.endswith((".txt", ".tsv")) and os.path.isfile(arg):
+                    stage_chunk_list(arg, profile, rewrite)
+            command = [rewrite(arg) for arg in command]
+        localized.append({**job, "command": command, "cluster": profile["name"]})
+    return localized
+
+
+def stage_chunk_list(path, profile, rewrite):
+    """Write a chunk list (or packed manifest) with remote paths under clusters/{name}/ for syncing."""
+    target = os.path.join(STAGING_DIR, profile["name"], os.path.relpath(path))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(path, "r") as source, open(target, "w") as f:
+        for line in source:
+            f.write("\t".join(rewrite(field) for field in line.rstrip("\n").split("\t")) + "\n")
+
+
+def sync_cluster(profile):
+    """Mirror clusters/{name}/ (chunk lists) into the cluster's research directory."""
+    staged = os.path.join(STAGING_DIR, profile["name"])
+    if not os.path.isdir(staged):
+        return True
+    target = f"{profile['username']}@{profile['hostname']}:{profile['research_dir']}/"
+    result = subprocess.run(["rsync", "-a", staged + "/", target], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        print(f"\t- Could not sync chunk lists to {profile['name']}: {result.stderr.decode().strip()}")
+    return result.returncode == 0
+
+
+def save_shares(shares, path=SHARES_FILE):
+    with open(path, "w") as f:
+        json.dump(shares, f, indent=2)
+
+
+def load_shares(path=SHARES_FILE):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def pull_results(shares, clusters, home):
+    """
+    Copy details files and chunk logs for every (model, dataset) that ran on a
+    remote cluster back into this research directory, so telemetry.py and
+    staged rankings see the whole sweep.
+    """
+    for name, share in shares.items():
+        profile = clusters[name]
+        if home and name == home["name"]:
+            continue
+        source = f"{profile['username']}@{profile['hostname']}:{profile['research_dir']}"
+        for model_name, dataset_name in share["groups"]:
+            dataset_file = dataset_name.replace(" ", "_")
+            os.makedirs(os.path.join(model_name, "research_output"), exist_ok=True)
+            for remote_path, local_dir in (
+                (f"{model_name}/details_{dataset_file}.txt", model_name),
+                (f"{model_name}/research_output/{dataset_name}_chunk*_slurm_output.txt", f"{model_name}/research_output"),
+            ):
+                result = subprocess.run(
+                    ["rsync", "-a", f"{source}/{remote_path}", local_dir + "/"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+                if result.returncode != 0:
+                    print(f"\t- Could not pull {remote_path} from {name}: {result.stderr.decode().strip()}")
+        print(f"Pulled {len(share['groups'])} model/dataset results from {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pull results of a multi-cluster run back to this cluster.")
+    parser.add_argument("--clusters-file", default=CLUSTERS_FILE)
+    parser.add_argument("--shares-file", default=SHARES_FILE)
+    args = parser.parse_args()
+
+    clusters = load_clusters(args.clusters_file)
+    pull_results(load_shares(args.shares_file), clusters, home_cluster(clusters))
+
+
+if __name__ == "__main__":
+    main()
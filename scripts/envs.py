@@ -0,0 +1,218 @@
+#!/opt/homebrew/bin/python3
+"""
+Name: envs.py
+Purpose: Build conda environments once per dependency hash as packed archives and unpack them to node-local scratch
+"""
+
+__author__ = "Ojas Chaturvedi"
+__github__ = "github.com/ojas-chaturvedi"
+__license__ = "MIT"
+
+import os
+import sys
+import time
+import fcntl
+import shutil
+import getpass
+import hashlib
+import tarfile
+import argparse
+import platform
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+
+SCRATCH_ROOT = os.environ.get("SCRATCH_ROOT", "/scratch/gilbreth/ochaturv")
+# Packed archives live outside .conda/, which main.sh wipes on every deploy
+ENV_CACHE = os.environ.get("ENV_CACHE", os.path.join(SCRATCH_ROOT, "env_cache"))
+LOCAL_ROOT = os.environ.get("ENV_LOCAL_ROOT") or os.path.join(
+    tempfile.gettempdir(), f"conda_envs_{os.environ.get('USER') or getpass.getuser()}"
+)
+BUILD_ATTEMPTS = 3
+PACKAGE_SERVER = "https://repo.anaconda.com"  # Checked before a build; unpacking a cached archive needs no network
+
+# Shared environments used by the job scripts: name -> (packages, post-build shell command)
+SPECS = {
+    "scoring-env": (
+        ["python=3.10", "pip", "setuptools", "mir_eval", "pretty_midi", "numpy=1.23", "pyyaml"],
+        "sed -i '22s/MAX_TICK = 1e7/MAX_TICK = 1e8/' "
+        '"$ENV_PREFIX/lib/python3.10/site-packages/pretty_midi/pretty_midi.py"',
+    ),
+    "upload-env": (["python=3.10", "pip", "pydrive2"], None),
+    "audio-cache": (["python=3.10", "numpy", "scipy", "pysoundfile"], None),
+    "analysis": (["python=3.10", "pip", "mido", "tqdm", "pandas"], None),
+}
+
+
+def log(message):
+    # stdout carries only the environment prefix, for `conda activate "$(python envs.py NAME)"`
+    print(message, file=sys.stderr)
+
+
+def spec_hash(packages=None, env_file=None, post=None):
+    """Short SHA-256 of everything that decides an environment's contents."""
+    digest = hashlib.sha256()
+    digest.update(f"{platform.system()}-{platform.machine()}\n".encode())
+    if env_file:
+        with open(env_file, "rb") as f:
+            digest.update(f.read())
+    for package in sorted(packages or []):
+        digest.update(f"{package}\n".encode())
+    digest.update((post or "").encode())
+    return digest.hexdigest()[:16]
+
+
+def locked(path):
+    """Open and exclusively flock a lock file; close the returned handle to release it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle = open(path, "w")
+    fcntl.flock(handle, fcntl.LOCK_EX)
+    return handle
+
+
+def has_internet(url=PACKAGE_SERVER, timeout=10):
+    """Whether conda's package server answers a HEAD request."""
+    try:
+        urllib.request.urlopen(urllib.request.Request(url, method="HEAD"), timeout=timeout)
+    except (urllib.error.URLError, OSError):
+        return False
+    return True
+
+
+def conda_tool():
+    return shutil.which("mamba") or shutil.which("conda")
+
+
+def conda_pack_tool():
+    """Path to conda-pack, installing it into a small tools environment in the cache if needed."""
+    found = shutil.which("conda-pack")
+    if found:
+        return found
+    tools = os.path.join(ENV_CACHE, "tools")
+    tool = os.path.join(tools, "bin", "conda-pack")
+    if not os.path.exists(tool):
+        subprocess.run(
+            [conda_tool(), "create", "-y", "-q", "--prefix", tools, "-c", "conda-forge", "conda-pack"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+    return tool
+
+
+def create_env(prefix, packages=None, env_file=None, post=None):
+    """Create an environment at `prefix` with isolated package caches, retrying transient failures."""
+    if env_file:
+        command = [conda_tool(), "env", "create", "-q", "-f", env_file, "--prefix", prefix]
+    else:
+        command = [conda_tool(), "create", "-y", "-q", "--prefix", prefix] + list(packages)
+
+    pkgs_dir = prefix + "_pkgs"
+    env = {**os.environ, "CONDA_PKGS_DIRS": pkgs_dir, "PIP_NO_CACHE_DIR": "true", "ENV_PREFIX": prefix}
+    try:
+        for attempt in range(1, BUILD_ATTEMPTS + 1):
+            shutil.rmtree(prefix, ignore_errors=True)
+            result = subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if result.returncode == 0:
+                break
+            log(f"\t- Creating {prefix} failed (attempt {attempt}/{BUILD_ATTEMPTS}): {result.stderr.decode()[-2000:]}")
+            if attempt == BUILD_ATTEMPTS:
+                raise RuntimeError(f"Could not create {prefix}")
+            time.sleep(5 * attempt)
+        if post:
+            subprocess.run(post, shell=True, check=True, env=env, stdout=sys.stderr)
+    finally:
+        shutil.rmtree(pkgs_dir, ignore_errors=True)
+
+
+def build_archive(name, key, packages=None, env_file=None, post=None):
+    """
+    Return the packed archive for a spec, building it first if no job has. The
+    build runs under a lock so concurrent jobs wait for one build instead of
+    each creating the environment.
+    """
+    archive = os.path.join(ENV_CACHE, f"{name}-{key}.tar")
+    if os.path.exists(archive):
+        return archive
+
+    lock = locked(archive + ".lock")
+    try:
+        if os.path.exists(archive):
+            return archive
+        if not has_internet():
+            raise RuntimeError(f"No internet access to build {name} ({key}) and no cached archive")
+        start = time.time()
+        build_prefix = os.path.join(ENV_CACHE, "build", f"{name}-{key}")
+        log(f"Building {name} ({key})")
+        create_env(build_prefix, packages, env_file, post)
+        subprocess.run(
+            [conda_pack_tool(), "-q", "-p", build_prefix, "-o", archive + ".tmp", "--format", "tar", "--force"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        os.replace(archive + ".tmp", archive)
+        shutil.rmtree(build_prefix, ignore_errors=True)
+        log(f"Packed {name} into {archive} in {time.time() - start:.1f} seconds")
+    finally:
+        lock.close()
+    return archive
+
+
+def unpack(archive, name, key):
+    """Unpack an archive into node-local scratch once per node and fix its prefixes; return the prefix."""
+    prefix = os.path.join(LOCAL_ROOT, f"{name}-{key}")
+    ready = os.path.join(prefix, ".unpacked")
+    if os.path.exists(ready):
+        return prefix
+
+    lock = locked(prefix + ".lock")
+    try:
+        if os.path.exists(ready):
+            return prefix
+        start = time.time()
+        shutil.rmtree(prefix, ignore_errors=True)
+        with tarfile.open(archive) as tar:
+            # The data filter (Python 3.12+, and backported security releases) refuses members outside the prefix
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(prefix, filter="data")
+            else:
+                tar.extractall(prefix)
+        # conda-pack's script rewrites the build prefix baked into scripts and shebangs
+        subprocess.run([os.path.join(prefix, "bin", "conda-unpack")], check=True, stdout=sys.stderr)
+        open(ready, "w").close()
+        log(f"Unpacked {name} to {prefix} in {time.time() - start:.1f} seconds")
+    finally:
+        lock.close()
+    return prefix
+
+
+def ensure_env(name, packages=None, env_file=None, post=None):
+    """Prefix of a ready-to-activate environment for a spec, building and unpacking only what is missing."""
+    if not packages and not env_file:
+        if name not in SPECS:
+            raise ValueError(f"No packages given and no shared spec named '{name}'")
+        packages, post = SPECS[name]
+    key = spec_hash(packages, env_file, post)
+    return unpack(build_archive(name, key, packages, env_file, post), name, key)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print the prefix of a cached conda environment, building and unpacking it if needed."
+    )
+    parser.add_argument("name", help="Environment name; a shared spec from SPECS when no packages are given")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--packages", nargs="+", help="conda packages to install")
+    source.add_argument("--file", help="environment.yml to create the environment from")
+    parser.add_argument("--post", help="Shell command run after creation, with $ENV_PREFIX set")
+    args = parser.parse_args()
+
+    try:
+        print(ensure_env(args.name, args.packages, args.file, args.post))
+    except (OSError, ValueError, RuntimeError, subprocess.CalledProcessError) as e:
+        log(f"Could not prepare environment {args.name}: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -30,18 +30,22 @@ module load parallel
 module load gcc
 source "$(conda info --base)/etc/profile.d/conda.sh"
 
+# Cluster scratch space, e.g. /anvil/scratch/x-ochaturvedi on Anvil (see clusters.json)
+SCRATCH_ROOT="${SCRATCH_ROOT:-/scratch/gilbreth/ochaturv}"
+export SCRATCH_ROOT
+
 export JOBS="${SLURM_CPUS_PER_TASK:-${SLURM_CPUS_ON_NODE:-$(getconf _NPROCESSORS_ONLN)}}"
 export PARALLEL="--will-cite"
 
 task_time=$(date +%s.%N)
-rm -rf /scratch/gilbreth/ochaturv/.conda/
+rm -rf "$SCRATCH_ROOT/.conda/"
 echo "Cleaned conda directory in $(echo "$(date +%s.%N) - $task_time" | bc) seconds"
 
 echo "--------------------------------------------------"
 echo "Verifying dataset .wav counts match datasets.json"
 task_time=$(date +%s.%N)
 
-DATASET_JSON="/scratch/gilbreth/ochaturv/research/datasets.json"
+DATASET_JSON="$SCRATCH_ROOT/research/datasets.json"
 MISMATCHES=0
 
 mapfile -t datasets < <(jq -r '.values[1:][] | @tsv' "$DATASET_JSON")
@@ -50,7 +54,9 @@ mapfile -t datasets < <(jq -r '.values[1:][] | @tsv' "$DATASET_JSON")
 printf '%s\n' "${datasets[@]}" | parallel -j "$JOBS" --colsep '\t' '
     name={1}; path={2};
     echo "Regenerating list for: {1}";
-    find "$(realpath "$path")" -type f -name "*.wav" | sort > "${path}.txt"
+    find "$(realpath "$path")" -type f -name "*.wav" | sort > "${path}.txt.new";
+    # Only replace a list whose contents changed, so its mtime and the manifest built from it stay valid
+    if cmp -s "${path}.txt.new" "${path}.txt"; then rm -f "${path}.txt.new"; else mv "${path}.txt.new" "${path}.txt"; fi
 '
 
 # Check counts in parallel
@@ -85,34 +91,31 @@ echo "--------------------------------------------------"
 echo "Creating default conda environment with mamba"
 task_time=$(date +%s.%N)
 
-export CONDA_PKGS_DIRS=/scratch/gilbreth/ochaturv/.conda/pkgs_default
+export CONDA_PKGS_DIRS=$SCRATCH_ROOT/.conda/pkgs_default
 mkdir -p "$CONDA_PKGS_DIRS"
-conda create -y -q --prefix /scratch/gilbreth/ochaturv/.conda/envs/default-env python=3.12 >/dev/null
-conda activate /scratch/gilbreth/ochaturv/.conda/envs/default-env
+conda create -y -q --prefix $SCRATCH_ROOT/.conda/envs/default-env python=3.12 >/dev/null
+conda activate $SCRATCH_ROOT/.conda/envs/default-env
 conda install -y -q -c conda-forge mamba >/dev/null
 rm -rf "$CONDA_PKGS_DIRS"
 echo "Default conda environment created in $(echo "$(date +%s.%N) - $task_time" | bc) seconds"
 
 echo "--------------------------------------------------"
-echo "Creating shared conda environments for scoring and Google Drive upload"
+echo "Building dataset manifests from WAV headers"
 task_time=$(date +%s.%N)
 
-export CONDA_PKGS_DIRS=/scratch/gilbreth/ochaturv/.conda/pkgs_scoring
-mkdir -p "$CONDA_PKGS_DIRS"
-mamba create -y -q --prefix /scratch/gilbreth/ochaturv/.conda/envs/scoring-env python=3.10 pip setuptools mir_eval pretty_midi numpy=1.23 pyyaml >/dev/null
-sed -i '22s/MAX_TICK = 1e7/MAX_TICK = 1e8/' /scratch/gilbreth/ochaturv/.conda/envs/scoring-env/lib/python3.10/site-packages/pretty_midi/pretty_midi.py
-rm -rf "$CONDA_PKGS_DIRS"
+python manifest.py "$DATASET_JSON" --workers "$((JOBS * 4))"
+echo "Dataset manifests built in $(echo "$(date +%s.%N) - $task_time" | bc) seconds"
 
-export CONDA_PKGS_DIRS=/scratch/gilbreth/ochaturv/.conda/pkgs_upload
-mkdir -p "$CONDA_PKGS_DIRS"
-mamba create -y -q --prefix /scratch/gilbreth/ochaturv/.conda/envs/upload-env python=3.10 pip pydrive2 >/dev/null
-rm -rf "$CONDA_PKGS_DIRS"
+echo "--------------------------------------------------"
+echo "Creating shared conda environments for scoring and Google Drive upload"
+task_time=$(date +%s.%N)
 
-if [ ! -d "/scratch/gilbreth/ochaturv/.conda/envs/scoring-env" ]; then
+# Packed once per dependency hash into $SCRATCH_ROOT/env_cache (see envs.py); unchanged specs are reused
+if ! python envs.py scoring-env >/dev/null; then
     echo "Scoring environment failed to create. Skipping scoring."
     exit 1
 fi
-if [ ! -d "/scratch/gilbreth/ochaturv/.conda/envs/upload-env" ]; then
+if ! python envs.py upload-env >/dev/null; then
     echo "Upload environment failed to create. Skipping upload."
     exit 1
 fi
@@ -122,13 +125,13 @@ echo "--------------------------------------------------"
 echo "Running cloning for all model repositories"
 task_time=$(date +%s.%N)
 
-export CONDA_PKGS_DIRS=/scratch/gilbreth/ochaturv/.conda/pkgs_cloning
+export CONDA_PKGS_DIRS=$SCRATCH_ROOT/.conda/pkgs_cloning
 mkdir -p "$CONDA_PKGS_DIRS"
-mamba create -y -q --prefix /scratch/gilbreth/ochaturv/.conda/envs/cloning-env python=3.12 git-lfs pip requests gitpython >/dev/null
+mamba create -y -q --prefix $SCRATCH_ROOT/.conda/envs/cloning-env python=3.12 git-lfs pip requests gitpython >/dev/null
 rm -rf "$CONDA_PKGS_DIRS"
 
 conda deactivate
-conda activate /scratch/gilbreth/ochaturv/.conda/envs/cloning-env
+conda activate $SCRATCH_ROOT/.conda/envs/cloning-env
 pip install -q requests gitpython >/dev/null
 conda install -c conda-forge -y -q git-lfs >/dev/null
 git lfs install >/dev/null
@@ -143,37 +146,15 @@ task_time=$(date +%s.%N)
 
 mapfile -t MODEL_NAMES < <(jq -r '.values[1:][] | select(length>0) | .[0]' models.json | tr -d '\r' | sed "s/^'//;s/'$//")
 
-BASE_DIR="$(pwd)"
-export BASE_DIR
-
 echo "Extracted model names from JSON:"
 printf "'%s'\n" "${MODEL_NAMES[@]}"
 echo ""
 
-# Run git lfs pull in parallel for each directory
-printf '%s\0' "${MODEL_NAMES[@]}" \
-| parallel -0 -j "$JOBS" '
-    cd "$BASE_DIR" || exit 1
-    dir={}
-    if [[ -d "$dir" ]]; then
-        echo "[START] git lfs pull in: $dir"
-        if git -C "$dir" lfs pull; then
-            echo "[DONE ] $dir"
-        else
-            echo "[ERROR] git lfs pull failed in: $dir" >&2
-        fi
-    else
-        echo "[MISSING] Directory \"$dir\" does not exist." >&2
-        echo "[DEBUG] Looking for: $(printf %q "$dir")" >&2
-    fi
-'
-echo ""
-
 echo "Model parsing completed in $(echo "$(date +%s.%N) - $task_time" | bc) seconds"
 
 conda deactivate
-rm -rf /scratch/gilbreth/ochaturv/.conda/envs/cloning-env
-# conda activate /scratch/gilbreth/ochaturv/.conda/envs/default-env
+rm -rf "$SCRATCH_ROOT/.conda/envs/cloning-env"
+# conda activate $SCRATCH_ROOT/.conda/envs/default-env
 
 echo "--------------------------------------------------"
 echo "Making model conda environments"
@@ -183,46 +164,21 @@ make_env() {
     local MODEL_NAME_RAW="$1"
     MODEL_NAME=${MODEL_NAME_RAW// /_}
     ENV_NAME="running-env-${MODEL_NAME}"
-    ENV_PATH="/scratch/gilbreth/ochaturv/.conda/envs/$ENV_NAME"
-    PKGS_PATH="/scratch/gilbreth/ochaturv/.conda/pkgs_${ENV_NAME}_$$"
     MODEL_DIR="$MODEL_NAME_RAW"
 
-    echo "[INFO] PKGS_PATH: $PKGS_PATH"
     echo "[INFO] Creating conda env for $MODEL_NAME_RAW..."
 
-    # Isolate PKGS path
-    CONDA_PKGS_DIRS="$PKGS_PATH"
-    export CONDA_PKGS_DIRS
-    mkdir -p "$CONDA_PKGS_DIRS"
-
-    # Remove existing environment if it exists
-    if [ -d "$ENV_PATH" ]; then
-        conda env remove -y --prefix "$ENV_PATH" >/dev/null
-        rm -rf "$ENV_PATH"
-    fi
-
     # Check if environment.yml exists
     if [ ! -f "./$MODEL_DIR/environment.yml" ]; then
         echo "[SKIP] Missing environment.yml for $MODEL_DIR"
-        rm -rf "$PKGS_PATH"
         return
     fi
 
-    # Retry logic for mamba create
-    MAX_ATTEMPTS=3
-    for ((i=1; i<=MAX_ATTEMPTS; i++)); do
-        if mamba env create -q -f "./$MODEL_DIR/environment.yml" --prefix "$ENV_PATH" >/dev/null 2>"$ENV_PATH-create.log"; then
-            break
-        elif [[ $i -lt $MAX_ATTEMPTS ]]; then
-            echo "[WARN] Env creation failed for $MODEL_NAME_RAW — retrying ($i/$MAX_ATTEMPTS)..."
-            sleep $((RANDOM % 10 + 5))
-        else
-            echo "[ERROR] Failed to create environment for $MODEL_NAME_RAW after $MAX_ATTEMPTS attempts"
-            cat "$ENV_PATH-create.log"
-            rm -rf "$PKGS_PATH"
-            return
-        fi
-    done
+    # Built and packed only when environment.yml changed; run.sh unpacks the same archive (see envs.py)
+    if ! ENV_PATH=$(python envs.py "$ENV_NAME" --file "./$MODEL_DIR/environment.yml"); then
+        echo "[ERROR] Failed to create environment for $MODEL_NAME_RAW"
+        return
+    fi
 
     PYTHON_CMD="$ENV_PATH/bin/python"
 
@@ -251,8 +207,6 @@ make_env() {
         echo "[RESULT] $MODEL_NAME_RAW | Python: $PY_VER | No TF/PT detected | CUDA libraries installed"
     fi
 
-    conda clean --packages --tarballs --yes >/dev/null
-    rm -rf "$PKGS_PATH"
 }
 
 export -f make_env
@@ -292,7 +246,12 @@ task_time=$(date +%s.%N)
 #     fi
 # done
 
-python run.py
+# Clusters that only receive work from run.py --clusters elsewhere set SETUP_ONLY=1
+if [[ "${SETUP_ONLY:-0}" == "1" ]]; then
+    echo "SETUP_ONLY set, not submitting jobs from this cluster"
+else
+    python run.py
+fi
 
 job_count="UNKNOWN"
 if [ -f "jobs_submitted.txt" ]; then
@@ -0,0 +1,287 @@
+#!/opt/homebrew/bin/python3
+"""
+Name: manifest.py
+Purpose: Build per-dataset audio manifests (duration, format, size, hash, instrument count) from file headers
+"""
+
+__author__ = "Ojas Chaturvedi"
+__github__ = "github.com/ojas-chaturvedi"
+__license__ = "MIT"
+
+import os
+import csv
+import json
+import struct
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+DATASETS_FILE = "datasets.json"
+MANIFEST_SUFFIX = ".manifest.csv"
+MANIFEST_COLUMNS = [
+    "path",
+    "duration_seconds",
+    "sample_rate",
+    "channels",
+    "bytes",
+    "mtime_ns",
+    "content_hash",
+    "instruments",
+]
+HASH_BLOCK = 64 * 1024  # Bytes hashed from each end of the file by the quick hash
+
+
+def manifest_path_for(dataset_path):
+    """Manifest written next to the {dataset_path}.txt list."""
+    return f"{dataset_path}{MANIFEST_SUFFIX}"
+
+
+def read_wav_header(path):
+    """
+    Return (sample_rate, channels, duration_seconds) by walking the RIFF chunk
+    headers. Only the chunk headers and the fmt chunk are read, never the audio.
+    """
+    with open(path, "rb") as f:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff not in (b"RIFF", b"RF64") or wave != b"WAVE":
+            raise ValueError("not a RIFF/WAVE file")
+
+        sample_rate = channels = block_align = data_size = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                _, channels, sample_rate, _, block_align = struct.unpack("<HHIIH", fmt[:14])
+            elif chunk_id == b"ds64":
+                ds64 = f.read(chunk_size)
+                data_size = struct.unpack("<Q", ds64[8:16])[0]
+            elif chunk_id == b"data":
+                if data_size is None or chunk_size != 0xFFFFFFFF:
+                    data_size = chunk_size
+                break
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+                continue
+            if chunk_size & 1:
+                f.seek(1, os.SEEK_CUR)
+
+    if not sample_rate or not block_align or data_size is None:
+        raise ValueError("missing fmt or data chunk")
+    return sample_rate, channels, data_size / block_align / sample_rate
+
+
+def _read_varlen(data, i):
+    """Read a MIDI variable-length quantity at data[i]; return (value, next index)."""
+    value = 0
+    while True:
+        byte = data[i]
+        i += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, i
+
+
+def midi_instrument_count(path):
+    """
+    Count the MIDI channels that play notes in a reference file, as a proxy for
+    its number of instruments. Every track is scanned, so type 0 files (all parts
+    in one track) and type 1 files (one track per part) both work.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != b"MThd":
+        raise ValueError("not a MIDI file")
+
+    channels = set()
+    pos = 8 + struct.unpack(">I", data[4:8])[0]
+    try:
+        while pos + 8 <= len(data):
+            chunk_id, length = struct.unpack(">4sI", data[pos : pos + 8])
+            pos += 8
+            end = pos + length
+            i, status = pos, 0
+            while chunk_id == b"MTrk" and i < min(end, len(data)):
+                _, i = _read_varlen(data, i)  # Delta time
+                if data[i] & 0x80:
+                    status = data[i]
+                    i += 1
+                elif not status:
+                    raise ValueError("data byte without running status")
+
+                if status == 0xFF:  # Meta event
+                    length, i = _read_varlen(data, i + 1)
+                    i += length
+                    status = 0
+                elif status in (0xF0, 0xF7):  # SysEx
+                    length, i = _read_varlen(data, i)
+                    i += length
+                    status = 0
+                else:
+                    kind = status & 0xF0
+                    if kind == 0x90 and data[i + 1] > 0:
+                        channels.add(status & 0x0F)
+                    i += 1 if kind in (0xC0, 0xD0) else 2
+            pos = end
+    except IndexError:
+        raise ValueError("truncated MIDI file")
+    return len(channels)
+
+
+def reference_midi(path):
+    """Reference MIDI next to an audio file ({name}.mid or {name}.midi), or None."""
+    base = os.path.splitext(path)[0]
+    return next((base + ext for ext in (".mid", ".midi") if os.path.isfile(base + ext)), None)
+
+
+def content_hash(path, size, full=False):
+    """
+    SHA-256 of the whole file when `full`, otherwise of its size plus the first and
+    last HASH_BLOCK bytes, which is enough to notice re-rendered or truncated audio.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        if full:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+            return digest.hexdigest()
+
+        digest.update(str(size).encode())
+        digest.update(f.read(HASH_BLOCK))
+        if size > 2 * HASH_BLOCK:
+            f.seek(-HASH_BLOCK, os.SEEK_END)
+            digest.update(f.read(HASH_BLOCK))
+    return "quick:" + digest.hexdigest()
+
+
+def describe_file(path, full_hash=False, stat=None):
+    """Build one manifest row for an audio file."""
+    stat = stat or os.stat(path)
+    size = stat.st_size
+    try:
+        sample_rate, channels, duration = read_wav_header(path)
+    except (ValueError, struct.error) as e:
+        print(f"\t- Could not read header of {path}: {e}")
+        sample_rate, channels, duration = "", "", ""
+    else:
+        duration = round(duration, 4)
+
+    instruments = ""
+    reference = reference_midi(path)
+    if reference:
+        try:
+            instruments = midi_instrument_count(reference)
+        except (ValueError, struct.error) as e:
+            print(f"\t- Could not read reference MIDI {reference}: {e}")
+    return {
+        "path": path,
+        "duration_seconds": duration,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "bytes": size,
+        "mtime_ns": stat.st_mtime_ns,
+        "content_hash": content_hash(path, size, full_hash),
+        "instruments": instruments,
+    }
+
+
+def read_manifest_rows(manifest_path):
+    """Raw manifest rows by path, or {} if there is no manifest yet."""
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, "r", newline="") as f:
+        return {row["path"]: row for row in csv.DictReader(f)}
+
+
+def build_manifest(dataset_path, workers=32, full_hash=False):
+    """
+    Write {dataset_path}.manifest.csv for every file in the {dataset_path}.txt
+    list. Rows of files whose size and mtime are unchanged are reused, so only
+    new or modified files have their headers read and hashed, and an unchanged
+    manifest is not rewritten.
+    """
+    list_file = f"{dataset_path}.txt"
+    with open(list_file, "r") as f:
+        paths = [line.strip() for line in f if line.strip()]
+
+    manifest_path = manifest_path_for(dataset_path)
+    previous = read_manifest_rows(manifest_path)
+
+    def row_for(path):
+        stat = os.stat(path)
+        old = previous.get(path)
+        if old and old.get("mtime_ns") == str(stat.st_mtime_ns) and old["bytes"] == str(stat.st_size):
+            return old, False
+        return describe_file(path, full_hash, stat), True
+
+    # Header reads and stats are latency-bound on depot, so use many more threads than cores
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(row_for, paths))
+    rows = [row for row, _ in results]
+    described = sum(changed for _, changed in results)
+
+    if described or list(previous) != paths:
+        with open(manifest_path + ".tmp", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=MANIFEST_COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(manifest_path + ".tmp", manifest_path)
+    print(f"\t- {described} of {len(paths)} files read, the rest reused from {manifest_path}")
+    return manifest_path, rows
+
+
+def load_manifest(dataset_path):
+    """
+    Load a dataset manifest as a list of dicts with numeric fields converted, or
+    None if the manifest is missing or does not cover the same files as the list
+    file it describes.
+    """
+    manifest_path = manifest_path_for(dataset_path)
+    list_file = f"{dataset_path}.txt"
+    if not os.path.isfile(manifest_path):
+        return None
+
+    rows = []
+    with open(manifest_path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            row["duration_seconds"] = float(row["duration_seconds"]) if row["duration_seconds"] else None
+            row["sample_rate"] = int(row["sample_rate"]) if row["sample_rate"] else None
+            row["channels"] = int(row["channels"]) if row["channels"] else None
+            row["bytes"] = int(row["bytes"])
+            # Manifests written before the instruments or mtime_ns columns have no values there
+            row["mtime_ns"] = int(row["mtime_ns"]) if row.get("mtime_ns") else None
+            row["instruments"] = int(row["instruments"]) if row.get("instruments") else None
+            rows.append(row)
+
+    if os.path.isfile(list_file):
+        with open(list_file, "r") as f:
+            listed = {line.strip() for line in f if line.strip()}
+        if listed != {row["path"] for row in rows}:
+            print(f"\t- Manifest {manifest_path} does not match {list_file}, ignoring it.")
+            return None
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build audio manifests for every dataset.")
+    parser.add_argument("config", nargs="?", default=DATASETS_FILE, help="Path to datasets.json")
+    parser.add_argument("--workers", type=int, default=32, help="Parallel header readers")
+    parser.add_argument("--full-hash", action="store_true", help="Hash whole files instead of head and tail")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        dataset_rows = json.load(f)["values"][1:]
+
+    for dataset_name, dataset_path, *_ in dataset_rows:
+        if not os.path.isfile(f"{dataset_path}.txt"):
+            print(f"Missing file list: {dataset_path}.txt, skipping {dataset_name}.")
+            continue
+        manifest_path, rows = build_manifest(dataset_path, args.workers, args.full_hash)
+        hours = sum(float(r["duration_seconds"] or 0) for r in rows) / 3600  # Reused rows hold CSV strings
+        print(f"{dataset_name}: {len(rows)} files, {hours:.1f} h -> {manifest_path}")
+
+
+if __name__ == "__main__":
+    main()
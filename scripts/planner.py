@@ -0,0 +1,227 @@
+#!/opt/homebrew/bin/python3
+"""
+Name: planner.py
+Purpose: Predict job runtimes from history, set walltimes and order run.py's job plan shortest-expected-first
+"""
+
+__author__ = "Ojas Chaturvedi"
+__github__ = "github.com/ojas-chaturvedi"
+__license__ = "MIT"
+
+import os
+import csv
+import math
+import heapq
+
+TELEMETRY_DIR = "telemetry"
+DEFAULT_FILE_SECONDS = 60.0  # Per-file guess when a model has no runtime history at all
+
+# Walltime requests
+JOB_OVERHEAD_SECONDS = 900  # Module loads, conda activation and scoring per job
+WALLTIME_MARGIN = 0.5  # Requested walltime is the prediction plus this fraction
+WALLTIME_STEP = 900  # Round requests up to 15 minutes
+MIN_WALLTIME = 1800
+MAX_WALLTIME = 2 * 24 * 3600  # run.sh's #SBATCH --time
+PLAN_CONCURRENCY = 16  # Running jobs assumed by the --plan makespan when not throttled
+
+
+def load_runtime_history(telemetry_dir=TELEMETRY_DIR):
+    """
+    Summarize telemetry.py's files.csv into per-(model, dataset) and per-model
+    runtime statistics. Dataset names use underscores, as in details files.
+    """
+    history = {"pairs": {}, "models": {}}
+    files_path = os.path.join(telemetry_dir, "files.csv")
+    if not os.path.isfile(files_path):
+        return history
+
+    with open(files_path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            runtime = float(row["runtime_seconds"])
+            duration = float(row["duration_seconds"])
+            for stats in (
+                history["pairs"].setdefault((row["model"], row["dataset"]), _empty_stats()),
+                history["models"].setdefault(row["model"], _empty_stats()),
+            ):
+                stats["files"] += 1
+                stats["runtime"] += runtime
+                stats["audio"] += duration
+                stats["audio_sq"] += duration * duration
+                stats["cross"] += duration * runtime
+    return history
+
+
+def _empty_stats():
+    return {"files": 0, "runtime": 0.0, "audio": 0.0, "audio_sq": 0.0, "cross": 0.0}
+
+
+def fit_runtime(stats):
+    """
+    Least-squares fit of per-file runtime = intercept + slope * audio seconds,
+    or None without at least two files of different lengths.
+    """
+    if not stats or stats["files"] < 2:
+        return None
+    n = stats["files"]
+    variance = n * stats["audio_sq"] - stats["audio"] ** 2
+    if variance <= 1e-9 * max(n * stats["audio_sq"], 1.0):
+        return None
+    slope = (n * stats["cross"] - stats["audio"] * stats["runtime"]) / variance
+    intercept = (stats["runtime"] - slope * stats["audio"]) / n
+    return intercept, slope
+
+
+def predict_seconds(history, model_name, dataset_name, files, audio_seconds=None):
+    """
+    Predict transcription seconds for `files` files of a dataset. With known
+    audio length this uses the model's runtime regression on this dataset, then
+    across datasets; otherwise the per-file mean on this dataset, then across
+    datasets, then DEFAULT_FILE_SECONDS.
+    """
+    pair = history["pairs"].get((model_name, dataset_name.replace(" ", "_")))
+    model = history["models"].get(model_name)
+
+    if audio_seconds:
+        for stats in (pair, model):
+            fit = fit_runtime(stats)
+            if fit:
+                intercept, slope = fit
+                return max(files * intercept + slope * audio_seconds, 0.0)
+
+    for stats in (pair, model):
+        if stats and stats["files"]:
+            return files * stats["runtime"] / stats["files"]
+
+    return files * DEFAULT_FILE_SECONDS
+
+
+def estimate_job(job, history):
+    """Predicted seconds for a planned job from its work items (0 for uploads/notification)."""
+    return sum(
+        predict_seconds(history, item["model"], item["dataset"], item["files"], item["audio_seconds"])
+        for item in job.get("work", [])
+    )
+
+
+def model_workers(resources):
+    """Concurrent transcriptions in a job: one per GPU, or one per CPU for CPU-only models."""
+    return resources["gpus"] or resources["cpus"]
+
+
+def requested_walltime(seconds, margin=WALLTIME_MARGIN):
+    """Walltime to request for a predicted runtime: add the margin, round up, clamp."""
+    seconds = math.ceil(seconds * (1 + margin) / WALLTIME_STEP) * WALLTIME_STEP
+    return int(min(max(seconds, MIN_WALLTIME), MAX_WALLTIME))
+
+
+def format_walltime(seconds):
+    """Format seconds as SLURM's D-HH:MM:SS."""
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{days}-{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def estimate_plan(plan, history, margin=WALLTIME_MARGIN):
+    """
+    Set expected_seconds (summed per-file runtime) on every job, and
+    predicted_walltime on jobs that transcribe files. Their walltime (to request)
+    is only set when every model in the job has runtime history; otherwise it is
+    None and the job keeps run.sh's default.
+    """
+    for job in plan:
+        job["expected_seconds"] = estimate_job(job, history)
+        if job["work"] and job["resources"]:
+            workers = max(model_workers(job["resources"]), 1)
+            job["predicted_walltime"] = job["expected_seconds"] / workers + JOB_OVERHEAD_SECONDS
+            known = all(history["models"].get(item["model"]) for item in job["work"])
+            job["walltime"] = requested_walltime(job["predicted_walltime"], margin) if known else None
+    return plan
+
+
+def forecast_makespan(plan, concurrency):
+    """Hours until the last transcription job finishes with `concurrency` jobs running at once, in plan order."""
+    running = [0.0] * max(concurrency, 1)
+    finish = 0.0
+    for job in plan:
+        if "predicted_walltime" not in job:
+            continue
+        start = heapq.heappop(running)
+        end = start + job["predicted_walltime"]
+        heapq.heappush(running, end)
+        finish = max(finish, end)
+    return finish / 3600
+
+
+def plan_report(plan, concurrency):
+    """Print predicted and requested walltime per job, GPU/CPU-hours and makespan."""
+    print(f"\n{'Job':<50} {'Files':>6} {'Predicted':>12} {'Requested':>12} {'GPU-h':>8}")
+    gpu_hours = cpu_hours = 0.0
+    too_long = []
+    for job in plan:
+        if "predicted_walltime" not in job:
+            continue
+        hours = job["predicted_walltime"] / 3600
+        gpus = job["resources"]["gpus"]
+        gpu_hours += hours * gpus
+        cpu_hours += hours * job["resources"]["cpus"]
+        if job["predicted_walltime"] > MAX_WALLTIME:
+            too_long.append(job["label"])
+        files = sum(item["files"] for item in job["work"])
+        requested = format_walltime(job["walltime"]) if job["walltime"] else "default"
+        print(
+            f"{job['label'][:50]:<50} {files:>6} {format_walltime(job['predicted_walltime']):>12} "
+            f"{requested:>12} {hours * gpus:>8.1f}"
+        )
+
+    print(f"\nTotal GPU-hours: {gpu_hours:.1f}")
+    print(f"Total CPU-hours: {cpu_hours:.1f}")
+    print(f"Expected makespan at {concurrency} concurrent jobs: {forecast_makespan(plan, concurrency):.1f} h")
+    for label in too_long:
+        print(f"\t- Warning: {label} is predicted to exceed {format_walltime(MAX_WALLTIME)}; lower CHUNK_SIZE")
+
+
+def parse_priorities(values):
+    """Parse repeated NAME=N options (model or dataset names) into a dict; lower runs sooner."""
+    priorities = {}
+    for value in values or []:
+        name, _, level = value.rpartition("=")
+        if not name:
+            raise ValueError(f"Priority '{value}' must look like NAME=N")
+        priorities[name] = int(level)
+    return priorities
+
+
+def order_plan(plan, priorities=None):
+    """
+    Reorder an estimated plan so whole (model, dataset) groups run
+    shortest-expected-first within each user priority level, and set each job's
+    queue priority to match. The notification job stays last.
+    """
+    priorities = priorities or {}
+    groups = {}
+    tail = []
+    for index, job in enumerate(plan):
+        if job["group"] is None:
+            tail.append(job)
+            continue
+        groups.setdefault(job["group"], {"index": index, "jobs": []})["jobs"].append(job)
+
+    def group_key(item):
+        group, info = item
+        names = group if isinstance(group, tuple) else (group,)
+        level = sum(priorities.get(name, 0) for name in names)
+        cost = sum(job["expected_seconds"] for job in info["jobs"])
+        return (level, cost, info["index"])
+
+    ordered = []
+    for group, info in sorted(groups.items(), key=group_key):
+        ordered.extend(info["jobs"])
+    ordered.extend(tail)
+
+    for rank, job in enumerate(ordered):
+        if job["priority"] >= 0:
+            job["priority"] = rank
+    plan[:] = ordered
+    return plan
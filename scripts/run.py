@@ -9,9 +9,35 @@ __github__ = "github.com/ojas-chaturvedi"
 __license__ = "MIT"
 
 import json
-import subprocess
 import os
 import math
+import time
+import asyncio
+import argparse
+from scheduler import SlurmScheduler, LocalScheduler, TERMINAL_STATES, classify_failure
+from manifest import load_manifest
+from staged import stratified_order, read_fmeasures, rank_models
+from dispatch import (
+    CLUSTERS_FILE,
+    load_clusters,
+    home_cluster,
+    cluster_scheduler,
+    assign_groups,
+    localize_plan,
+    sync_cluster,
+    save_shares,
+)
+from planner import (
+    PLAN_CONCURRENCY,
+    WALLTIME_MARGIN,
+    estimate_plan,
+    format_walltime,
+    load_runtime_history,
+    model_workers,
+    order_plan,
+    parse_priorities,
+    plan_report,
+)
 
 CHUNK_SIZE = 1500
 MODELS_FILE = "models.json"
@@ -20,76 +46,269 @@ RUN_SCRIPT = "run.sh"
 UPLOAD_SCRIPT = "upload.sh"
 NOTIFICATION_SCRIPT = "notification.sh"
 
+# Used for models without a Resources entry in models.json (matches the run.sh #SBATCH header)
+DEFAULT_RESOURCES = {
+    "account": "yunglu-k",
+    "partition": None,
+    "gpus": 2,
+    "cpus": 8,
+    "mem_gb": 128,
+    "files_per_hour": None,
+}
 
-def extract_slurm_id(output: str) -> str:
-    """Extract SLURM job ID from sbatch output."""
-    return next((word for word in output.split() if word.isdigit()), "")
+# Monitor mode settings
+LEDGER_FILE = "jobs_ledger.json"
+MAX_RETRIES = 3
+MAX_MEM_GB = 512
+POLL_INTERVAL = 300  # Seconds between job state polls
+
+# Staged mode settings
+STAGE_SIZE = 1000  # Files per dataset in the first stage; each later stage doubles it
+MAX_STAGES = 5  # Stages before staged mode stops expanding even if rankings are unresolved
+CONFIDENCE = 0.95
+
+# Throttled mode settings
+THROTTLE_POLL_INTERVAL = 60  # Seconds between queue depth checks
+MAX_SUBMIT_ATTEMPTS = 20
+
+SCHEDULER = SlurmScheduler()
+
+# Set by --stream-upload: chunk jobs upload their own outputs and the upload job only finishes the folder
+UPLOAD_RUN_ID = None
+# Set by --archive: outputs are uploaded as one zip/tar plus member index per chunk instead of file by file
+UPLOAD_ARCHIVE = None
+
+
+def job_exports(**variables):
+    """--export flag passing the given variables (plus the upload run and archive format, if any) to a job."""
+    if UPLOAD_RUN_ID:
+        variables["UPLOAD_RUN_ID"] = UPLOAD_RUN_ID
+    if UPLOAD_ARCHIVE:
+        variables["UPLOAD_ARCHIVE"] = UPLOAD_ARCHIVE
+    return "--export=" + ",".join(["ALL"] + [f"{name}={value}" for name, value in variables.items()])
 
 
 def submit_job(command):
     """Run sbatch command and return job ID if successful."""
+    return SCHEDULER.submit(command)
+
+
+def load_values(path):
+    """Load the rows (without header) of a models/datasets JSON file."""
+    if not os.path.exists(path):
+        print(f"Error: {path} not found.")
+        return None
+
     try:
-        result = subprocess.run(
-            command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        output = result.stdout.decode().strip()
-        return extract_slurm_id(output)
-    except subprocess.CalledProcessError as e:
-        print(f"\tFailed to submit job: {e.stderr.decode().strip()}")
+        with open(path, "r") as f:
+            return json.load(f).get("values", [])[1:]
+    except Exception as e:
+        print(f"Error loading {path}: {e}")
         return None
 
 
-def main():
-    print("Starting SLURM Job Submission Process")
+def load_file_list(dataset_path):
+    """
+    Read a dataset's audio paths and {path: duration} from its manifest, or the
+    sorted list (with no durations) if there is none. Returns (None, {}) if neither exists.
+    """
+    manifest_rows = load_manifest(dataset_path)
+    if manifest_rows is not None:
+        paths = [row["path"] for row in manifest_rows]
+        durations = {row["path"]: row["duration_seconds"] for row in manifest_rows}
+        return paths, durations
 
-    if not os.path.exists(MODELS_FILE):
-        print(f"Error: {MODELS_FILE} not found.")
-        return
-    if not os.path.exists(DATASETS_FILE):
-        print(f"Error: {DATASETS_FILE} not found.")
-        return
+    list_file_path = f"{dataset_path}.txt"
+    if not os.path.isfile(list_file_path):
+        return None, {}
+    with open(list_file_path, "r") as f:
+        return [line.strip() for line in f if line.strip()], {}
 
-    try:
-        with open(MODELS_FILE, "r") as f:
-            model_data = json.load(f).get("values", [])[1:]
-    except Exception as e:
-        print(f"Error loading {MODELS_FILE}: {e}")
-        return
 
-    try:
-        with open(DATASETS_FILE, "r") as f:
-            dataset_data = json.load(f).get("values", [])[1:]
-    except Exception as e:
-        print(f"Error loading {DATASETS_FILE}: {e}")
-        return
+def work_item(model_name, dataset_name, paths, durations):
+    """Describe files of one dataset inside a job, for runtime prediction."""
+    known = [durations[p] for p in paths if durations.get(p)]
+    return {
+        "model": model_name,
+        "dataset": dataset_name,
+        "files": len(paths),
+        "audio_seconds": sum(known) if len(known) == len(paths) else None,
+    }
 
-    if not model_data:
-        print("No models found.")
-        return
-    if not dataset_data:
-        print("No datasets found.")
-        return
 
-    print(f"Found {len(model_data)} models and {len(dataset_data)} datasets.")
+def write_chunk(chunk_path, chunk_files):
+    """Write a chunk list file, one audio path per line."""
+    with open(chunk_path, "w") as chunk_file:
+        chunk_file.write("\n".join(chunk_files) + "\n")
 
-    total_jobs_submitted = 0
-    all_upload_ids = []
 
-    # Sort models by reverse alphabetical order
-    model_data.sort(key=lambda x: x[0], reverse=True)
+def model_resources(model_row):
+    """Resource profile for a model row, filling unset fields from DEFAULT_RESOURCES."""
+    profile = model_row[4] if len(model_row) > 4 and isinstance(model_row[4], dict) else {}
+    return {
+        **DEFAULT_RESOURCES,
+        **{key: value for key, value in profile.items() if value is not None},
+    }
+
+
+def resource_flags(resources, mem_gb=None):
+    """sbatch flags for a resource profile; CPU-only profiles request no GPUs so SLURM can pack them."""
+    flags = ["-A", resources["account"]]
+    if resources.get("partition"):
+        flags.append(f"--partition={resources['partition']}")
+    if resources["gpus"]:
+        flags.append(f"--gres=gpu:{resources['gpus']}")
+    else:
+        flags.append("--gres=none")
+    flags += [
+        f"--cpus-per-task={resources['cpus']}",
+        f"--mem={mem_gb or resources['mem_gb']}G",
+        # run.sh runs one transcription per GPU, or one per CPU for CPU-only models
+        job_exports(MODEL_WORKERS=model_workers(resources)),
+    ]
+    return flags
+
+
+def chunk_command(
+    model_name, dataset_name, dataset_path, audio_type, chunk_path, chunk_id, resources=None, mem_gb=None, walltime=None
+):
+    """Build the sbatch command for a single chunk job."""
+    job_name = f"{model_name}_{dataset_name}_chunk{chunk_id}"
+    output_file = f"{model_name}/research_output/{dataset_name}_chunk{chunk_id}_slurm_output.txt"
+
+    sbatch_cmd = ["sbatch", "-J", job_name, "-o", output_file]
+    sbatch_cmd += resource_flags(resources or DEFAULT_RESOURCES, mem_gb)
+    if walltime:
+        sbatch_cmd.append(f"--time={format_walltime(walltime)}")
+    sbatch_cmd += [
+        RUN_SCRIPT,
+        model_name,
+        dataset_name,
+        dataset_path,
+        audio_type,
+        chunk_path,
+    ]
+    return sbatch_cmd
+
+
+def skip_reason(model_row, dataset_name, dataset_instrument):
+    """Return why a model should not run on a dataset, or None if it should."""
+    model_name, instrument_type, training_datasets, completed_datasets = model_row[:4]
+
+    training_datasets = set(
+        training_datasets if isinstance(training_datasets, list) else []
+    )
+    completed_datasets = set(
+        completed_datasets if isinstance(completed_datasets, list) else []
+    )
+
+    if dataset_name in training_datasets:
+        return f"{dataset_name} used for training {model_name}."
+    if dataset_name in completed_datasets:
+        return f"{dataset_name} already completed for {model_name}."
+    if instrument_type == "Piano" and dataset_instrument != "Piano":
+        return "model and dataset instrument mismatch."
+    return None
+
+
+def upload_command(model_name, dataset_name, hold=False):
+    """Build the upload job command for a (model, dataset); dependencies are added at submission."""
+    upload_cmd = ["sbatch", "-J", f"Upload-{model_name}-{dataset_name}"]
+    # In monitor mode the upload waits for retries, so it is released by the monitor
+    if hold:
+        upload_cmd.append("--hold")
+    if UPLOAD_RUN_ID or UPLOAD_ARCHIVE:
+        upload_cmd.append(job_exports())
+    upload_cmd += [UPLOAD_SCRIPT, model_name, dataset_name]
+    return upload_cmd
+
+
+def with_walltime(command, walltime):
+    """Set an sbatch command's --time, replacing any already there."""
+    command = [arg for arg in command if not arg.startswith("--time=")]
+    return command[:1] + [f"--time={format_walltime(walltime)}"] + command[1:]
+
+
+def with_dependency(command, job_ids):
+    """Insert an afterany dependency on the given job IDs into an sbatch command."""
+    if not job_ids:
+        return command
+    return command[:1] + ["--dependency=afterany:" + ":".join(job_ids)] + command[1:]
+
+
+# Job plan functions
+#
+# A plan is an ordered list of job dicts: key, kind (chunk/pack/upload/notify),
+# label, command, depends_on (keys of jobs it runs after), priority (lower is
+# submitted first when throttled), group (the (model, dataset) or model the job
+# belongs to, for ordering), work (files per dataset) and resources (for runtime
+# prediction) and, for chunks, the monitor ledger record.
+
+
+def plan_job(key, kind, label, command, depends_on=(), priority=0, record=None, group=None, work=None, resources=None):
+    return {
+        "key": key,
+        "kind": kind,
+        "label": label,
+        "command": command,
+        "depends_on": list(depends_on),
+        "priority": priority,
+        "record": record,
+        "group": group,
+        "work": work or [],
+        "resources": resources,
+    }
+
+
+def chunk_job(model_name, resources, dataset_row, chunk_path, chunk_id, chunk_files, durations, label, priority):
+    """Plan one chunk job of a model on a dataset, with its monitor ledger record."""
+    dataset_name, dataset_path, _, audio_type, _ = dataset_row
+    return plan_job(
+        f"chunk:{model_name}:{dataset_name}:{chunk_id}",
+        "chunk",
+        label,
+        chunk_command(
+            model_name,
+            dataset_name,
+            dataset_path,
+            audio_type,
+            chunk_path,
+            chunk_id,
+            resources,
+        ),
+        priority=priority,
+        group=(model_name, dataset_name),
+        work=[work_item(model_name, dataset_name, chunk_files, durations)],
+        resources=resources,
+        record={
+            "model": model_name,
+            "dataset": dataset_name,
+            "dataset_path": dataset_path,
+            "audio_type": audio_type,
+            "chunk_path": chunk_path,
+            "chunk_id": chunk_id,
+            "attempt": 0,
+            "resources": resources,
+            "mem_gb": resources["mem_gb"],
+            "state": "PENDING",
+            "status": "active",
+        },
+    )
+
+
+def build_plan(model_data, dataset_data, hold_uploads=False):
+    """Write chunk files and plan chunk jobs plus one upload job per (model, dataset)."""
+    plan = []
 
     for dataset_row in dataset_data:
         dataset_name, dataset_path, dataset_instrument, audio_type, _ = dataset_row
         print(f"\nProcessing dataset: {dataset_name}")
 
-        list_file_path = f"{dataset_path}.txt"
-        if not os.path.isfile(list_file_path):
-            print(f"\t- Missing file list: {list_file_path}, skipping dataset.")
+        all_files, durations = load_file_list(dataset_path)
+        if all_files is None:
+            print(f"\t- Missing file list: {dataset_path}.txt, skipping dataset.")
             continue
 
-        with open(list_file_path, "r") as f:
-            all_files = [line.strip() for line in f if line.strip()]
-
         total_files = len(all_files)
         num_chunks = math.ceil(total_files / CHUNK_SIZE)
         print(f"\t- Total files: {total_files}, Chunks: {num_chunks}")
@@ -97,109 +316,828 @@ def main():
         chunk_dir = f"chunks/{dataset_name}"
         os.makedirs(chunk_dir, exist_ok=True)
 
+        for i in range(num_chunks):
+            chunk_path = os.path.abspath(f"{chunk_dir}/chunk_{i:03d}.txt")
+            write_chunk(chunk_path, all_files[i * CHUNK_SIZE : (i + 1) * CHUNK_SIZE])
+
         for model_row in model_data:
-            model_name, instrument_type, training_datasets, completed_datasets = (
-                model_row
-            )
+            model_name = model_row[0]
+            resources = model_resources(model_row)
             print(f"\tProcessing model: {model_name}")
 
-            training_datasets = set(
-                training_datasets if isinstance(training_datasets, list) else []
-            )
-            completed_datasets = set(
-                completed_datasets if isinstance(completed_datasets, list) else []
+            reason = skip_reason(model_row, dataset_name, dataset_instrument)
+            if reason:
+                print(f"\t\t- Skipping: {reason}")
+                continue
+
+            chunk_keys = []
+            for i in range(num_chunks):
+                chunk_files = all_files[i * CHUNK_SIZE : (i + 1) * CHUNK_SIZE]
+                chunk_id = f"{i:03d}"
+                chunk_path = os.path.abspath(f"{chunk_dir}/chunk_{chunk_id}.txt")
+                job = chunk_job(
+                    model_name,
+                    resources,
+                    dataset_row,
+                    chunk_path,
+                    chunk_id,
+                    chunk_files,
+                    durations,
+                    f"chunk {i + 1}/{num_chunks} of {model_name} / {dataset_name}",
+                    len(plan),
+                )
+                plan.append(job)
+                chunk_keys.append(job["key"])
+
+            plan.append(
+                plan_job(
+                    f"upload:{model_name}:{dataset_name}",
+                    "upload",
+                    f"upload of {model_name} / {dataset_name}",
+                    upload_command(model_name, dataset_name, hold_uploads),
+                    depends_on=chunk_keys,
+                    priority=-1,
+                    group=(model_name, dataset_name),
+                    record={"model": model_name, "dataset": dataset_name},
+                )
             )
 
-            if dataset_name in training_datasets:
-                print(f"\t\t- Skipping: {dataset_name} used for training {model_name}.")
+    return plan
+
+
+def build_packed_plan(model_data, dataset_data):
+    """
+    Plan one job per CHUNK_SIZE files per model, mixing datasets so the model
+    environment (and, with main.py --batch, its weights) loads once per job.
+    """
+    plan = []
+
+    file_lists = {}
+    durations = {}
+    for dataset_row in dataset_data:
+        dataset_name, dataset_path = dataset_row[0], dataset_row[1]
+        all_files, dataset_durations = load_file_list(dataset_path)
+        if all_files is None:
+            print(f"\t- Missing file list: {dataset_path}.txt, skipping {dataset_name}.")
+            continue
+        file_lists[dataset_name] = all_files
+        durations.update(dataset_durations)
+
+    for model_row in model_data:
+        model_name = model_row[0]
+        print(f"\nPacking model: {model_name}")
+
+        entries = []
+        for dataset_name, dataset_path, dataset_instrument, audio_type, _ in dataset_data:
+            if dataset_name not in file_lists:
+                continue
+            reason = skip_reason(model_row, dataset_name, dataset_instrument)
+            if reason:
+                print(f"\t- Skipping: {reason}")
                 continue
+            entries += [(dataset_name, audio_type, path) for path in file_lists[dataset_name]]
+
+        if not entries:
+            continue
+
+        pack_dir = f"chunks/packed/{model_name.replace('/', '_')}"
+        os.makedirs(pack_dir, exist_ok=True)
+        num_packs = math.ceil(len(entries) / CHUNK_SIZE)
+        print(f"\t- Total files: {len(entries)}, Packs: {num_packs}")
 
-            if dataset_name in completed_datasets:
-                print(
-                    f"\t\t- Skipping: {dataset_name} already completed for {model_name}."
+        dataset_pack_keys = {}
+        for i in range(num_packs):
+            pack = entries[i * CHUNK_SIZE : (i + 1) * CHUNK_SIZE]
+            manifest_path = os.path.abspath(f"{pack_dir}/pack_{i:03d}.tsv")
+            with open(manifest_path, "w") as f:
+                f.write("".join(f"{d}\t{t}\t{p}\n" for d, t, p in pack))
+
+            key = f"pack:{model_name}:{i:03d}"
+            resources = model_resources(model_row)
+            sbatch_cmd = [
+                "sbatch",
+                "-J",
+                f"{model_name}_pack{i:03d}",
+                "-o",
+                f"{model_name}/research_output/packed_pack{i:03d}_slurm_output.txt",
+                *resource_flags(resources),
+                RUN_SCRIPT,
+                model_name,
+                "--packed",
+                manifest_path,
+            ]
+            pack_datasets = sorted({d for d, _, _ in pack})
+            plan.append(
+                plan_job(
+                    key,
+                    "pack",
+                    f"pack {i + 1}/{num_packs} of {model_name}",
+                    sbatch_cmd,
+                    priority=len(plan),
+                    group=model_name,
+                    work=[
+                        work_item(model_name, d, [p for ds, _, p in pack if ds == d], durations)
+                        for d in pack_datasets
+                    ],
+                    resources=resources,
+                )
+            )
+            for dataset_name in pack_datasets:
+                dataset_pack_keys.setdefault(dataset_name, []).append(key)
+
+        # Results are still written per dataset, so uploads stay per (model, dataset)
+        for dataset_name, pack_keys in dataset_pack_keys.items():
+            plan.append(
+                plan_job(
+                    f"upload:{model_name}:{dataset_name}",
+                    "upload",
+                    f"upload of {model_name} / {dataset_name}",
+                    upload_command(model_name, dataset_name),
+                    depends_on=pack_keys,
+                    priority=-1,
+                    group=model_name,
+                    record={"model": model_name, "dataset": dataset_name},
                 )
+            )
+
+    return plan
+
+
+def add_notification(plan):
+    """Append the final notification job, run after every upload."""
+    upload_keys = [job["key"] for job in plan if job["kind"] == "upload"]
+    if upload_keys:
+        plan.append(
+            plan_job(
+                "notify",
+                "notify",
+                "notification",
+                ["sbatch", "-J", "Notify", NOTIFICATION_SCRIPT],
+                depends_on=upload_keys,
+                priority=-1,
+            )
+        )
+    return plan
+
+
+def apply_walltimes(plan):
+    """Request each job's predicted walltime, and keep it on chunk records for resubmission."""
+    for job in plan:
+        if job.get("walltime"):
+            job["command"] = with_walltime(job["command"], job["walltime"])
+            if job["record"] is not None and job["kind"] == "chunk":
+                job["record"]["walltime"] = job["walltime"]
+    return plan
+
+
+def ready_command(job, job_ids):
+    """Return the job's command with its dependencies resolved, or None if none of them were submitted."""
+    dependency_ids = [job_ids[key] for key in job["depends_on"] if key in job_ids]
+    if job["depends_on"] and not dependency_ids:
+        return None
+    return with_dependency(job["command"], dependency_ids)
+
+
+def submit_plan(plan):
+    """Submit a plan in order and return {key: job_id} for the jobs that were accepted."""
+    job_ids = {}
+    for job in plan:
+        command = ready_command(job, job_ids)
+        if command is None:
+            print(f"\t- Skipping {job['label']}: none of its dependencies were submitted.")
+            continue
+        job_id = submit_job(command)
+        if job_id:
+            job_ids[job["key"]] = job_id
+            print(f"\t- Submitted {job['label']} as job ID: {job_id}")
+        else:
+            print(f"\t- Failed to submit {job['label']}")
+    return job_ids
+
+
+# Throttled submission functions
+
+
+async def submit_plan_throttled(plan, max_queued, poll_interval=THROTTLE_POLL_INTERVAL):
+    """
+    Submit a plan without exceeding `max_queued` of our jobs in the queue. Jobs
+    become eligible once their dependencies have job IDs and are released from a
+    priority queue as the watcher sees slots free up. Failed submissions go back
+    into the queue, so capacity limits only delay jobs.
+    """
+    loop = asyncio.get_running_loop()
+    eligible = asyncio.PriorityQueue()
+    resolved = {job["key"]: asyncio.Event() for job in plan}
+    job_ids = {}
+    attempts = {}
+
+    async def enqueue_when_ready(index, job):
+        for key in job["depends_on"]:
+            if key in resolved:
+                await resolved[key].wait()
+        await eligible.put((job["priority"], index, job))
+
+    waiters = [asyncio.create_task(enqueue_when_ready(i, job)) for i, job in enumerate(plan)]
+
+    remaining = len(plan)
+    while remaining:
+        await asyncio.sleep(0)  # Let newly ready jobs reach the queue
+        queued = await loop.run_in_executor(None, SCHEDULER.queue_depth)
+        slots = max(max_queued - queued, 0)
+
+        while slots and not eligible.empty():
+            priority, index, job = eligible.get_nowait()
+            command = ready_command(job, job_ids)
+            if command is None:
+                print(f"\t- Skipping {job['label']}: none of its dependencies were submitted.")
+                resolved[job["key"]].set()
+                remaining -= 1
                 continue
 
-            if instrument_type == "Piano" and dataset_instrument != "Piano":
-                print(f"\t\t- Skipping: model and dataset instrument mismatch.")
+            job_id = await loop.run_in_executor(None, submit_job, command)
+            if job_id:
+                job_ids[job["key"]] = job_id
+                print(f"\t- Submitted {job['label']} as job ID: {job_id} ({queued + 1}/{max_queued} queued)")
+                resolved[job["key"]].set()
+                remaining -= 1
+                slots -= 1
+                queued += 1
                 continue
 
-            chunk_job_ids = []
+            attempts[job["key"]] = attempts.get(job["key"], 0) + 1
+            if attempts[job["key"]] >= MAX_SUBMIT_ATTEMPTS:
+                print(f"\t- Giving up on {job['label']} after {MAX_SUBMIT_ATTEMPTS} attempts")
+                resolved[job["key"]].set()
+                remaining -= 1
+            else:
+                await eligible.put((priority, index, job))
+            break  # Rejected, so the queue is fuller than squeue reported; wait for the next poll
 
-            for i in range(num_chunks):
-                chunk_files = all_files[i * CHUNK_SIZE : (i + 1) * CHUNK_SIZE]
-                chunk_path = os.path.abspath(f"{chunk_dir}/chunk_{i:03d}.txt")
+        if remaining:
+            await asyncio.sleep(poll_interval)
 
-                with open(chunk_path, "w") as chunk_file:
-                    chunk_file.write("\n".join(chunk_files) + "\n")
+    for waiter in waiters:
+        waiter.cancel()
+    return job_ids
 
-                job_name = f"{model_name}_{dataset_name}_chunk{i:03d}"
-                output_file = f"{model_name}/research_output/{dataset_name}_chunk{i:03d}_slurm_output.txt"
 
-                sbatch_cmd = [
-                    "sbatch",
-                    "-J",
-                    job_name,
-                    "-o",
-                    output_file,
-                    RUN_SCRIPT,
-                    model_name,
-                    dataset_name,
-                    dataset_path,
-                    audio_type,
-                    chunk_path,
-                ]
-
-                job_id = submit_job(sbatch_cmd)
-                if job_id:
-                    chunk_job_ids.append(job_id)
-                    total_jobs_submitted += 1
-                    print(
-                        f"\t\t- Submitted chunk {i + 1}/{num_chunks} as job ID: {job_id}"
+def build_ledger(plan, job_ids):
+    """Monitor ledger for the submitted chunk and upload jobs of a plan."""
+    ledger = {"chunks": [], "groups": [], "upload_run_id": UPLOAD_RUN_ID, "upload_archive": UPLOAD_ARCHIVE}
+    for job in plan:
+        if job["key"] not in job_ids:
+            continue
+        if job["kind"] == "chunk":
+            ledger["chunks"].append({"job_id": job_ids[job["key"]], **job["record"]})
+        elif job["kind"] == "upload":
+            ledger["groups"].append(
+                {**job["record"], "upload_job_id": job_ids[job["key"]], "released": False}
+            )
+    return ledger
+
+
+# Monitor mode functions
+
+
+def save_ledger(ledger, path=LEDGER_FILE):
+    with open(path, "w") as f:
+        json.dump(ledger, f, indent=2)
+
+
+def load_ledger(path=LEDGER_FILE):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def split_chunk(record):
+    """Split a chunk list file into two halves and return [(chunk_path, chunk_id), ...]."""
+    with open(record["chunk_path"], "r") as f:
+        files = [line.strip() for line in f if line.strip()]
+
+    if len(files) < 2:
+        return [(record["chunk_path"], record["chunk_id"])]
+
+    middle = len(files) // 2
+    base, ext = os.path.splitext(record["chunk_path"])
+    halves = []
+    for suffix, part in (("a", files[:middle]), ("b", files[middle:])):
+        part_path = f"{base}{suffix}{ext}"
+        write_chunk(part_path, part)
+        halves.append((part_path, f"{record['chunk_id']}{suffix}"))
+    return halves
+
+
+def resubmit(record, failure):
+    """Resubmit a failed chunk according to its failure class and return the new records."""
+    resources = record.get("resources") or DEFAULT_RESOURCES
+    mem_gb = record.get("mem_gb") or resources["mem_gb"]
+    pieces = [(record["chunk_path"], record["chunk_id"])]
+
+    if failure == "walltime":
+        pieces = split_chunk(record)
+    elif failure == "oom":
+        mem_gb = min(mem_gb * 2, MAX_MEM_GB)
+
+    new_records = []
+    for chunk_path, chunk_id in pieces:
+        sbatch_cmd = chunk_command(
+            record["model"],
+            record["dataset"],
+            record["dataset_path"],
+            record["audio_type"],
+            chunk_path,
+            chunk_id,
+            resources,
+            mem_gb,
+            record.get("walltime"),
+        )
+        job_id = submit_job(sbatch_cmd)
+        if not job_id:
+            print(f"\t- Failed to resubmit chunk {chunk_id} of {record['model']} / {record['dataset']}")
+            continue
+        print(
+            f"\t- Resubmitted chunk {chunk_id} of {record['model']} / {record['dataset']} "
+            f"({failure}, attempt {record['attempt'] + 1}) as job ID: {job_id}"
+        )
+        new_records.append(
+            {
+                **record,
+                "job_id": job_id,
+                "chunk_path": chunk_path,
+                "chunk_id": chunk_id,
+                "attempt": record["attempt"] + 1,
+                "mem_gb": mem_gb,
+                "state": "PENDING",
+                "status": "active",
+            }
+        )
+    return new_records
+
+
+def monitor_jobs(ledger, poll_interval=POLL_INTERVAL, max_retries=MAX_RETRIES):
+    """Poll chunk jobs, resubmit failures and release held upload jobs once each group resolves."""
+    print("\nMonitoring chunk jobs")
+
+    while True:
+        active = [r for r in ledger["chunks"] if r["status"] == "active"]
+        states = SCHEDULER.states([r["job_id"] for r in active])
+
+        for record in active:
+            state = states.get(record["job_id"], record["state"])
+            record["state"] = state
+            if state not in TERMINAL_STATES:
+                continue
+
+            failure = classify_failure(state)
+            if failure == "ok":
+                record["status"] = "done"
+            elif failure == "cancelled":
+                print(f"\t- Job {record['job_id']} was cancelled, not retrying.")
+                record["status"] = "cancelled"
+            elif record["attempt"] >= max_retries:
+                print(f"\t- Job {record['job_id']} failed ({state}), retry budget exhausted.")
+                record["status"] = "exhausted"
+            else:
+                record["status"] = "retried"
+                ledger["chunks"].extend(resubmit(record, failure))
+
+        # Release each upload once none of its chunks can run again
+        for group in ledger["groups"]:
+            if group["released"]:
+                continue
+            if any(
+                r["status"] == "active"
+                for r in ledger["chunks"]
+                if r["model"] == group["model"] and r["dataset"] == group["dataset"]
+            ):
+                continue
+            if SCHEDULER.release(group["upload_job_id"]):
+                print(f"\t- Released upload job {group['upload_job_id']} for {group['model']} / {group['dataset']}")
+            group["released"] = True
+
+        save_ledger(ledger)
+
+        remaining = sum(r["status"] == "active" for r in ledger["chunks"])
+        if not remaining and all(g["released"] for g in ledger["groups"]):
+            break
+        print(f"\t- {remaining} chunk jobs still active, sleeping {poll_interval} seconds")
+        time.sleep(poll_interval)
+
+    exhausted = [r for r in ledger["chunks"] if r["status"] == "exhausted"]
+    print("\nMonitoring Complete.")
+    print(f"Chunks that could not be recovered: {len(exhausted)}")
+    for record in exhausted:
+        print(f"\t- {record['model']} / {record['dataset']} chunk {record['chunk_id']}: {record['state']}")
+
+
+# Staged mode functions
+
+
+def staged_datasets(model_data, dataset_data, seed=0):
+    """Stratified file order, durations and eligible models for each dataset."""
+    datasets = []
+    for dataset_row in dataset_data:
+        dataset_name, dataset_path, dataset_instrument = dataset_row[:3]
+        rows = load_manifest(dataset_path)
+        if rows is None:
+            all_files, _ = load_file_list(dataset_path)
+            if all_files is None:
+                print(f"\t- Missing file list: {dataset_path}.txt, skipping {dataset_name}.")
+                continue
+            print(f"\t- No manifest for {dataset_name}, sampling it without strata (run manifest.py).")
+            rows = [{"path": path} for path in all_files]
+
+        models = [row for row in model_data if not skip_reason(row, dataset_name, dataset_instrument)]
+        if not models:
+            continue
+        datasets.append(
+            {
+                "row": dataset_row,
+                "order": stratified_order(rows, seed),
+                "durations": {row["path"]: row.get("duration_seconds") for row in rows},
+                "offset": 0,
+                "models": models,
+                "ran": [],
+            }
+        )
+    return datasets
+
+
+def stage_plan(datasets, stage, size):
+    """Write the next `size` sampled files of each dataset as chunks and plan them for its active models."""
+    plan = []
+    for entry in datasets:
+        dataset_name = entry["row"][0]
+        sample = entry["order"][entry["offset"] : entry["offset"] + size]
+        if not entry["models"] or not sample:
+            entry["models"] = []
+            continue
+        entry["offset"] += len(sample)
+
+        chunk_dir = f"chunks/{dataset_name}"
+        os.makedirs(chunk_dir, exist_ok=True)
+        pieces = []
+        for i in range(math.ceil(len(sample) / CHUNK_SIZE)):
+            chunk_id = f"s{stage}_{i:03d}"
+            chunk_path = os.path.abspath(f"{chunk_dir}/chunk_{chunk_id}.txt")
+            chunk_files = sample[i * CHUNK_SIZE : (i + 1) * CHUNK_SIZE]
+            write_chunk(chunk_path, chunk_files)
+            pieces.append((chunk_id, chunk_path, chunk_files))
+
+        for model_row in entry["models"]:
+            model_name = model_row[0]
+            if model_name not in entry["ran"]:
+                entry["ran"].append(model_name)
+            resources = model_resources(model_row)
+            for chunk_id, chunk_path, chunk_files in pieces:
+                plan.append(
+                    chunk_job(
+                        model_name,
+                        resources,
+                        entry["row"],
+                        chunk_path,
+                        chunk_id,
+                        chunk_files,
+                        entry["durations"],
+                        f"stage {stage} chunk {chunk_id} of {model_name} / {dataset_name}",
+                        len(plan),
                     )
-                else:
-                    print(f"\t\t- Failed to submit chunk {i + 1}/{num_chunks}")
-
-            if chunk_job_ids:
-                dependency_str = ":".join(chunk_job_ids)
-                upload_job_name = f"Upload-{model_name}-{dataset_name}"
-                upload_cmd = [
-                    "sbatch",
-                    "-J",
-                    upload_job_name,
-                    "--dependency=afterany:" + dependency_str,
-                    UPLOAD_SCRIPT,
-                    model_name,
-                    dataset_name,
-                ]
-
-                upload_job_id = submit_job(upload_cmd)
-                if upload_job_id:
-                    print(f"\t\t- Upload job submitted (Job ID: {upload_job_id})")
-                    total_jobs_submitted += 1
-                    all_upload_ids.append(upload_job_id)
-                else:
-                    print(f"\t\t- Failed to submit upload job.")
-
-    # Submit final notification job
-    if all_upload_ids:
-        dependency_str = ":".join(all_upload_ids)
-        notify_cmd = [
-            "sbatch",
-            "-J",
-            "Notify",
-            "--dependency=afterany:" + dependency_str,
-            NOTIFICATION_SCRIPT,
-        ]
-
-        notification_job_id = submit_job(notify_cmd)
-        if notification_job_id:
-            print(f"\nNotification job submitted! Job ID: {notification_job_id}")
-            total_jobs_submitted += 1
+                )
+    return plan
+
+
+def review_stage(entry, confidence=CONFIDENCE):
+    """Rank the models run on a dataset so far and keep only those whose order is unresolved active."""
+    dataset_name = entry["row"][0]
+    sampled = {os.path.basename(path) for path in entry["order"][: entry["offset"]]}
+    scores = {}
+    for model_name in entry["ran"]:
+        details_file = os.path.join(model_name, f"details_{dataset_name.replace(' ', '_')}.txt")
+        scores[model_name] = {
+            name: fmeasure for name, fmeasure in read_fmeasures(details_file).items() if name in sampled
+        }
+
+    ranking, comparisons, unresolved, failed = rank_models(scores, confidence)
+    print(f"\n{dataset_name}: {entry['offset']}/{len(entry['order'])} files sampled")
+    for better, worse, mean, half_width, shared, resolved in comparisons:
+        status = "resolved" if resolved else "unresolved"
+        print(f"\t- {better} > {worse}: {mean:+.4f} +/- {half_width:.4f} over {shared} files ({status})")
+    for model_name in sorted(failed):
+        print(f"\t- {model_name} produced no F-measures (check its chunk logs and {model_name}/details_*.txt); dropped")
+
+    if entry["offset"] >= len(entry["order"]):
+        entry["models"] = []
+    else:
+        entry["models"] = [row for row in entry["models"] if row[0] in unresolved]
+    if entry["models"]:
+        print(f"\t- Expanding for: {', '.join(row[0] for row in entry['models'])}")
+
+
+def run_staged(model_data, dataset_data, args):
+    """
+    Evaluate a stratified sample of each dataset, then keep doubling the sample
+    for the models whose ranking is still statistically unresolved, for at most
+    `args.max_stages` stages. Every stage is monitored to completion; uploads
+    run once the sweep settles.
+    """
+    history = load_runtime_history(args.telemetry_dir)
+    datasets = staged_datasets(model_data, dataset_data, args.seed)
+    size = args.stage_size
+    stage = 0
+
+    while True:
+        if stage >= args.max_stages:
+            for entry in datasets:
+                if entry["models"]:
+                    names = ", ".join(row[0] for row in entry["models"])
+                    print(f"\n{entry['row'][0]}: still unresolved after {stage} stage(s), not expanding: {names}")
+            break
+        plan = stage_plan(datasets, stage, size)
+        if not plan:
+            break
+        estimate_plan(plan, history, args.walltime_margin)
+        apply_walltimes(plan)
+
+        print(f"\nStage {stage}: submitting {len(plan)} chunk jobs ({size} files per dataset)")
+        if args.throttle:
+            job_ids = asyncio.run(submit_plan_throttled(plan, args.throttle))
         else:
-            print("\nFailed to submit notification job.")
+            job_ids = submit_plan(plan)
+        ledger = build_ledger(plan, job_ids)
+        save_ledger(ledger)
+        monitor_jobs(ledger, args.poll_interval, args.max_retries)
+
+        for entry in datasets:
+            if entry["models"]:
+                review_stage(entry, args.confidence)
+        stage += 1
+        size *= 2
+
+    plan = [
+        plan_job(
+            f"upload:{model_name}:{entry['row'][0]}",
+            "upload",
+            f"upload of {model_name} / {entry['row'][0]}",
+            upload_command(model_name, entry["row"][0]),
+            priority=-1,
+        )
+        for entry in datasets
+        for model_name in entry["ran"]
+    ]
+    add_notification(plan)
+    print(f"\nStaged evaluation settled after {stage} stage(s), submitting {len(plan)} upload jobs")
+    submit_plan(plan)
+
+
+# Multi-cluster functions
+
+
+def dispatch_plan(plan, cluster_names, args):
+    """
+    Split a plan between clusters by (model, dataset) group according to each
+    cluster's queue backlog, then submit every share to its cluster with its own
+    notification job. Returns {cluster: {groups, job_ids}}, saved to cluster_shares.json.
+    """
+    global SCHEDULER
+
+    clusters = load_clusters(CLUSTERS_FILE)
+    home = home_cluster(clusters)
+    if home is None:
+        print("\t- Could not tell which cluster this is from the hostname; treating every cluster as remote.")
+
+    profiles = {}
+    for name in cluster_names:
+        if name not in clusters:
+            print(f"\t- Unknown cluster '{name}' in {CLUSTERS_FILE}, skipping it.")
+        elif not clusters[name]["account"]:
+            print(f"\t- No account set for {name} in {CLUSTERS_FILE}, skipping it.")
+        else:
+            profiles[name] = clusters[name]
+
+    schedulers = {
+        name: LocalScheduler() if args.scheduler == "local" else cluster_scheduler(profile, home)
+        for name, profile in profiles.items()
+    }
+    backlogs = {
+        name: schedulers[name].backlog(profile["account"], profile["partition"]) for name, profile in profiles.items()
+    }
+    for name, depth in backlogs.items():
+        print(f"\t- {name}: {depth} pending jobs")
+
+    assignment = assign_groups(plan, backlogs)
+    if not assignment:
+        print("No reachable clusters, nothing submitted.")
+        return {}
+
+    shares = {}
+    for name, profile in profiles.items():
+        share = [job for job in plan if job["group"] is not None and assignment.get(job["group"]) == name]
+        if not share:
+            continue
+        share = localize_plan(add_notification(share), profile, home)
+        if args.scheduler != "local" and not (home and name == home["name"]) and not sync_cluster(profile):
+            continue
+
+        print(f"\nSubmitting {len(share)} jobs to {name}")
+        SCHEDULER = schedulers[name]
+        if args.throttle:
+            job_ids = asyncio.run(submit_plan_throttled(share, args.throttle))
+        else:
+            job_ids = submit_plan(share)
+
+        # Uploads run where their outputs are, so each share records the results it owns
+        shares[name] = {
+            "groups": [[job["record"]["model"], job["record"]["dataset"]] for job in share if job["kind"] == "upload"],
+            "job_ids": job_ids,
+        }
+
+    save_shares(shares)
+    return shares
+
+
+def main():
+    global SCHEDULER, UPLOAD_RUN_ID, UPLOAD_ARCHIVE
+
+    parser = argparse.ArgumentParser(description="Submit SLURM jobs for model evaluation.")
+    parser.add_argument(
+        "--monitor",
+        action="store_true",
+        help="Hold upload jobs and poll chunk jobs, resubmitting failures until all finish",
+    )
+    parser.add_argument(
+        "--resume-monitor",
+        action="store_true",
+        help=f"Resume monitoring jobs recorded in {LEDGER_FILE} without submitting",
+    )
+    parser.add_argument(
+        "--scheduler",
+        choices=["slurm", "local"],
+        default="slurm",
+        help="Scheduler backend (local is an in-process stand-in for testing)",
+    )
+    parser.add_argument(
+        "--pack",
+        action="store_true",
+        help="Pack chunks from several datasets of the same model into one job",
+    )
+    parser.add_argument(
+        "--throttle",
+        type=int,
+        metavar="MAX_QUEUED",
+        help="Keep at most MAX_QUEUED of our jobs in the queue, releasing the rest as slots free up",
+    )
+    parser.add_argument(
+        "--stream-upload",
+        action="store_true",
+        help="Upload each chunk's transcriptions as it finishes; the upload job only sends the rest and marks completion",
+    )
+    parser.add_argument(
+        "--archive",
+        choices=["zip", "tar"],
+        help="Upload transcriptions as one archive per chunk (or per model/dataset) with a member index for range reads",
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        help="Evaluate a stratified sample first and add files only while model rankings are unresolved",
+    )
+    parser.add_argument(
+        "--stage-size",
+        type=int,
+        default=STAGE_SIZE,
+        help="Files per dataset in the first stage (doubles each stage)",
+    )
+    parser.add_argument(
+        "--max-stages",
+        type=int,
+        default=MAX_STAGES,
+        help="Most stages --staged runs before it stops expanding unresolved rankings",
+    )
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE, help="Confidence level for staged rankings")
+    parser.add_argument("--seed", type=int, default=0, help="Sampling seed for --staged")
+    parser.add_argument(
+        "--clusters",
+        metavar="NAME,NAME",
+        help=f"Split jobs between these clusters from {CLUSTERS_FILE} by queue backlog",
+    )
+    parser.add_argument("--max-retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--poll-interval", type=int, default=POLL_INTERVAL)
+    parser.add_argument(
+        "--order",
+        choices=["sjf", "file"],
+        default="sjf",
+        help="sjf: shortest expected (model, dataset) first; file: datasets.json order",
+    )
+    parser.add_argument(
+        "--priority",
+        action="append",
+        metavar="NAME=N",
+        help="Priority level for a model or dataset (lower runs sooner, default 0); repeatable",
+    )
+    parser.add_argument("--telemetry-dir", default="telemetry", help="telemetry.py output used for runtime history")
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print predicted walltimes, GPU-hours and makespan without submitting",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help=f"Concurrent jobs assumed by --plan (default: --throttle, else {PLAN_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--walltime-margin",
+        type=float,
+        default=WALLTIME_MARGIN,
+        help="Fraction added to predicted walltime when requesting --time",
+    )
+    args = parser.parse_args()
+
+    try:
+        priorities = parse_priorities(args.priority)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.pack and (args.monitor or args.resume_monitor):
+        parser.error("--pack cannot be combined with monitor mode")
+    if args.staged and (args.pack or args.plan or args.resume_monitor):
+        parser.error("--staged cannot be combined with --pack, --plan or --resume-monitor")
+    if args.clusters and (args.monitor or args.resume_monitor or args.staged):
+        parser.error("--clusters cannot be combined with monitor or staged mode")
+
+    if args.scheduler == "local":
+        SCHEDULER = LocalScheduler()
+
+    if args.resume_monitor:
+        ledger = load_ledger()
+        # Retried chunks keep streaming into the same run's folders
+        UPLOAD_RUN_ID = ledger.get("upload_run_id")
+        UPLOAD_ARCHIVE = ledger.get("upload_archive")
+        monitor_jobs(ledger, args.poll_interval, args.max_retries)
+        return
+
+    if args.stream_upload:
+        UPLOAD_RUN_ID = time.strftime("%Y%m%d-%H%M%S")
+    UPLOAD_ARCHIVE = args.archive
+
+    print("Starting SLURM Job Submission Process")
+
+    model_data = load_values(MODELS_FILE)
+    dataset_data = load_values(DATASETS_FILE)
+    if model_data is None or dataset_data is None:
+        return
+
+    if not model_data:
+        print("No models found.")
+        return
+    if not dataset_data:
+        print("No datasets found.")
+        return
+
+    print(f"Found {len(model_data)} models and {len(dataset_data)} datasets.")
+
+    # Sort models by reverse alphabetical order
+    model_data.sort(key=lambda x: x[0], reverse=True)
+
+    if args.staged:
+        run_staged(model_data, dataset_data, args)
+        return
+
+    if args.pack:
+        plan = build_packed_plan(model_data, dataset_data)
+    else:
+        plan = build_plan(model_data, dataset_data, hold_uploads=args.monitor)
+
+    # Per-file runtime history predicts each job's walltime, which is requested with a margin
+    estimate_plan(plan, load_runtime_history(args.telemetry_dir), args.walltime_margin)
+    apply_walltimes(plan)
+    if args.order == "sjf":
+        # Small, complete model/dataset results first
+        order_plan(plan, priorities)
+
+    if args.plan:
+        plan_report(plan, args.concurrency or args.throttle or PLAN_CONCURRENCY)
+        return
+
+    if args.clusters:
+        shares = dispatch_plan(plan, args.clusters.split(","), args)
+        total_jobs_submitted = sum(len(share["job_ids"]) for share in shares.values())
+        print("\nSLURM Job Submission Complete.")
+        print(f"Total jobs submitted: {total_jobs_submitted}")
+        with open("jobs_submitted.txt", "w") as f:
+            f.write(str(total_jobs_submitted))
+        return
+    add_notification(plan)
+
+    if not any(job["kind"] == "upload" for job in plan):
+        print("\nNo upload jobs planned, so skipping notification job.")
+
+    print(f"\nSubmitting {len(plan)} jobs")
+    if args.throttle:
+        job_ids = asyncio.run(submit_plan_throttled(plan, args.throttle))
     else:
-        print("\nNo upload jobs submitted, so skipping notification job.")
+        job_ids = submit_plan(plan)
+    total_jobs_submitted = len(job_ids)
 
     print("\nSLURM Job Submission Complete.")
     print(f"Total jobs submitted: {total_jobs_submitted}")
@@ -207,6 +1145,11 @@ def main():
     with open("jobs_submitted.txt", "w") as f:
         f.write(str(total_jobs_submitted))
 
+    if args.monitor:
+        ledger = build_ledger(plan, job_ids)
+        save_ledger(ledger)
+        monitor_jobs(ledger, args.poll_interval, args.max_retries)
+
 
 if __name__ == "__main__":
     main()
@@ -7,12 +7,12 @@
 #SBATCH --mem=128G
 #SBATCH --time=2-00:00:00
 
-# Check for internet access for Conda environment creation
-if ! curl --silent --head --fail https://repo.anaconda.com > /dev/null; then
-    echo "No internet access. Cannot create Conda environment. Exiting."
-    curl -s -X POST -H "Content-Type: application/json" -d '{"content": "URGENT: NO INTERNET ACCESS FOR CONDA CREATION", "avatar_url": "https://droplr.com/wp-content/uploads/2020/10/Screenshot-on-2020-10-21-at-10_29_26.png"}' https://discord.com/api/webhooks/1355780352530055208/84HI6JSNN3cPHbux6fC2qXanozCSrza7-0nAGJgsC_dC2dWAqdnMR7d4wsmwQ4Ai4Iux
+# envs.py only needs the network (and checks for it) when a spec has no cached archive yet
+env_failed() {
+    echo "Could not prepare Conda environment $1. Exiting."
+    curl -s -X POST -H "Content-Type: application/json" -d "{\"content\": \"URGENT: COULD NOT PREPARE CONDA ENVIRONMENT $1 (NO INTERNET FOR A NEW BUILD?)\", \"avatar_url\": \"https://droplr.com/wp-content/uploads/2020/10/Screenshot-on-2020-10-21-at-10_29_26.png\"}" https://discord.com/api/webhooks/1355780352530055208/84HI6JSNN3cPHbux6fC2qXanozCSrza7-0nAGJgsC_dC2dWAqdnMR7d4wsmwQ4Ai4Iux
     exit 1
-fi
+}
 
 start_time=$(date +%s.%N)
 
@@ -21,19 +21,23 @@ echo "Grading model: $1"
 model_name=${1// /_}
 export model_name
 
-echo "Processing dataset: $2"
-dataset_name=${2// /_}
-export dataset_name
-
-echo "Searching in: $3"
-
-echo "Audio type: $4"
-audio_type=${4// /_}
-export audio_type
-
-echo "Chunk file: $5"
-chunk_file="$5"
-chunk_basename=$(basename "$chunk_file" .txt)
+# Usage: run.sh MODEL DATASET DATASET_PATH AUDIO_TYPE CHUNK_FILE
+#    or: run.sh MODEL --packed MANIFEST (tab-separated: dataset, audio type, file)
+if [[ "$2" == "--packed" ]]; then
+    echo "Packed manifest: $3"
+    manifest_file="$3"
+    chunk_basename=$(basename "$manifest_file" .tsv)
+    dataset_label="packed ($(cut -f1 "$manifest_file" | sort -u | paste -sd, -))"
+    temp_name="temp_${chunk_basename}"
+else
+    echo "Processing dataset: $2"
+    echo "Searching in: $3"
+    echo "Audio type: $4"
+    echo "Chunk file: $5"
+    chunk_basename=$(basename "$5" .txt)
+    dataset_label="$2"
+    temp_name="temp_${2// /_}_${chunk_basename}"
+fi
 export chunk_basename
 
 source /etc/profile.d/modules.sh
@@ -48,27 +52,63 @@ source "$(conda info --base)/etc/profile.d/conda.sh"
 
 export PIP_NO_CACHE_DIR=true
 
+# Cluster scratch space (run.py --clusters exports it for other clusters)
+SCRATCH_ROOT="${SCRATCH_ROOT:-/scratch/gilbreth/ochaturv}"
+export SCRATCH_ROOT
+
+MAIN_FOLDER_ID="11zBLIit-Cg7Tu5KHJXZBvaUauFr5Dtbc" # Drive folder for streamed uploads (same as upload.sh)
+
+# Models can read pre-decoded audio via load_audio() in $RESEARCH_DIR/audio_cache.py
+export RESEARCH_DIR="$PWD"
+export AUDIO_CACHE_ROOT="$SCRATCH_ROOT/audio_cache"
+
+# Environments are unpacked from the packed cache into node-local scratch (see envs.py)
+running_env=$(python3 envs.py "running-env-$model_name" --file "$1/environment.yml") || env_failed "running-env-$model_name"
+scoring_env=$(python3 envs.py scoring-env) || env_failed scoring-env
+if [[ -n "$UPLOAD_RUN_ID" ]]; then
+    upload_env=$(python3 envs.py upload-env) || env_failed upload-env
+fi
+
 echo "--------------------------------------------------"
 echo "Available GPUs:"
 nvidia-smi -L 2>/dev/null || echo "nvidia-smi not found"
 gpu_count=$(nvidia-smi -L | wc -l) # Determine number of GPUs
 cpu_count=$SLURM_CPUS_ON_NODE # Determine number of CPU cores
+export gpu_count
+
+# Concurrent transcriptions: set by run.py from the model's resource profile, else one per GPU
+model_workers=${MODEL_WORKERS:-$gpu_count}
+if [[ "$model_workers" -lt 1 ]]; then
+    model_workers=$cpu_count
+fi
+export model_workers
 
 echo "--------------------------------------------------"
 echo "Transcribing dataset files with $1"
 export MODEL_DIR="$1"
-mkdir -p "./$1/research_output_$dataset_name"
 cd "$1"
 shopt -s nullglob
 
 # Temporary folder to store per-file data
-temp_dir="./temp_${dataset_name}_${chunk_basename}"
+temp_dir="./${temp_name}"
 rm -rf "$temp_dir"
 mkdir "$temp_dir"
 export temp_dir
 
+# A plain chunk is a single-dataset manifest
+if [[ "$2" != "--packed" ]]; then
+    manifest_file="$temp_dir/manifest.tsv"
+    awk -v d="$2" -v t="$4" 'NF {print d "\t" t "\t" $0}' "$5" >"$manifest_file"
+fi
+export manifest_file
+
+mapfile -t manifest_datasets < <(cut -f1 "$manifest_file" | sort -u)
+for dataset in "${manifest_datasets[@]}"; do
+    mkdir -p "./research_output_${dataset// /_}" "$temp_dir/${dataset// /_}"
+done
+
 # Activate the Conda environment
-conda activate /scratch/gilbreth/ochaturv/.conda/envs/running-env-"$model_name"
+conda activate "$running_env"
 
 # Function to process one audio file
 transcribe_file() {
@@ -77,18 +117,25 @@ transcribe_file() {
     local original_file="$1"
 
     local slot="$2"
-    # echo "Using GPU: $CUDA_VISIBLE_DEVICES"
-    echo "Using GPU: $((slot - 1))"
+    local dataset_name=${3// /_}
+    local audio_type=${4// /_}
+    # The dataset list path, which keys the decoded-audio cache (load_audio), even when $1 is a staged copy
+    export ORIGINAL_INPUT="${5:-$original_file}"
+    # CPU-only jobs leave CUDA_VISIBLE_DEVICES unset
+    if [[ "$gpu_count" -gt 0 ]]; then
+        export CUDA_VISIBLE_DEVICES=$(((slot - 1) % gpu_count))
+        echo "Using GPU: $CUDA_VISIBLE_DEVICES"
+    fi
 
     local file="$original_file" # Default file to process
     local base_name=$(basename "$original_file" .$audio_type)
 
     local transcription_path="./research_output_${dataset_name}/${base_name}.mid"
-    local runtime_file="$temp_dir/${base_name}.runtime"
+    local runtime_file="$temp_dir/${dataset_name}/${base_name}.runtime"
 
     local temp_wav_created=0
     if [[ "$audio_type" != "wav" ]]; then
-        local temp_wav="$temp_dir/${base_name}.wav"
+        local temp_wav="$temp_dir/${dataset_name}/${base_name}.wav"
         echo "Converting $original_file to temporary WAV file..."
         ffmpeg -loglevel error -y -i "$original_file" -ac 1 -ar 44100 "$temp_wav"
         file="$temp_wav"
@@ -99,7 +146,7 @@ transcribe_file() {
 
     local start_time=$(date +%s.%N)
 
-    CUDA_VISIBLE_DEVICES=$((slot - 1)) python3 main.py -i "$file" -o "$transcription_path"
+    python3 main.py -i "$file" -o "$transcription_path"
 
     local end_time=$(date +%s.%N)
 
@@ -108,24 +155,116 @@ transcribe_file() {
         rm -f "$file"
     fi
 
+    # Free the staging slot so the next file can be copied to scratch
+    if [[ -n "$stage_dir" && "$original_file" == "$stage_dir"/* ]]; then
+        rm -f "$original_file"
+    fi
+
     # Runtime calculation
     local runtime=$(echo "$end_time - $start_time" | bc)
     echo "$runtime" >"$runtime_file"
     echo "Processed ${base_name}.$audio_type in $runtime seconds"
 }
+
+# Transcribe the whole manifest with one model process per GPU (main.py --batch)
+transcribe_batch() {
+    local batch_dir="$temp_dir/batch"
+    local shards=$model_workers
+    mkdir -p "$batch_dir"
+
+    # input, output and runtime paths for every manifest entry
+    while IFS=$'\t' read -r dataset audio file; do
+        local dataset_name=${dataset// /_}
+        local audio_type=${audio// /_}
+        local base_name=$(basename "$file" .$audio_type)
+        local input="$file"
+        if [[ "$audio_type" != "wav" ]]; then
+            input="$temp_dir/${dataset_name}/${base_name}.wav"
+            ffmpeg -loglevel error -y -i "$file" -ac 1 -ar 44100 "$input"
+        fi
+        printf '%s\t%s\t%s\t%s\n' "$input" "./research_output_${dataset_name}/${base_name}.mid" "$temp_dir/${dataset_name}/${base_name}.runtime" "$file"
+    done <"$manifest_file" >"$batch_dir/all.tsv"
+
+    split -n r/"$shards" -d "$batch_dir/all.tsv" "$batch_dir/shard_"
+
+    local slot=0
+    for shard in "$batch_dir"/shard_*; do
+        (
+            local prev=$(date +%s.%N)
+            cut -f1,2,4 "$shard" >"$shard.list"
+            if [[ "$gpu_count" -gt 0 ]]; then
+                export CUDA_VISIBLE_DEVICES=$((slot % gpu_count))
+            fi
+            python3 main.py --batch "$shard.list"
+
+            # The model runs sequentially, so each file's runtime is the gap between output completions
+            while IFS=$'\t' read -r input output runtime_file _; do
+                [[ -f "$output" ]] && printf '%s\t%s\t%s\n' "$(date -r "$output" +%s.%N)" "$runtime_file" "$(basename "$input")"
+            done <"$shard" | sort -n | while IFS=$'\t' read -r done_time runtime_file name; do
+                local runtime=$(echo "$done_time - $prev" | bc)
+                echo "$runtime" >"$runtime_file"
+                echo "Processed $name in $runtime seconds"
+                prev=$done_time
+            done
+        ) &
+        slot=$((slot + 1))
+    done
+    wait
+}
 export -f transcribe_file
 export PATH CONDA_PREFIX LD_LIBRARY_PATH
 
-# Run jobs in parallel using GNU Parallel
-cat "$chunk_file" | parallel -j "$gpu_count" transcribe_file {} {%}
+# Models that accept --batch load their weights once per GPU instead of once per file; for the others a
+# packed job only saves scheduling overhead, as main.py still starts once per file
+if python3 main.py --help 2>/dev/null | grep -q -- "--batch"; then
+    echo "Model supports --batch, transcribing with $model_workers warm model process(es)"
+    transcribe_batch
+elif [[ "${STAGE_AHEAD:-32}" -gt 0 ]]; then
+    # Copy audio to node-local scratch up to STAGE_AHEAD files ahead of the model
+    stage_dir="${TMPDIR:-/tmp}/stage_${SLURM_JOB_ID:-$$}"
+    export stage_dir
+    python3 ../staging.py --manifest "$manifest_file" --scratch "$stage_dir" --ahead "${STAGE_AHEAD:-32}" --workers "${STAGE_WORKERS:-4}" \
+        | parallel --colsep '\t' -j "$model_workers" transcribe_file {3} {%} {1} {2} {4}
+    rm -rf "$stage_dir"
+else
+    # Run jobs in parallel using GNU Parallel
+    cat "$manifest_file" | parallel --colsep '\t' -j "$model_workers" transcribe_file {3} {%} {1} {2}
+fi
 
 # Deactivate the running-env Conda environment
 conda deactivate
 
+# Stream this chunk's transcriptions to Drive while it is scored (run.py --stream-upload)
+upload_pid=""
+if [[ -n "$UPLOAD_RUN_ID" ]]; then
+    while IFS=$'\t' read -r dataset audio file; do
+        transcription="$PWD/research_output_${dataset// /_}/$(basename "$file" ".${audio// /_}").mid"
+        [[ -f "$transcription" ]] && echo "$transcription" >>"$temp_dir/${dataset// /_}/uploads.txt"
+    done <"$manifest_file"
+
+    (
+        conda activate "$upload_env"
+        for dataset in "${manifest_datasets[@]}"; do
+            uploads="$temp_dir/${dataset// /_}/uploads.txt"
+            [[ -s "$uploads" ]] || continue
+            python ../upload.py \
+                --main-folder="$MAIN_FOLDER_ID" \
+                --model-name="$1" \
+                --dataset-name="${dataset// /_}" \
+                --local-directory="./research_output_${dataset// /_}" \
+                --run-id="$UPLOAD_RUN_ID" \
+                --files-from="$uploads" \
+                --chunk-name="$chunk_basename" \
+                ${UPLOAD_ARCHIVE:+--archive="$UPLOAD_ARCHIVE" --archive-name="${chunk_basename}_${dataset// /_}"}
+        done
+    ) >"$temp_dir/upload.log" 2>&1 &
+    upload_pid=$!
+fi
+
 # Compute average runtime
 total=0
 count=0
-for file in "$temp_dir"/*.runtime; do
+for file in "$temp_dir"/*/*.runtime; do
     if [[ -f "$file" ]]; then
         value=$(cat "$file")
         # Remove any whitespace
@@ -147,21 +286,22 @@ fi
 echo "--------------------------------------------------"
 echo "Scoring all transcriptions from $1"
 
-details_file="./details_${dataset_name}.txt"
-export details_file
-touch "$details_file"
+for dataset in "${manifest_datasets[@]}"; do
+    details_file="./details_${dataset// /_}.txt"
+    touch "$details_file"
 
-if [ ! -s "$details_file" ]; then
-    {
-        echo "Model Name: $model_name"
-        echo "Dataset Name: $2"
-        echo ""
-        echo ""
-    } >"$details_file"
-fi
+    if [ ! -s "$details_file" ]; then
+        {
+            echo "Model Name: $model_name"
+            echo "Dataset Name: $dataset"
+            echo ""
+            echo ""
+        } >"$details_file"
+    fi
+done
 
 # Activate the Conda environment
-conda activate /scratch/gilbreth/ochaturv/.conda/envs/scoring-env
+conda activate "$scoring_env"
 
 # Function to score one transcribed file
 score_transcription() {
@@ -169,6 +309,8 @@ score_transcription() {
     echo "Scoring file: $1"
     local original_file="$1"
     local slot="$2"
+    local dataset_name=${3// /_}
+    local audio_type=${4// /_}
 
     # Base name without extension, using the same $audio_type as before
     local base_name
@@ -182,9 +324,9 @@ score_transcription() {
     fi
 
     local transcription_path="./research_output_${dataset_name}/${base_name}.mid"
-    local temp_detail_file="$temp_dir/${base_name}.details"
-    local fmeasure_file="$temp_dir/${base_name}.fmeasure"
-    local runtime_file="$temp_dir/${base_name}.runtime"
+    local temp_detail_file="$temp_dir/${dataset_name}/${base_name}.details"
+    local fmeasure_file="$temp_dir/${dataset_name}/${base_name}.fmeasure"
+    local runtime_file="$temp_dir/${dataset_name}/${base_name}.runtime"
 
     # Duration (use the original audio file)
     local duration=$(ffprobe -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1 "$original_file")
@@ -243,25 +385,28 @@ score_transcription() {
 export -f score_transcription
 export PATH CONDA_PREFIX LD_LIBRARY_PATH
 
-cat "$chunk_file" | parallel -j "$cpu_count" score_transcription {} {%}
+cat "$manifest_file" | parallel --colsep '\t' -j "$cpu_count" score_transcription {3} {%} {1} {2}
 
 # Deactivate the scoring-env Conda environment
 conda deactivate
 
 echo "--------------------------------------------------"
 
-# Merge per-file details into shared details.txt without overwriting
-echo "Appending per-file details into $details_file"
-for file in "$temp_dir"/*.details; do
-    if [[ -f "$file" ]]; then
-        cat "$file" >> "$details_file"
-    fi
+# Merge per-file details into each dataset's shared details file without overwriting
+for dataset in "${manifest_datasets[@]}"; do
+    details_file="./details_${dataset// /_}.txt"
+    echo "Appending per-file details into $details_file"
+    for file in "$temp_dir/${dataset// /_}"/*.details; do
+        if [[ -f "$file" ]]; then
+            cat "$file" >> "$details_file"
+        fi
+    done
 done
 
 # Compute average F-measure
 total=0
 count=0
-for file in "$temp_dir"/*.fmeasure; do
+for file in "$temp_dir"/*/*.fmeasure; do
     if [[ -f "$file" ]]; then
         value=$(cat "$file")
         if [[ "$value" =~ ^[0-9]+(\.[0-9]+)?$ ]]; then
@@ -277,6 +422,12 @@ else
     echo "No valid F-measures collected."
 fi
 
+if [[ -n "$upload_pid" ]]; then
+    echo "Waiting for streamed upload to finish"
+    wait "$upload_pid" || echo "Warning: streamed upload failed, the final upload job will retry it"
+    cat "$temp_dir/upload.log"
+fi
+
 # Clean up
 rm -rf "$temp_dir"
 cd ..
@@ -295,7 +446,7 @@ overall_runtime_formatted=$(printf '%02d:%02d:%02d' "$hours" "$minutes" "$second
 echo "Total runtime: $overall_runtime_formatted"
 
 curl -s -X POST -H "Content-Type: application/json" -d "{
-    \"content\": \"**Model Evaluation Completed**\n**Model:** \`$1\`\n**Dataset:** \`$2\`\n**Chunk:** \`$chunk_basename\`\n**Average F-measure:** \`$avg_fmeasure\`\n**Total Runtime:** \`$overall_runtime_formatted\`\",
+    \"content\": \"**Model Evaluation Completed**\n**Model:** \`$1\`\n**Dataset:** \`$dataset_label\`\n**Chunk:** \`$chunk_basename\`\n**Average F-measure:** \`$avg_fmeasure\`\n**Total Runtime:** \`$overall_runtime_formatted\`\",
     \"avatar_url\": \"https://droplr.com/wp-content/uploads/2020/10/Screenshot-on-2020-10-21-at-10_29_26.png\"
 }" \
     -H "Content-Type: application/json" \
@@ -0,0 +1,237 @@
+#!/opt/homebrew/bin/python3
+"""
+Name: scheduler.py
+Purpose: Job scheduler backends for run.py (SLURM, plus a local stand-in for testing)
+"""
+
+__author__ = "Ojas Chaturvedi"
+__github__ = "github.com/ojas-chaturvedi"
+__license__ = "MIT"
+
+import os
+import shlex
+import getpass
+import subprocess
+import itertools
+
+# SLURM states after which a job will never run again
+TERMINAL_STATES = {
+    "COMPLETED",
+    "FAILED",
+    "TIMEOUT",
+    "OUT_OF_MEMORY",
+    "NODE_FAIL",
+    "BOOT_FAIL",
+    "PREEMPTED",
+    "CANCELLED",
+    "DEADLINE",
+}
+
+
+def extract_slurm_id(output: str) -> str:
+    """Extract SLURM job ID from sbatch output."""
+    return next((word for word in output.split() if word.isdigit()), "")
+
+
+def normalize_state(state: str) -> str:
+    """Reduce a raw sacct/squeue state ('CANCELLED by 123', 'OUT_OF_ME+') to its base name."""
+    state = state.strip().split()[0] if state.strip() else "UNKNOWN"
+    state = state.rstrip("+")
+    if state.startswith("OUT_OF_ME"):
+        return "OUT_OF_MEMORY"
+    return state
+
+
+def classify_failure(state: str) -> str:
+    """Map a terminal job state to the failure class used for retry decisions."""
+    state = normalize_state(state)
+    if state == "COMPLETED":
+        return "ok"
+    if state in ("TIMEOUT", "DEADLINE"):
+        return "walltime"
+    if state == "OUT_OF_MEMORY":
+        return "oom"
+    if state in ("NODE_FAIL", "BOOT_FAIL", "PREEMPTED"):
+        return "node"
+    if state == "CANCELLED":
+        return "cancelled"
+    return "failed"
+
+
+class SlurmScheduler:
+    """
+    Submit and poll jobs through sbatch, sacct and squeue. With `host` set, every
+    command runs over ssh as `user` on that cluster's login node from `workdir`.
+    """
+
+    def __init__(self, host=None, workdir=None, user=None):
+        self.host = host
+        self.workdir = workdir
+        self.user = user
+
+    def _run(self, command):
+        if self.host:
+            remote = shlex.join(command)
+            if self.workdir:
+                remote = f"cd {shlex.quote(self.workdir)} && {remote}"
+            target = f"{self.user}@{self.host}" if self.user else self.host
+            command = ["ssh", "-o", "BatchMode=yes", target, remote]
+        return subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def submit(self, command):
+        """Run sbatch command and return job ID if successful."""
+        try:
+            result = self._run(command)
+            output = result.stdout.decode().strip()
+            return extract_slurm_id(output)
+        except subprocess.CalledProcessError as e:
+            print(f"\tFailed to submit job: {e.stderr.decode().strip()}")
+            return None
+
+    def states(self, job_ids):
+        """Return {job_id: state} for the given jobs, using sacct with squeue as fallback."""
+        job_ids = [job_id for job_id in job_ids if job_id]
+        if not job_ids:
+            return {}
+
+        states = {}
+        try:
+            result = self._run(["sacct", "-n", "-P", "-X", "-o", "JobID,State", "-j", ",".join(job_ids)])
+            for line in result.stdout.decode().splitlines():
+                if "|" not in line:
+                    continue
+                job_id, state = line.split("|", 1)
+                states[job_id.strip()] = normalize_state(state)
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"\tsacct unavailable, falling back to squeue: {e}")
+
+        missing = [job_id for job_id in job_ids if job_id not in states]
+        if missing:
+            try:
+                result = self._run(["squeue", "-h", "-o", "%i|%T", "-j", ",".join(missing)])
+                for line in result.stdout.decode().splitlines():
+                    if "|" in line:
+                        job_id, state = line.split("|", 1)
+                        states[job_id.strip()] = normalize_state(state)
+            except (subprocess.CalledProcessError, FileNotFoundError):
+                pass
+
+        return states
+
+    def queue_depth(self):
+        """
+        Number of our jobs currently pending or running. Jobs held with --hold
+        are left out: monitor mode releases them only after submission ends, so
+        counting them could keep a throttled submission waiting for ever.
+        """
+        user = self.user or os.environ.get("USER") or getpass.getuser()
+        try:
+            result = self._run(["squeue", "-h", "-u", user, "-t", "PENDING,RUNNING", "-o", "%i|%r"])
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"\tCould not read queue depth: {e}")
+            return float("inf")  # Treat as full so throttled submission waits
+        depth = 0
+        for line in result.stdout.decode().splitlines():
+            if line.strip() and line.split("|", 1)[-1].strip() != "JobHeldUser":
+                depth += 1
+        return depth
+
+    def backlog(self, account=None, partition=None):
+        """Pending jobs of all users in an account's (or partition's) queue, a proxy for how busy the cluster is."""
+        command = ["squeue", "-h", "-t", "PENDING", "-o", "%i"]
+        if account:
+            command += ["-A", account]
+        elif partition:
+            command += ["-p", partition]
+        try:
+            result = self._run(command)
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"\tCould not read backlog{f' on {self.host}' if self.host else ''}: {e}")
+            return float("inf")  # Unreachable clusters get no work
+        return len(result.stdout.decode().split())
+
+    def release(self, job_id):
+        """Release a job that was submitted with --hold."""
+        try:
+            self._run(["scontrol", "release", job_id])
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return False
+        return True
+
+
+class LocalScheduler:
+    """
+    In-process stand-in for SLURM used by tests and dry runs.
+
+    Jobs are keyed by their -J name. `outcomes` maps a job name to the list of
+    terminal states it returns on successive submissions; anything not listed
+    completes successfully. Each call to states() or queue_depth() is one tick
+    of a fake clock, and unheld jobs finish `runtime_ticks` ticks after
+    submission. With `max_queued` set, submissions beyond that many unfinished
+    jobs are rejected like a per-user job limit. `backlog_jobs` stands in for
+    other users' pending jobs when splitting work between clusters.
+    """
+
+    def __init__(self, outcomes=None, runtime_ticks=0, max_queued=None, backlog_jobs=0):
+        self.outcomes = {name: list(states) for name, states in (outcomes or {}).items()}
+        self.runtime_ticks = runtime_ticks
+        self.max_queued = max_queued
+        self.backlog_jobs = backlog_jobs
+        self.clock = 0
+        self.jobs = {}
+        self.submitted = []
+        self.max_depth_seen = 0
+        self._ids = itertools.count(1000)
+
+    def _tick(self):
+        self.clock += 1
+        for job in self.jobs.values():
+            if not job["held"] and self.clock >= job["finish_at"]:
+                job["state"] = job["final_state"]
+
+    def _depth(self):
+        return sum(job["state"] not in TERMINAL_STATES for job in self.jobs.values())
+
+    def _active_depth(self):
+        return sum(job["state"] not in TERMINAL_STATES and not job["held"] for job in self.jobs.values())
+
+    def submit(self, command):
+        if self.max_queued is not None and self._depth() >= self.max_queued:
+            print("\tFailed to submit job: QOSMaxSubmitJobPerUserLimit")
+            return None
+        job_id = str(next(self._ids))
+        name = command[command.index("-J") + 1] if "-J" in command else job_id
+        held = "--hold" in command
+        queued = self.outcomes.get(name)
+        final_state = queued.pop(0) if queued else "COMPLETED"
+        self.jobs[job_id] = {
+            "name": name,
+            "command": list(command),
+            "state": "PENDING",
+            "final_state": final_state,
+            "held": held,
+            "finish_at": self.clock + self.runtime_ticks,
+        }
+        self.submitted.append(list(command))
+        self.max_depth_seen = max(self.max_depth_seen, self._active_depth())
+        return job_id
+
+    def states(self, job_ids):
+        self._tick()
+        return {job_id: self.jobs[job_id]["state"] for job_id in job_ids if job_id in self.jobs}
+
+    def queue_depth(self):
+        # Held jobs are not counted, as in SlurmScheduler.queue_depth
+        self._tick()
+        return self._active_depth()
+
+    def backlog(self, account=None, partition=None):
+        return self.backlog_jobs + sum(job["state"] == "PENDING" for job in self.jobs.values())
+
+    def release(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        job["held"] = False
+        job["finish_at"] = self.clock + self.runtime_ticks
+        return True
@@ -0,0 +1,115 @@
+#!/opt/homebrew/bin/python3
+"""
+Name: staged.py
+Purpose: Stratified file sampling and paired confidence intervals for run.py's staged evaluation mode
+"""
+
+__author__ = "Ojas Chaturvedi"
+__github__ = "github.com/ojas-chaturvedi"
+__license__ = "MIT"
+
+import os
+import math
+import random
+import bisect
+from statistics import NormalDist
+
+DURATION_BINS = 4  # Duration quantiles per dataset
+INSTRUMENT_EDGES = [2, 4]  # Instrument count bins: 1, 2-3, 4+
+MIN_PAIRED_FILES = 30  # Files two models must share before their order can count as resolved
+
+
+def stratum_keys(rows):
+    """Map each manifest path to its (duration quantile, instrument bin) stratum."""
+    durations = sorted(row["duration_seconds"] for row in rows if row.get("duration_seconds"))
+    cuts = [durations[len(durations) * q // DURATION_BINS] for q in range(1, DURATION_BINS)] if durations else []
+
+    keys = {}
+    for row in rows:
+        duration = row.get("duration_seconds")
+        instruments = row.get("instruments")
+        duration_bin = bisect.bisect_right(cuts, duration) if duration else -1
+        instrument_bin = bisect.bisect_right(INSTRUMENT_EDGES, instruments) if instruments else -1
+        keys[row["path"]] = (duration_bin, instrument_bin)
+    return keys
+
+
+def stratified_order(rows, seed=0):
+    """
+    Order a dataset's files so every prefix is a proportional stratified random
+    sample: files are shuffled within their stratum and then interleaved by
+    their relative position in it. Taking the next slice expands the sample.
+    """
+    rng = random.Random(seed)
+    strata = {}
+    for path, key in stratum_keys(rows).items():
+        strata.setdefault(key, []).append(path)
+
+    positioned = []
+    for paths in strata.values():
+        rng.shuffle(paths)
+        for i, path in enumerate(paths):
+            positioned.append(((i + rng.random()) / len(paths), path))
+    positioned.sort()
+    return [path for _, path in positioned]
+
+
+def read_fmeasures(details_path):
+    """Return {filename: F-measure} from a details_{dataset}.txt file; later entries win."""
+    scores = {}
+    if not os.path.isfile(details_path):
+        return scores
+
+    filename = None
+    with open(details_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if line and ":" not in line:
+                filename = line
+            elif line.startswith("F-measure:") and filename:
+                try:
+                    scores[filename] = float(line.split()[1])
+                except (IndexError, ValueError):
+                    pass
+                filename = None
+    return scores
+
+
+def paired_interval(scores_a, scores_b, z):
+    """Mean and half-width of the paired F-measure difference a - b over shared files."""
+    shared = scores_a.keys() & scores_b.keys()
+    diffs = [scores_a[name] - scores_b[name] for name in shared]
+    if len(diffs) < 2:
+        return 0.0, math.inf, len(diffs)
+    mean = sum(diffs) / len(diffs)
+    variance = sum((d - mean) ** 2 for d in diffs) / (len(diffs) - 1)
+    return mean, z * math.sqrt(variance / len(diffs)), len(diffs)
+
+
+def rank_models(scores, confidence=0.95):
+    """
+    Rank models by mean F-measure and test each adjacent pair with a paired
+    interval (Bonferroni-corrected across pairs). Returns (ranking, comparisons,
+    unresolved, failed): unresolved is the set of models in a pair whose order
+    the sample cannot yet settle, and failed the models with no F-measures at
+    all (crashed chunks, missing details file), which are left out of the
+    ranking rather than sampled further.
+    """
+    ranking = sorted(
+        (model for model in scores if scores[model]),
+        key=lambda model: sum(scores[model].values()) / len(scores[model]),
+        reverse=True,
+    )
+    failed = {model for model in scores if not scores[model]}
+    unresolved = set()
+
+    pairs = max(len(ranking) - 1, 1)
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / (2 * pairs))
+    comparisons = []
+    for better, worse in zip(ranking, ranking[1:]):
+        mean, half_width, shared = paired_interval(scores[better], scores[worse], z)
+        resolved = shared >= MIN_PAIRED_FILES and abs(mean) > half_width
+        comparisons.append((better, worse, mean, half_width, shared, resolved))
+        if not resolved:
+            unresolved.update((better, worse))
+    return ranking, comparisons, unresolved, failed
@@ -0,0 +1,112 @@
+#!/opt/homebrew/bin/python3
+"""
+Name: staging.py
+Purpose: Copy a chunk's audio to node-local scratch ahead of the model and stream the staged manifest
+"""
+
+__author__ = "Ojas Chaturvedi"
+__github__ = "github.com/ojas-chaturvedi"
+__license__ = "MIT"
+
+import os
+import sys
+import time
+import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DEFAULT_AHEAD = 32
+DEFAULT_WORKERS = 4
+POLL_SECONDS = 0.2
+
+
+def read_manifest(path):
+    """Read a manifest of (dataset, audio type, file) rows; a bare list is treated as one column of files."""
+    entries = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            parts = line.split("\t")
+            entries.append(tuple(parts) if len(parts) == 3 else ("", "", line.strip()))
+    return entries
+
+
+def stage_file(entry, scratch_dir):
+    """Copy one file into scratch and return (entry, staged path), falling back to the original on error."""
+    dataset, audio_type, source = entry
+    target_dir = os.path.join(scratch_dir, dataset.replace(" ", "_") or "files")
+    target = os.path.join(target_dir, os.path.basename(source))
+    try:
+        os.makedirs(target_dir, exist_ok=True)
+        shutil.copyfile(source, target + ".part")
+        os.replace(target + ".part", target)
+        return entry, target
+    except OSError as e:
+        print(f"Staging failed for {source}, reading from source: {e}", file=sys.stderr)
+        return entry, source
+
+
+def emit(entry, path):
+    """Write a staged row: the manifest row with the staged path, plus the original path as a fourth column."""
+    dataset, audio_type, source = entry
+    if dataset:
+        sys.stdout.write(f"{dataset}\t{audio_type}\t{path}\t{source}\n")
+    else:
+        sys.stdout.write(f"{path}\n")
+    sys.stdout.flush()
+
+
+def stage_manifest(entries, scratch_dir, ahead=DEFAULT_AHEAD, workers=DEFAULT_WORKERS):
+    """
+    Stage entries with a bounded thread pool, keeping at most `ahead` staged files
+    on disk. The consumer deletes each staged file once it is processed, which
+    frees a slot for the next copy.
+    """
+    os.makedirs(scratch_dir, exist_ok=True)
+    outstanding = set()  # Staged or in-flight files the consumer has not deleted yet
+    pending = {}
+
+    def wait_for_slot():
+        while len(outstanding) >= ahead:
+            for path in list(outstanding):
+                if path.startswith(scratch_dir) and not os.path.exists(path):
+                    outstanding.discard(path)
+            if len(outstanding) >= ahead:
+                drain(block=False)
+                time.sleep(POLL_SECONDS)
+
+    def drain(block):
+        done = [f for f in pending if f.done()] if not block else list(as_completed(pending))
+        for future in done:
+            key = pending.pop(future)
+            entry, path = future.result()
+            outstanding.discard(key)
+            if path.startswith(scratch_dir):
+                outstanding.add(path)
+            emit(entry, path)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for index, entry in enumerate(entries):
+            wait_for_slot()
+            key = f"inflight:{index}"
+            outstanding.add(key)
+            pending[executor.submit(stage_file, entry, scratch_dir)] = key
+            drain(block=False)
+        drain(block=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stage chunk audio to node-local scratch ahead of the model.")
+    parser.add_argument("--manifest", required=True, help="Chunk list or packed manifest to stage")
+    parser.add_argument("--scratch", required=True, help="Node-local directory to stage into")
+    parser.add_argument("--ahead", type=int, default=DEFAULT_AHEAD, help="Maximum staged files not yet processed")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Parallel copy threads")
+    args = parser.parse_args()
+
+    stage_manifest(read_manifest(args.manifest), os.path.abspath(args.scratch), max(args.ahead, 1), args.workers)
+
+
+if __name__ == "__main__":
+    main()
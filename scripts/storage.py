@@ -0,0 +1,583 @@
+#!/opt/homebrew/bin/python3
+"""
+Name: storage.py
+Purpose: Storage backends for upload.py and dataframe.py: Google Drive, and a filesystem stand-in for offline tests and benchmarks
+"""
+
+__author__ = "Ojas Chaturvedi"
+__github__ = "github.com/ojas-chaturvedi"
+__license__ = "MIT"
+
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import shutil
+import hashlib
+import threading
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+PAGE_SIZE = 1000  # Drive's maximum page size for file listings
+METADATA_FIELDS = ["id", "title", "mimeType", "md5Checksum", "fileSize", "modifiedDate"]
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 1.0  # Seconds; attempt n sleeps a random time up to BACKOFF_BASE * 2**n
+BACKOFF_CAP = 64.0
+
+
+class RateLimitError(Exception):
+    """A 429 from the stand-in, shaped like pydrive2's ApiRequestError so callers classify it the same way."""
+
+    def __init__(self, message="429 userRateLimitExceeded"):
+        super().__init__(message)
+        self.error = {"code": 429, "message": message}
+
+
+def classify_error(error):
+    """'rate' for Drive rate limits (403 rate-limit reasons, 429), 'retry' for transient errors, None otherwise."""
+    if isinstance(error, (FileNotFoundError, PermissionError, IsADirectoryError)):
+        return None
+    status = None
+    details = getattr(error, "error", None)  # pydrive2's ApiRequestError carries the decoded error body
+    if isinstance(details, dict):
+        status = details.get("code")
+    if status is None and getattr(error, "resp", None) is not None:
+        status = getattr(error.resp, "status", None)
+    text = str(error)
+    if status == 429 or "RateLimitExceeded" in text or "rateLimitExceeded" in text:
+        return "rate"
+    if status is None or status == 408 or int(status) >= 500:
+        return "retry"  # Connection resets and server errors
+    return None
+
+
+def backoff_seconds(attempt):
+    """Full-jitter exponential backoff, so throttled workers do not retry in lockstep."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+
+def call_with_retries(function, *args, attempts=MAX_ATTEMPTS):
+    """Call `function(*args)`, retrying rate limits and transient errors with backoff; re-raise anything else."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return function(*args)
+        except Exception as e:
+            if classify_error(e) is None or attempt == attempts:
+                raise
+            time.sleep(backoff_seconds(attempt))
+
+
+async def call_with_retries_async(function, *args, attempts=MAX_ATTEMPTS):
+    """call_with_retries for coroutine functions, backing off without blocking the event loop."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return await function(*args)
+        except Exception as e:
+            if classify_error(e) is None or attempt == attempts:
+                raise
+            await asyncio.sleep(backoff_seconds(attempt))
+
+
+class DownloadError(Exception):
+    """A failed content download, with the HTTP status in .error like pydrive2's ApiRequestError."""
+
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.error = {"code": status, "message": message}
+
+
+class StorageBackend:
+    """
+    Folder/file operations used by the upload and results scripts. Items are
+    dicts with METADATA_FIELDS (Drive v2 names); folders have FOLDER_MIME.
+    """
+
+    def list_page(self, folder_id, page_token=None, folders_only=False, files_only=False, title=None, page_size=PAGE_SIZE):
+        """
+        One page of a folder's non-trashed children: (items, token for the next
+        page or None on the last). Each page is a single request, so callers can
+        retry or spread pages across threads.
+        """
+        raise NotImplementedError
+
+    def list_pages(self, folder_id, folders_only=False, files_only=False, title=None, page_size=PAGE_SIZE):
+        """Yield the non-trashed children of a folder one page (list of items) at a time."""
+        page_token = None
+        while True:
+            items, page_token = self.list_page(folder_id, page_token, folders_only, files_only, title, page_size)
+            yield items
+            if not page_token:
+                return
+
+    def list_children(self, folder_id, folders_only=False, files_only=False, title=None):
+        """All non-trashed children of a folder."""
+        return [item for page in self.list_pages(folder_id, folders_only, files_only, title) for item in page]
+
+    def create_folder(self, title, parent_id):
+        """Create a folder and return its ID."""
+        raise NotImplementedError
+
+    def make_public(self, file_id):
+        """Let anyone with the link read a file or folder."""
+        raise NotImplementedError
+
+    def upload_file(self, local_path, title, parent_id, file_id=None):
+        """Upload a local file (replacing the content of `file_id` when given) and return its ID."""
+        raise NotImplementedError
+
+    def upload_string(self, text, title, parent_id):
+        """Create a small text file and return its ID."""
+        raise NotImplementedError
+
+    def download_file(self, file_id, local_path):
+        """Save a file's content to `local_path`."""
+        raise NotImplementedError
+
+    def download_bytes(self, file_id, offset=None, size=None):
+        """A file's content, or `size` bytes from `offset` (a range read)."""
+        raise NotImplementedError
+
+    def delete(self, file_id):
+        """Delete a file or folder (and its contents)."""
+        raise NotImplementedError
+
+    def async_session(self, concurrency):
+        """
+        A session whose `await download_bytes(file_id)` fetches file contents
+        into memory from an event loop, reusing up to `concurrency` pooled
+        connections; `await close()` when done. Create it inside the running loop.
+        """
+        raise NotImplementedError
+
+    def batch(self, calls):
+        """
+        Run metadata calls in one round-trip. `calls` is a list of (operation,
+        args) with operation one of BATCH_OPERATIONS; returns one result per
+        call, or the exception it raised.
+        """
+        raise NotImplementedError
+
+
+# Metadata operations a batch may contain: name -> what it returns
+BATCH_OPERATIONS = {
+    "find_folders": "IDs of folders titled `title` in a parent (args: parent_id, title)",
+    "exists": "whether a non-trashed file or folder has this ID (args: file_id)",
+    "create_folder": "the new folder's ID (args: title, parent_id)",
+    "make_public": "None (args: file_id)",
+    "delete": "None (args: file_id)",
+}
+
+
+class DriveBackend(StorageBackend):
+    """Google Drive through an authenticated pydrive2 GoogleDrive client."""
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    @staticmethod
+    def _item(file):
+        return {field: file.get(field) for field in METADATA_FIELDS}
+
+    def list_page(self, folder_id, page_token=None, folders_only=False, files_only=False, title=None, page_size=PAGE_SIZE):
+        query = f"'{folder_id}' in parents and trashed=false"
+        if folders_only:
+            query += f" and mimeType='{FOLDER_MIME}'"
+        elif files_only:
+            query += f" and mimeType!='{FOLDER_MIME}'"
+        if title is not None:
+            escaped = title.replace("\\", "\\\\").replace("'", "\\'")
+            query += f" and title='{escaped}'"
+        parameters = {"q": query, "maxResults": page_size}
+        if page_token:
+            parameters["pageToken"] = page_token
+        # Advancing a ListFile fetches one API page and leaves nextPageToken in its pageToken
+        listing = self.drive.ListFile(parameters)
+        page = next(listing, [])
+        return [self._item(file) for file in page], listing.get("pageToken")
+
+    def create_folder(self, title, parent_id):
+        metadata = {"title": title, "mimeType": FOLDER_MIME}
+        if parent_id:
+            metadata["parents"] = [{"id": parent_id}]
+        folder = self.drive.CreateFile(metadata)
+        folder.Upload()
+        return folder["id"]
+
+    def make_public(self, file_id):
+        self.drive.CreateFile({"id": file_id}).InsertPermission({"type": "anyone", "role": "reader"})
+
+    def upload_file(self, local_path, title, parent_id, file_id=None):
+        if file_id:
+            file = self.drive.CreateFile({"id": file_id})
+        else:
+            file = self.drive.CreateFile({"title": title, "parents": [{"id": parent_id}]})
+        file.SetContentFile(local_path)
+        file.Upload()
+        return file["id"]
+
+    def upload_string(self, text, title, parent_id):
+        file = self.drive.CreateFile({"title": title, "parents": [{"id": parent_id}]})
+        file.SetContentString(text)
+        file.Upload()
+        return file["id"]
+
+    def download_file(self, file_id, local_path):
+        self.drive.CreateFile({"id": file_id}).GetContentFile(local_path)
+
+    def download_bytes(self, file_id, offset=None, size=None):
+        http = self.drive.auth.Get_Http_Object()
+        url = f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
+        headers = {"Range": f"bytes={offset}-{offset + size - 1}"} if offset is not None else {}
+        response, content = http.request(url, headers=headers)
+        if response.status == 206 or (response.status == 200 and offset is None):
+            return content
+        if response.status == 200:  # Range ignored; the whole file came back
+            return content[offset : offset + size]
+        raise IOError(f"Download of {file_id} failed with HTTP {response.status}")
+
+    def delete(self, file_id):
+        self.drive.CreateFile({"id": file_id}).Delete()
+
+    def async_session(self, concurrency):
+        return DriveAsyncSession(self.drive, concurrency)
+
+    def _batch_request(self, operation, args):
+        files = self.drive.auth.service.files()
+        if operation == "find_folders":
+            parent_id, title = args
+            escaped = title.replace("\\", "\\\\").replace("'", "\\'")
+            query = f"'{parent_id}' in parents and trashed=false and mimeType='{FOLDER_MIME}' and title='{escaped}'"
+            return files.list(q=query, maxResults=PAGE_SIZE, fields="items(id)")
+        if operation == "exists":
+            return files.get(fileId=args[0], fields="id,labels/trashed")
+        if operation == "create_folder":
+            title, parent_id = args
+            body = {"title": title, "mimeType": FOLDER_MIME}
+            if parent_id:
+                body["parents"] = [{"id": parent_id}]
+            return files.insert(body=body, fields="id")
+        if operation == "make_public":
+            return self.drive.auth.service.permissions().insert(
+                fileId=args[0], body={"type": "anyone", "role": "reader"}, fields="id"
+            )
+        if operation == "delete":
+            return files.delete(fileId=args[0])
+        raise ValueError(f"Unknown batch operation: {operation}")
+
+    @staticmethod
+    def _batch_result(operation, response):
+        if operation == "find_folders":
+            return [item["id"] for item in response.get("items", [])]
+        if operation == "exists":
+            return not response.get("labels", {}).get("trashed", False)
+        if operation == "create_folder":
+            return response["id"]
+        return None
+
+    def batch(self, calls):
+        # One multipart request to Drive's batch endpoint; callbacks arrive per call
+        results = [None] * len(calls)
+
+        def callback(request_id, response, exception):
+            index = int(request_id)
+            operation = calls[index][0]
+            if exception is None:
+                results[index] = self._batch_result(operation, response)
+            elif operation == "exists" and getattr(getattr(exception, "resp", None), "status", None) == 404:
+                results[index] = False
+            else:
+                results[index] = exception
+
+        request = self.drive.auth.service.new_batch_http_request(callback=callback)
+        for index, (operation, args) in enumerate(calls):
+            request.add(self._batch_request(operation, args), request_id=str(index))
+        request.execute(http=self.drive.auth.Get_Http_Object())
+        return results
+
+
+class DriveAsyncSession:
+    """
+    aiohttp client for Drive content downloads: keep-alive connections pooled up
+    to the concurrency limit, each request authorized with the service
+    account's current access token.
+    """
+
+    def __init__(self, drive, concurrency):
+        # Only the async download engine needs aiohttp
+        import aiohttp
+
+        self.drive = drive
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=300),
+        )
+
+    async def download_bytes(self, file_id):
+        # oauth2client refreshes the token itself once it expires
+        token = self.drive.auth.credentials.get_access_token().access_token
+        url = f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
+        async with self.session.get(url, headers={"Authorization": f"Bearer {token}"}) as response:
+            if response.status != 200:
+                raise DownloadError(response.status, await response.text())
+            return await response.read()
+
+    async def close(self):
+        await self.session.close()
+
+
+class LocalDriveBackend(StorageBackend):
+    """
+    Drive stand-in on the local filesystem. Every item is a metadata JSON file
+    under meta/{parent ID}/ with content under blobs/. Unknown folder IDs (such
+    as the main folder ID) act as existing empty folders. `latency` seconds are
+    added to every call, `bandwidth` bytes/second limits content transfer,
+    `requests_per_second` is enforced like Drive's per-user quota by raising
+    RateLimitError, and `error_rate` fails that fraction of calls at random.
+    A batch costs one call's latency, but each operation in it counts
+    against the quota, as on Drive.
+    """
+
+    def __init__(
+        self, root, latency=0.0, bandwidth=None, requests_per_second=None, error_rate=0.0, page_size=PAGE_SIZE
+    ):
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests_per_second = requests_per_second
+        self.error_rate = error_rate
+        self.max_page_size = page_size
+        self.calls = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_calls = 0
+        os.makedirs(os.path.join(root, "meta"), exist_ok=True)
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(root, "parents"), exist_ok=True)
+
+    def _charge(self, transfer_bytes=0, operations=1):
+        """Count a round-trip of `operations` calls against the quota; return (its simulated delay, whether it failed)."""
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start, self._window_calls = now, 0
+            self._window_calls += operations
+            over_quota = self.requests_per_second and self._window_calls > self.requests_per_second
+            failed = over_quota or random.random() < self.error_rate
+            if failed:
+                self.rate_limited += 1
+        return self.latency + (transfer_bytes / self.bandwidth if self.bandwidth else 0), failed
+
+    def _request(self, transfer_bytes=0, operations=1):
+        """Make a simulated round-trip: count it, wait out its latency and raise if it was rate limited."""
+        delay, failed = self._charge(transfer_bytes, operations)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise RateLimitError()
+
+    async def _request_async(self, transfer_bytes=0):
+        """_request for the async session, waiting without blocking the event loop."""
+        delay, failed = self._charge(transfer_bytes)
+        if delay:
+            await asyncio.sleep(delay)
+        if failed:
+            raise RateLimitError()
+
+    def _meta_path(self, parent_id, file_id):
+        return os.path.join(self.root, "meta", parent_id, f"{file_id}.json")
+
+    def _parent(self, file_id):
+        with open(os.path.join(self.root, "parents", file_id), "r") as f:
+            return f.read()
+
+    def _load(self, file_id):
+        try:
+            with open(self._meta_path(self._parent(file_id), file_id), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"File not found: {file_id}")
+
+    def _save(self, item, parent_id):
+        os.makedirs(os.path.join(self.root, "meta", parent_id), exist_ok=True)
+        path = self._meta_path(parent_id, item["id"])
+        with open(path + ".tmp", "w") as f:
+            json.dump(item, f)
+        os.replace(path + ".tmp", path)
+        with open(os.path.join(self.root, "parents", item["id"]), "w") as f:
+            f.write(parent_id)
+
+    def _new_item(self, title, mime_type):
+        return {
+            "id": uuid.uuid4().hex,
+            "title": title,
+            "mimeType": mime_type,
+            "md5Checksum": None,
+            "fileSize": None,
+            "modifiedDate": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+        }
+
+    def _store_content(self, item, data):
+        with open(os.path.join(self.root, "blobs", item["id"]), "wb") as f:
+            f.write(data)
+        item["md5Checksum"] = hashlib.md5(data).hexdigest()
+        item["fileSize"] = str(len(data))
+        item["modifiedDate"] = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+
+    def _list(self, folder_id):
+        directory = os.path.join(self.root, "meta", folder_id)
+        names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+        items = []
+        for name in names:
+            if name.endswith(".json"):
+                with open(os.path.join(directory, name), "r") as f:
+                    items.append(json.load(f))
+        return items
+
+    def list_page(self, folder_id, page_token=None, folders_only=False, files_only=False, title=None, page_size=PAGE_SIZE):
+        self._request()
+        items = self._list(folder_id)
+        start = int(page_token or 0)
+        end = start + min(page_size, self.max_page_size)
+        page = []
+        for item in items[start:end]:
+            is_folder = item["mimeType"] == FOLDER_MIME
+            if (folders_only and not is_folder) or (files_only and is_folder):
+                continue
+            if title is not None and item["title"] != title:
+                continue
+            page.append(item)
+        # Like Drive, filtering can leave a page short (or empty) while more pages follow
+        return page, str(end) if end < len(items) else None
+
+    def _create_folder(self, title, parent_id):
+        item = self._new_item(title, FOLDER_MIME)
+        self._save(item, parent_id)
+        return item["id"]
+
+    def create_folder(self, title, parent_id):
+        self._request()
+        return self._create_folder(title, parent_id)
+
+    def make_public(self, file_id):
+        self._request()
+        self._load(file_id)
+
+    def _exists(self, file_id):
+        try:
+            self._load(file_id)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def upload_file(self, local_path, title, parent_id, file_id=None):
+        with open(local_path, "rb") as f:
+            data = f.read()
+        self._request(len(data))
+        if file_id:
+            item, parent_id = self._load(file_id), self._parent(file_id)
+        else:
+            item = self._new_item(title, "application/octet-stream")
+        self._store_content(item, data)
+        self._save(item, parent_id)
+        return item["id"]
+
+    def upload_string(self, text, title, parent_id):
+        data = text.encode()
+        self._request(len(data))
+        item = self._new_item(title, "text/plain")
+        self._store_content(item, data)
+        self._save(item, parent_id)
+        return item["id"]
+
+    def download_file(self, file_id, local_path):
+        self._load(file_id)
+        blob = os.path.join(self.root, "blobs", file_id)
+        self._request(os.path.getsize(blob))
+        shutil.copyfile(blob, local_path)
+
+    def download_bytes(self, file_id, offset=None, size=None):
+        self._load(file_id)
+        with open(os.path.join(self.root, "blobs", file_id), "rb") as f:
+            if offset is not None:
+                f.seek(offset)
+                data = f.read(size)
+            else:
+                data = f.read()
+        self._request(len(data))
+        return data
+
+    def async_session(self, concurrency):
+        return LocalAsyncSession(self)
+
+    def _delete(self, file_id):
+        item = self._load(file_id)
+        if item["mimeType"] == FOLDER_MIME:
+            directory = os.path.join(self.root, "meta", file_id)
+            for name in os.listdir(directory) if os.path.isdir(directory) else []:
+                self._delete(name[: -len(".json")])
+        os.remove(self._meta_path(self._parent(file_id), file_id))
+        os.remove(os.path.join(self.root, "parents", file_id))
+        blob = os.path.join(self.root, "blobs", file_id)
+        if os.path.exists(blob):
+            os.remove(blob)
+
+    def delete(self, file_id):
+        self._request()
+        self._delete(file_id)
+
+    def batch(self, calls):
+        self._request(operations=len(calls))
+        operations = {
+            "find_folders": lambda parent_id, title: [
+                item["id"] for item in self._list(parent_id) if item["mimeType"] == FOLDER_MIME and item["title"] == title
+            ],
+            "exists": self._exists,
+            "create_folder": self._create_folder,
+            "make_public": self._load,
+            "delete": self._delete,
+        }
+        results = []
+        for operation, args in calls:
+            try:
+                result = operations[operation](*args)
+                results.append(None if operation in ("make_public", "delete") else result)
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class LocalAsyncSession:
+    """Async downloads from a LocalDriveBackend, with the same call counting, latency and quota."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def download_bytes(self, file_id):
+        self.backend._load(file_id)
+        with open(os.path.join(self.backend.root, "blobs", file_id), "rb") as f:
+            data = f.read()
+        await self.backend._request_async(len(data))
+        return data
+
+    async def close(self):
+        pass
+
+
+class ClientPool:
+    """
+    One backend client per worker thread, created on first use by `factory`.
+    httplib2 connections are not thread-safe, so threads must not share a
+    Drive client; a thread-safe backend's factory can return one shared instance.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._local = threading.local()
+
+    def get(self):
+        if not hasattr(self._local, "drive"):
+            self._local.drive = self.factory()
+        return self._local.drive
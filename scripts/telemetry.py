@@ -0,0 +1,265 @@
+#!/opt/homebrew/bin/python3
+"""
+Name: telemetry.py
+Purpose: Parse chunk SLURM logs and details files into per-job and per-model/dataset throughput reports
+"""
+
+__author__ = "Ojas Chaturvedi"
+__github__ = "github.com/ojas-chaturvedi"
+__license__ = "MIT"
+
+import os
+import re
+import csv
+import glob
+import json
+import argparse
+import subprocess
+from datetime import datetime
+
+MODELS_FILE = "models.json"
+OUTPUT_DIR = "telemetry"
+SLOWEST_FILES = 10
+
+# Chunk logs are {dataset}_chunk{id} with ids 000, s{stage}_000 (--staged), either followed by the a/b
+# suffixes of monitor-mode splits; --pack jobs write packed_pack{nnn}
+LOG_NAME_PATTERN = re.compile(
+    r"^(?:(?P<dataset>.+?)_chunk(?P<chunk>(?:s\d+_)?\d+[a-z]*)|packed_(?P<pack>pack\d+))_slurm_output\.txt$"
+)
+PROCESSED_PATTERN = re.compile(r"^Processed (.+) in (-?[\d.]+) seconds")
+TOTAL_RUNTIME_PATTERN = re.compile(r"^Total runtime: (\d+):(\d+):(\d+)")
+DURATION_PATTERN = re.compile(r"^Duration:\s*(-?[\d.]+)\s*seconds")
+RUNTIME_PATTERN = re.compile(r"^Runtime:\s*(-?[\d.]+)\s*seconds")
+
+
+def parse_slurm_output(path):
+    """Parse one chunk (or packed) SLURM output file written by run.sh; packed jobs get dataset 'packed'."""
+    match = LOG_NAME_PATTERN.match(os.path.basename(path))
+    if not match:
+        return None
+
+    file_runtimes = []
+    wall_seconds = None
+    with open(path, "r", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            processed = PROCESSED_PATTERN.match(line)
+            if processed:
+                file_runtimes.append((processed.group(1), float(processed.group(2))))
+                continue
+            total = TOTAL_RUNTIME_PATTERN.match(line)
+            if total:
+                hours, minutes, seconds = (int(x) for x in total.groups())
+                wall_seconds = hours * 3600 + minutes * 60 + seconds
+
+    return {
+        "dataset": match.group("dataset") or "packed",
+        "chunk": match.group("chunk") or match.group("pack"),
+        "files_processed": len(file_runtimes),
+        "transcribe_seconds": sum(runtime for _, runtime in file_runtimes),
+        "wall_seconds": wall_seconds,
+        "log_path": path,
+    }
+
+
+def parse_details_runtimes(path):
+    """Return [(filename, duration, runtime), ...] from a details_{dataset}.txt file."""
+    entries = []
+    filename, duration = None, None
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if line.endswith(".wav"):
+                filename, duration = line, None
+                continue
+            duration_match = DURATION_PATTERN.match(line)
+            if duration_match and filename:
+                duration = float(duration_match.group(1))
+                continue
+            runtime_match = RUNTIME_PATTERN.match(line)
+            if runtime_match and filename and duration is not None:
+                entries.append((filename, duration, float(runtime_match.group(1))))
+                filename, duration = None, None
+    return entries
+
+
+def sacct_times(job_name):
+    """Return (queue_wait_seconds, elapsed_seconds) for the latest job with this name, if sacct knows it."""
+    try:
+        result = subprocess.run(
+            ["sacct", "-n", "-P", "-X", f"--name={job_name}", "-o", "Submit,Start,End"],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None, None
+
+    lines = [line for line in result.stdout.decode().splitlines() if line.count("|") == 2]
+    if not lines:
+        return None, None
+
+    try:
+        submit, start, end = (datetime.fromisoformat(x) for x in lines[-1].split("|"))
+    except ValueError:
+        return None, None
+    return (start - submit).total_seconds(), (end - start).total_seconds()
+
+
+def find_slurm_logs(model_name):
+    """Find chunk and packed logs both before (research_output/) and after upload.sh moves them.
+
+    upload.sh copies a packed log into every dataset it covers, so logs are deduplicated by file name.
+    """
+    patterns = [
+        os.path.join(model_name, "research_output", "*_slurm_output.txt"),
+        os.path.join(model_name, "research_output_*", "*_slurm_output.txt"),
+    ]
+    logs = {}
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            logs.setdefault(os.path.basename(path), path)
+    return sorted(logs.values())
+
+
+def collect_model(model_name, use_sacct=False):
+    """Collect job rows and per-file rows for one model directory."""
+    job_rows = []
+    for log_path in find_slurm_logs(model_name):
+        parsed = parse_slurm_output(log_path)
+        if not parsed:
+            continue
+        queue_wait = None
+        if use_sacct:
+            if parsed["dataset"] == "packed":
+                job_name = f"{model_name}_{parsed['chunk']}"
+            else:
+                job_name = f"{model_name}_{parsed['dataset']}_chunk{parsed['chunk']}"
+            queue_wait, elapsed = sacct_times(job_name)
+            if parsed["wall_seconds"] is None:
+                parsed["wall_seconds"] = elapsed
+        job_rows.append({"model": model_name, "queue_wait_seconds": queue_wait, **parsed})
+
+    file_rows = []
+    for details_path in glob.glob(os.path.join(model_name, "details_*.txt")):
+        dataset = os.path.basename(details_path)[len("details_") : -len(".txt")]
+        for filename, duration, runtime in parse_details_runtimes(details_path):
+            file_rows.append(
+                {
+                    "model": model_name,
+                    "dataset": dataset,
+                    "filename": filename,
+                    "duration_seconds": duration,
+                    "runtime_seconds": runtime,
+                }
+            )
+    return job_rows, file_rows
+
+
+def summarize(job_rows, file_rows):
+    """Aggregate job and file rows into one summary row per (model, dataset)."""
+    groups = {}
+    for row in job_rows:
+        # Log names keep spaces in dataset names, details files use underscores
+        key = (row["model"], row["dataset"].replace(" ", "_"))
+        group = groups.setdefault(key, {"jobs": [], "files": []})
+        group["jobs"].append(row)
+    for row in file_rows:
+        key = (row["model"], row["dataset"])
+        group = groups.setdefault(key, {"jobs": [], "files": []})
+        group["files"].append(row)
+
+    summary = []
+    for (model, dataset), group in sorted(groups.items()):
+        walls = [j["wall_seconds"] for j in group["jobs"] if j["wall_seconds"]]
+        waits = [j["queue_wait_seconds"] for j in group["jobs"] if j["queue_wait_seconds"] is not None]
+        wall_total = sum(walls)
+        files_done = sum(j["files_processed"] for j in group["jobs"]) or len(group["files"])
+        audio_total = sum(f["duration_seconds"] for f in group["files"])
+
+        summary.append(
+            {
+                "model": model,
+                "dataset": dataset,
+                "jobs": len(group["jobs"]),
+                "files": files_done,
+                "mean_queue_wait_seconds": round(sum(waits) / len(waits), 1) if waits else None,
+                "mean_job_wall_seconds": round(wall_total / len(walls), 1) if walls else None,
+                "total_job_wall_seconds": round(wall_total, 1),
+                "files_per_hour": round(files_done / (wall_total / 3600), 2) if wall_total else None,
+                "audio_seconds_per_wall_second": round(audio_total / wall_total, 3) if wall_total else None,
+                "mean_file_runtime_seconds": round(
+                    sum(f["runtime_seconds"] for f in group["files"]) / len(group["files"]), 3
+                )
+                if group["files"]
+                else None,
+            }
+        )
+    return summary
+
+
+def slowest_files(file_rows, limit=SLOWEST_FILES):
+    """Return the slowest files per (model, dataset)."""
+    groups = {}
+    for row in file_rows:
+        groups.setdefault((row["model"], row["dataset"]), []).append(row)
+
+    slowest = []
+    for key in sorted(groups):
+        rows = sorted(groups[key], key=lambda r: r["runtime_seconds"], reverse=True)
+        slowest.extend(rows[:limit])
+    return slowest
+
+
+def write_csv(path, rows):
+    """Write a list of dicts as a CSV table (one column per key)."""
+    if not rows:
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect chunk job telemetry and throughput.")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Directory for the CSV reports")
+    parser.add_argument("--sacct", action="store_true", help="Query sacct for queue wait and elapsed time")
+    parser.add_argument("--slowest", type=int, default=SLOWEST_FILES, help="Slowest files to keep per model/dataset")
+    args = parser.parse_args()
+
+    if not os.path.exists(MODELS_FILE):
+        print(f"Error: {MODELS_FILE} not found.")
+        return
+    with open(MODELS_FILE, "r") as f:
+        model_names = [row[0] for row in json.load(f).get("values", [])[1:] if row]
+
+    job_rows, file_rows = [], []
+    for model_name in model_names:
+        if not os.path.isdir(model_name):
+            print(f"\t- Missing model directory: {model_name}, skipping.")
+            continue
+        jobs, files = collect_model(model_name, args.sacct)
+        print(f"\t- {model_name}: {len(jobs)} chunk logs, {len(files)} scored files")
+        job_rows.extend(jobs)
+        file_rows.extend(files)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary = summarize(job_rows, file_rows)
+    write_csv(os.path.join(args.output_dir, "jobs.csv"), job_rows)
+    write_csv(os.path.join(args.output_dir, "files.csv"), file_rows)
+    write_csv(os.path.join(args.output_dir, "summary.csv"), summary)
+    write_csv(os.path.join(args.output_dir, "slowest_files.csv"), slowest_files(file_rows, args.slowest))
+
+    print("\nThroughput per model and dataset:")
+    for row in summary:
+        print(
+            f"\t{row['model']:<30} {row['dataset']:<20} "
+            f"files/h: {row['files_per_hour']}  audio s/wall s: {row['audio_seconds_per_wall_second']}  "
+            f"queue wait: {row['mean_queue_wait_seconds']}"
+        )
+    print(f"\nTelemetry saved to {args.output_dir}/")
+
+
+if __name__ == "__main__":
+    main()
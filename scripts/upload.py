@@ -8,15 +8,34 @@ __author__ = "Ojas Chaturvedi"
 __github__ = "github.com/ojas-chaturvedi"
 __license__ = "MIT"
 
-from pydrive2.auth import GoogleAuth
-from pydrive2.drive import GoogleDrive
 import os
+import sys
+import json
+import time
+import glob
+import fcntl
+import shutil
+import struct
+import hashlib
+import tarfile
+import zipfile
 import argparse
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from storage import MAX_ATTEMPTS, ClientPool, DriveBackend, LocalDriveBackend, backoff_seconds, classify_error
+
+# Transfer concurrency adapts to Drive rate limits (AIMD)
+INITIAL_WORKERS = 8
+MAX_WORKERS = 32
+DECREASE_INTERVAL = 1.0  # One rate-limit burst halves the limit once, not once per failed request
 
 
 def authenticate_service_account():
     """Authenticate with Google Drive using a service account."""
+    # Only the Drive backend needs pydrive2; the local stand-in runs without it
+    from pydrive2.auth import GoogleAuth
+    from pydrive2.drive import GoogleDrive
+
     gauth = GoogleAuth()
     gauth.settings = {
         "client_config_backend": "service",
@@ -34,93 +53,491 @@ def authenticate_service_account():
     return GoogleDrive(gauth)
 
 
-def delete_existing_folder(drive, folder_name, parent_folder_id):
-    """Check if a folder with a given name already exists in Google Drive and delete it if found."""
-    query = f"'{parent_folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and title='{folder_name}'"
-    file_list = drive.ListFile({"q": query}).GetList()
+MODEL_OUTPUT_EXTENSIONS = [".mid", ".midi", ".pdf"]  # Uploaded to the Model Output subfolder
+OUTPUT_FOLDER = "Model Output"
+FOLDER_CACHE = "drive_folders.json"  # Beside the output directory: Drive folder IDs by parent ID and name
+ARCHIVE_DIR = "archives"  # Per-chunk bundles and their indexes, beside the outputs they cover
+INDEX_SUFFIX = ".index.json"
 
-    if file_list:
-        folder_id = file_list[0]["id"]
-        folder_to_delete = drive.CreateFile({"id": folder_id})
-        folder_to_delete.Delete()
-        print(f"Existing folder '{folder_name}' has been deleted.")
 
+def drive_backend():
+    """A Drive backend with its own authorized client (one per worker thread)."""
+    return DriveBackend(authenticate_service_account())
 
-def create_folder(drive, model_name, dataset_name, parent_folder_id=None):
-    """Create a folder in Google Drive and return its ID and link."""
-    if dataset_name:
-        folder_name = f"{model_name} - {dataset_name}"
-    else:
-        folder_name = model_name
 
-    # Delete existing folder if it exists
-    delete_existing_folder(drive, folder_name, parent_folder_id)
+class AdaptiveLimit:
+    """
+    AIMD cap on concurrent transfers: grows by one after `limit` successes in a
+    row and halves on a rate-limit response.
+    """
 
-    # Create a new folder
-    folder_metadata = {
-        "title": folder_name,
-        "mimeType": "application/vnd.google-apps.folder",
-    }
-    if parent_folder_id:
-        folder_metadata["parents"] = [{"id": parent_folder_id}]
-
-    folder = drive.CreateFile(folder_metadata)
-    folder.Upload()
-
-    # Make folder public (anyone can view)
-    folder.InsertPermission(
-        {
-            "type": "anyone",
-            "role": "reader",
-        }
-    )
+    def __init__(self, initial=INITIAL_WORKERS, maximum=MAX_WORKERS):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.peak = initial
+        self.active = 0
+        self.successes = 0
+        self.last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.active >= int(self.limit):
+                self._condition.wait()
+            self.active += 1
+
+    def release(self, rate_limited=False):
+        with self._condition:
+            self.active -= 1
+            now = time.monotonic()
+            if rate_limited:
+                self.successes = 0
+                if now - self.last_decrease >= DECREASE_INTERVAL:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = now
+            else:
+                self.successes += 1
+                if self.successes >= int(self.limit):
+                    self.limit = min(float(self.maximum), self.limit + 1)
+                    self.peak = max(self.peak, int(self.limit))
+                    self.successes = 0
+            self._condition.notify_all()
+
+
+def is_model_output(filename):
+    """Transcriptions, their PDFs and bundles of them go to the Model Output subfolder."""
+    extension = os.path.splitext(filename)[1].lower()
+    return extension in MODEL_OUTPUT_EXTENSIONS + [".zip", ".tar"] or filename.endswith(INDEX_SUFFIX)
+
+
+def folder_link(folder_id):
+    return f"https://drive.google.com/drive/folders/{folder_id}"
+
+
+def load_folder_cache(cache_path):
+    """{"parent ID/folder name": folder ID} from the folder cache, or {} if there is none yet."""
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path, "r") as f:
+        return json.load(f)
+
+
+def save_folder_cache(cache_path, entries, stale_ids=()):
+    """
+    Merge entries into the folder cache, dropping entries for deleted folders
+    and their children. Upload jobs for other datasets of the model share the
+    file, so the read-modify-write runs under an exclusive lock.
+    """
+    with open(cache_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        cache = load_folder_cache(cache_path)
+        for key in list(cache):
+            if cache[key] in stale_ids or key.split("/", 1)[0] in stale_ids:
+                del cache[key]
+        cache.update(entries)
+        with open(cache_path + ".tmp", "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(cache_path + ".tmp", cache_path)
+
+
+def is_missing(error):
+    """Whether an error means the file or folder does not exist (Drive 404, or the stand-in's FileNotFoundError)."""
+    if isinstance(error, FileNotFoundError):
+        return True
+    details = getattr(error, "error", None)
+    status = details.get("code") if isinstance(details, dict) else getattr(getattr(error, "resp", None), "status", None)
+    return status is not None and int(status) == 404
+
+
+def run_batch(drive, calls):
+    """
+    Send metadata calls as one batch request and return their results, resending
+    only the calls that hit rate limits or transient errors. Deleting something
+    that is already gone counts as done; any other error is raised.
+    """
+    results = [None] * len(calls)
+    pending = list(range(len(calls)))
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            outcomes = drive.batch([calls[index] for index in pending])
+        except Exception as e:
+            outcomes = [e] * len(pending)
+        retry = []
+        for index, outcome in zip(pending, outcomes):
+            if not isinstance(outcome, Exception):
+                results[index] = outcome
+            elif calls[index][0] == "delete" and is_missing(outcome):
+                results[index] = None
+            elif classify_error(outcome) is None or attempt == MAX_ATTEMPTS:
+                raise outcome
+            else:
+                retry.append(index)
+        if not retry:
+            return results
+        pending = retry
+        time.sleep(backoff_seconds(attempt))
+
+
+def prepare_folders(drive, model_name, dataset_name, parent_folder_id, cache_path, replace=True):
+    """
+    Return (folder ID, Model Output folder ID) for an upload, creating both as
+    public folders if needed. Metadata calls go out as batch requests: creating
+    the folders takes three round-trips (create the folder and look for existing
+    ones; delete those, share the folder and create Model Output; share Model
+    Output). With `replace`, existing folders of the same name are deleted;
+    otherwise they are reused so their IDs and links stay the same, and a reuse
+    of cached IDs takes a single round-trip to check they still exist.
+    """
+    folder_name = f"{model_name} - {dataset_name}" if dataset_name else model_name
+    key = f"{parent_folder_id}/{folder_name}"
+
+    if not replace:
+        cache = load_folder_cache(cache_path)
+        folder_id = cache.get(key)
+        output_folder_id = cache.get(f"{folder_id}/{OUTPUT_FOLDER}")
+        if folder_id and output_folder_id and all(
+            run_batch(drive, [("exists", (folder_id,)), ("exists", (output_folder_id,))])
+        ):
+            print(f"Syncing into existing folder '{folder_name}' with ID: {folder_id}")
+            return folder_id, output_folder_id
+
+        found = run_batch(drive, [("find_folders", (parent_folder_id, folder_name))])[0]
+        if found:
+            folder_id = found[0]
+            print(f"Syncing into existing folder '{folder_name}' with ID: {folder_id}")
+            found = run_batch(drive, [("find_folders", (folder_id, OUTPUT_FOLDER))])[0]
+            if found:
+                output_folder_id = found[0]
+            else:
+                output_folder_id = run_batch(drive, [("create_folder", (OUTPUT_FOLDER, folder_id))])[0]
+                run_batch(drive, [("make_public", (output_folder_id,))])
+            save_folder_cache(cache_path, {key: folder_id, f"{folder_id}/{OUTPUT_FOLDER}": output_folder_id})
+            return folder_id, output_folder_id
 
-    folder_id = folder["id"]
-    folder_link = f"https://drive.google.com/drive/folders/{folder_id}"
+    # The listing may run before or after the create within the batch, so the new folder is filtered out
+    folder_id, existing = run_batch(
+        drive, [("create_folder", (folder_name, parent_folder_id)), ("find_folders", (parent_folder_id, folder_name))]
+    )
+    stale_ids = [existing_id for existing_id in existing if existing_id != folder_id]
+    calls = [("delete", (stale_id,)) for stale_id in stale_ids]
+    calls += [("make_public", (folder_id,)), ("create_folder", (OUTPUT_FOLDER, folder_id))]
+    output_folder_id = run_batch(drive, calls)[-1]
+    run_batch(drive, [("make_public", (output_folder_id,))])
 
+    if stale_ids:
+        print(f"Existing folder '{folder_name}' has been deleted.")
     print(f"Created new folder '{folder_name}' with ID: {folder_id}")
-    print(f"Folder link: {folder_link}")
+    print(f"Folder link: {folder_link(folder_id)}")
+    save_folder_cache(
+        cache_path, {key: folder_id, f"{folder_id}/{OUTPUT_FOLDER}": output_folder_id}, stale_ids=set(stale_ids)
+    )
+    return folder_id, output_folder_id
 
-    return folder_id, folder_link
 
+def upload_single_file(drive, file_path, filename, target_folder_id, file_id=None):
+    """Upload a single file to a specific folder, or replace the content of `file_id` in place."""
+    drive.upload_file(file_path, filename, target_folder_id, file_id)
+    print(f"{'Updated' if file_id else 'Uploaded'} {filename} in folder ID: {target_folder_id}")
 
-def upload_single_file(drive, file_path, filename, target_folder_id):
-    """Upload a single file to a specific folder."""
-    try:
-        file = drive.CreateFile(
-            {
-                "title": filename,
-                "parents": [{"id": target_folder_id}],
-            }
-        )
-        file.SetContentFile(file_path)
-        file.Upload()
-        print(f"Uploaded {filename} to folder ID: {target_folder_id}")
-    except Exception as e:
-        print(f"Failed to upload {filename}: {e}")
 
+def upload_with_retries(pool, limit, transfer):
+    """Upload one (path, title, folder, file ID) transfer, retrying rate limits and transient errors; return the last error or None."""
+    filename = transfer[1]
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        limit.acquire()
+        try:
+            upload_single_file(pool.get(), *transfer)
+        except Exception as e:
+            kind = classify_error(e)
+            limit.release(rate_limited=kind == "rate")
+            if kind is None or attempt == MAX_ATTEMPTS:
+                print(f"Failed to upload {filename} after {attempt} attempt(s): {e}")
+                return str(e)
+            delay = backoff_seconds(attempt)
+            print(f"\t- {'Rate limited' if kind == 'rate' else 'Transient error'} on {filename}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+        else:
+            limit.release()
+            return None
 
-def upload_files_to_folder(drive, local_directory, folder_id, output_folder_id=None):
-    """Upload all files from a local directory using parallel threads."""
-    files_to_upload = []
 
-    for filename in os.listdir(local_directory):
-        file_path = os.path.join(local_directory, filename)
-        if os.path.isfile(file_path):
-            file_ext = os.path.splitext(filename)[1].lower()
-            if file_ext in [".mid", ".midi", ".pdf"]:
-                target_folder_id = output_folder_id
+def transfer_files(pool, transfers):
+    """
+    Run transfers on up to MAX_WORKERS threads, each with its own client, under
+    an AIMD concurrency limit. Returns ({file path: error} for failed transfers,
+    transfers that succeeded).
+    """
+    limit = AdaptiveLimit()
+    failures = {}
+    succeeded = []
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(upload_with_retries, pool, limit, transfer): transfer for transfer in transfers}
+        for future in as_completed(futures):
+            error = future.result()
+            if error is None:
+                succeeded.append(futures[future])
             else:
-                target_folder_id = folder_id
-            files_to_upload.append((file_path, filename, target_folder_id))
+                failures[futures[future][0]] = error
+    if transfers:
+        print(
+            f"Transferred {len(succeeded)}/{len(transfers)} files in {time.time() - start:.1f} seconds "
+            f"(concurrency peaked at {limit.peak}, ended at {int(limit.limit)})"
+        )
+    return failures, succeeded
+
+
+def report_failures(failures, report_path):
+    """List every file that was never uploaded, on stdout and in `report_path`; no report when all succeeded."""
+    if os.path.exists(report_path):
+        os.remove(report_path)
+    if not failures:
+        return
+    print(f"\n{len(failures)} file(s) were not uploaded (listed in {report_path}):")
+    with open(report_path, "w") as f:
+        for file_path, error in sorted(failures.items()):
+            print(f"\t- {file_path}: {error}")
+            f.write(f"{file_path}\t{error}\n")
+
+
+def chunk_report_path(report_path, chunk_name):
+    """Failure report of one streamed chunk, beside the dataset's report, so concurrent chunks never share a file."""
+    return f"{os.path.splitext(report_path)[0]}.{chunk_name}.txt"
+
+
+def collect_chunk_failures(report_path, uploaded_titles):
+    """
+    Read and remove the chunk failure reports of a dataset, returning {file path:
+    error} for the files whose titles are still not on Drive.
+    """
+    failures = {}
+    for chunk_report in sorted(glob.glob(chunk_report_path(report_path, "*"))):
+        with open(chunk_report, "r") as f:
+            for line in f:
+                file_path, _, error = line.rstrip("\n").partition("\t")
+                if file_path and os.path.basename(file_path) not in uploaded_titles:
+                    failures[file_path] = error
+        os.remove(chunk_report)
+    return failures
+
+
+def stream_folders(drive, model_name, dataset_name, parent_folder_id, run_id, state_path, cache_path):
+    """
+    Return (folder ID, Model Output folder ID) for a streaming upload run. The
+    first chunk of a run replaces any folder left by an earlier run; the IDs are
+    kept in a state file under an exclusive lock because chunk jobs upload concurrently.
+    """
+    with open(state_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = {}
+        if os.path.exists(state_path):
+            with open(state_path, "r") as f:
+                state = json.load(f)
+        if state.get("run_id") == run_id:
+            return state["folder_id"], state["output_folder_id"]
+
+        folder_id, output_folder_id = prepare_folders(drive, model_name, dataset_name, parent_folder_id, cache_path)
+        with open(state_path, "w") as f:
+            json.dump({"run_id": run_id, "folder_id": folder_id, "output_folder_id": output_folder_id}, f)
+        return folder_id, output_folder_id
+
+
+def existing_titles(drive, folder_id):
+    """Titles of the files already in a Drive folder."""
+    return {item["title"] for item in drive.list_children(folder_id)}
+
+
+def remote_files(drive, folder_id):
+    """
+    {title: [{id, md5, size}, ...]} for the files (not subfolders) in a Drive
+    folder, from a single paginated listing.
+    """
+    files = {}
+    for item in drive.list_children(folder_id, files_only=True):
+        files.setdefault(item["title"], []).append(
+            {"id": item["id"], "md5": item.get("md5Checksum"), "size": int(item.get("fileSize") or -1)}
+        )
+    return files
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sync_files_to_folder(pool, local_directory, folder_id, output_folder_id, delete=False, file_paths=None):
+    """
+    Make the Drive folders match a local directory: upload new files, replace
+    the content of files whose size or MD5 differ (keeping their Drive IDs),
+    leave identical files alone and, with `delete`, remove remote files that no
+    longer exist locally. Returns (counts per action, {file path: error}).
+    """
+    drive = pool.get()
+    remote = {folder_id: remote_files(drive, folder_id), output_folder_id: remote_files(drive, output_folder_id)}
+    counts = {"uploaded": 0, "updated": 0, "unchanged": 0, "deleted": 0, "failed": 0}
+    local_titles = {folder_id: set(), output_folder_id: set()}
+    transfers = []
+
+    if file_paths is None:
+        file_paths = [os.path.join(local_directory, filename) for filename in sorted(os.listdir(local_directory))]
 
-    with ThreadPoolExecutor(max_workers=16) as executor:
-        futures = [
-            executor.submit(upload_single_file, drive, fp, fn, folder_id)
-            for fp, fn, folder_id in files_to_upload
+    for file_path in file_paths:
+        filename = os.path.basename(file_path)
+        if not os.path.isfile(file_path):
+            continue
+        target_folder_id = output_folder_id if is_model_output(filename) else folder_id
+        local_titles[target_folder_id].add(filename)
+
+        existing = remote[target_folder_id].get(filename)
+        if not existing:
+            transfers.append((file_path, filename, target_folder_id, None))
+            continue
+        current = existing[0]
+        # Size is free to compare; only hash files whose size matches
+        if current["size"] == os.path.getsize(file_path) and current["md5"] == file_md5(file_path):
+            counts["unchanged"] += 1
+        else:
+            transfers.append((file_path, filename, target_folder_id, current["id"]))
+
+    failures, succeeded = transfer_files(pool, transfers)
+    counts["failed"] = len(failures)
+    for transfer in succeeded:
+        counts["updated" if transfer[3] else "uploaded"] += 1
+
+    if delete:
+        for target_folder_id, files in remote.items():
+            for title, entries in files.items():
+                # Duplicate titles beyond the first are stale copies from earlier uploads
+                stale = entries if title not in local_titles[target_folder_id] else entries[1:]
+                for entry in stale:
+                    drive.delete(entry["id"])
+                    counts["deleted"] += 1
+                    print(f"Deleted remote {title} from folder ID: {target_folder_id}")
+    return counts, failures
+
+
+def write_archive(file_paths, archive_path, archive_format):
+    """
+    Bundle files into an uncompressed zip or tar and write {archive}.index.json
+    listing each member's name, size and data offset, so a reader can fetch one
+    member with an HTTP range request. Returns the index.
+    """
+    members = []
+    partial = archive_path + ".part"  # Concurrent chunk uploads must never see a half-written archive
+    if archive_format == "zip":
+        # Stored, not deflated, so a member's bytes sit contiguously at its offset
+        with zipfile.ZipFile(partial, "w", zipfile.ZIP_STORED) as archive:
+            for file_path in file_paths:
+                archive.write(file_path, os.path.basename(file_path))
+        with zipfile.ZipFile(partial) as archive, open(partial, "rb") as f:
+            for info in archive.infolist():
+                f.seek(info.header_offset + 26)
+                name_length, extra_length = struct.unpack("<HH", f.read(4))
+                members.append(
+                    {
+                        "name": info.filename,
+                        "size": info.file_size,
+                        "offset": info.header_offset + 30 + name_length + extra_length,
+                    }
+                )
+    else:
+        with tarfile.open(partial, "w", format=tarfile.PAX_FORMAT) as archive:
+            for file_path in file_paths:
+                archive.add(file_path, os.path.basename(file_path))
+        with tarfile.open(partial) as archive:
+            for info in archive.getmembers():
+                members.append({"name": info.name, "size": info.size, "offset": info.offset_data})
+    os.replace(partial, archive_path)
+
+    index = {"archive": os.path.basename(archive_path), "format": archive_format, "members": members}
+    with open(archive_path + INDEX_SUFFIX + ".part", "w") as f:
+        json.dump(index, f)
+    os.replace(archive_path + INDEX_SUFFIX + ".part", archive_path + INDEX_SUFFIX)
+    return index
+
+
+def archived_members(archive_dir):
+    """Names of every file already bundled by an archive in `archive_dir`, from the local indexes."""
+    names = set()
+    if os.path.isdir(archive_dir):
+        for filename in os.listdir(archive_dir):
+            if filename.endswith(INDEX_SUFFIX):
+                with open(os.path.join(archive_dir, filename), "r") as f:
+                    names.update(member["name"] for member in json.load(f)["members"])
+    return names
+
+
+def archive_outputs(local_directory, file_paths, archive_format, archive_name, fresh=False):
+    """
+    Replace the model outputs among `file_paths` (all of `local_directory` when
+    None) with one archive and its index under {local_directory}/archives/.
+    Outputs already in an earlier archive there are left out, so a streaming
+    run's final upload only bundles what its chunks did not. Returns the paths
+    to upload: the other files plus the new archive and index, or, for a whole
+    directory, every archive and index in the archive directory.
+    """
+    whole_directory = file_paths is None
+    archive_dir = os.path.join(local_directory, ARCHIVE_DIR)
+    if fresh:
+        shutil.rmtree(archive_dir, ignore_errors=True)
+    os.makedirs(archive_dir, exist_ok=True)
+
+    if file_paths is None:
+        file_paths = [os.path.join(local_directory, filename) for filename in sorted(os.listdir(local_directory))]
+    file_paths = [path for path in file_paths if os.path.isfile(path)]
+
+    already = archived_members(archive_dir)
+    outputs = [
+        path
+        for path in file_paths
+        if os.path.splitext(path)[1].lower() in MODEL_OUTPUT_EXTENSIONS and os.path.basename(path) not in already
+    ]
+    others = [path for path in file_paths if os.path.splitext(path)[1].lower() not in MODEL_OUTPUT_EXTENSIONS]
+
+    bundles = []
+    if outputs:
+        archive_path = os.path.join(archive_dir, f"{archive_name}.{archive_format}")
+        index = write_archive(outputs, archive_path, archive_format)
+        print(f"Bundled {len(index['members'])} outputs into {archive_path}")
+        bundles = [archive_path, archive_path + INDEX_SUFFIX]
+
+    if whole_directory:
+        bundles = [
+            os.path.join(archive_dir, filename)
+            for filename in sorted(os.listdir(archive_dir))
+            if filename.endswith((".zip", ".tar", INDEX_SUFFIX))
         ]
-        for _ in as_completed(futures):
-            pass  # Already handled in upload_single_file with print
+    return others + bundles
+
+
+def write_marker(drive, folder_id, text):
+    """Upload the completion marker that tells readers a streamed folder is final."""
+    drive.upload_string(text, "_COMPLETE.txt", folder_id)
+    print(f"Wrote completion marker to folder ID: {folder_id}")
+
+
+def upload_files_to_folder(pool, local_directory, folder_id, output_folder_id=None, file_paths=None, skip_titles=()):
+    """
+    Upload all files from a local directory (or just `file_paths`) using parallel
+    threads, leaving out files whose names are in `skip_titles`. Returns
+    {file path: error} for files that could not be uploaded.
+    """
+    files_to_upload = []
+
+    if file_paths is None:
+        file_paths = [os.path.join(local_directory, filename) for filename in os.listdir(local_directory)]
+
+    for file_path in file_paths:
+        filename = os.path.basename(file_path)
+        if os.path.isfile(file_path) and filename not in skip_titles:
+            target_folder_id = output_folder_id if is_model_output(filename) else folder_id
+            files_to_upload.append((file_path, filename, target_folder_id, None))
+
+    failures, _ = transfer_files(pool, files_to_upload)
+    return failures
 
 
 def main():
@@ -140,6 +557,44 @@ def main():
         required=True,
         help="Local directory containing files to upload",
     )
+    parser.add_argument(
+        "--run-id",
+        help="Streaming upload run (run.py --stream-upload): reuse the run's folder and skip files already uploaded",
+    )
+    parser.add_argument("--files-from", help="Upload only the paths listed in this file")
+    parser.add_argument(
+        "--chunk-name",
+        help="Streamed chunk uploading (run.sh passes its chunk); its failures go to a report of its own",
+    )
+    parser.add_argument(
+        "--complete",
+        action="store_true",
+        help="Write the completion marker after uploading (final job of a streaming run)",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Update the existing folder in place, uploading only new or changed files (MD5 and size)",
+    )
+    parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="With --sync, also delete remote files that no longer exist locally",
+    )
+    parser.add_argument(
+        "--archive",
+        choices=["zip", "tar"],
+        help="Bundle .mid/.midi/.pdf outputs into one archive plus a member index instead of uploading each file",
+    )
+    parser.add_argument(
+        "--archive-name",
+        help="Archive file name without extension (default: model_dataset; streamed chunks pass the chunk name)",
+    )
+    parser.add_argument(
+        "--local-drive",
+        metavar="DIR",
+        help="Upload into a filesystem stand-in for Drive at DIR instead (offline testing)",
+    )
     args = parser.parse_args()
 
     print("Arguments Received:")
@@ -148,26 +603,76 @@ def main():
     print(f"\tDataset Name: {args.dataset_name}")
     print(f"\tLocal Directory: {args.local_directory}")
 
-    drive = authenticate_service_account()
+    if args.local_drive:
+        local_drive = LocalDriveBackend(args.local_drive)
+        pool = ClientPool(lambda: local_drive)
+    else:
+        pool = ClientPool(drive_backend)
+    drive = pool.get()
+    # Beside the output directory, like the streaming state file, so they are never uploaded themselves
+    model_directory = os.path.dirname(os.path.abspath(args.local_directory))
+    report_path = os.path.join(model_directory, f"upload_failed_{args.dataset_name}.txt")
+    cache_path = os.path.join(model_directory, FOLDER_CACHE)
 
-    # Get or create the model folder
-    model_folder_id, model_folder_link = create_folder(
-        drive, args.model_name, args.dataset_name, args.main_folder
-    )
-    print(f"Using folder for {args.model_name} with ID: {model_folder_id}")
-    print(f"\tModel folder link: {model_folder_link}")
+    file_paths = None
+    if args.files_from:
+        with open(args.files_from, "r") as f:
+            file_paths = [line.strip() for line in f if line.strip()]
+    if args.archive:
+        archive_name = args.archive_name or f"{args.model_name}_{args.dataset_name}".replace(" ", "_")
+        # A streaming run accumulates chunk archives; a one-shot upload rebuilds its single archive
+        file_paths = archive_outputs(args.local_directory, file_paths, args.archive, archive_name, fresh=not args.run_id)
+
+    if args.run_id:
+        state_path = os.path.join(model_directory, f"drive_folder_{args.dataset_name}.json")
+        folder_id, output_folder_id = stream_folders(
+            drive, args.model_name, args.dataset_name, args.main_folder, args.run_id, state_path, cache_path
+        )
+        skip_titles = existing_titles(drive, folder_id) | existing_titles(drive, output_folder_id)
+        failures = upload_files_to_folder(
+            pool, args.local_directory, folder_id, output_folder_id, file_paths, skip_titles
+        )
+        if not args.complete:
+            report_failures(failures, chunk_report_path(report_path, args.chunk_name or f"pid{os.getpid()}"))
+            sys.exit(1 if failures else 0)
 
-    # Create Output subfolder inside the submission folder
-    output_folder_name = "Model Output"
-    output_folder_id, output_folder_link = create_folder(
-        drive, output_folder_name, None, model_folder_id
+        # The final pass retried every file not yet on Drive; chunk failures it did not fix are still reported
+        uploaded_titles = existing_titles(drive, folder_id) | existing_titles(drive, output_folder_id)
+        failures = {**collect_chunk_failures(report_path, uploaded_titles), **failures}
+        report_failures(failures, report_path)
+        if not failures:
+            write_marker(drive, folder_id, f"{args.model_name} / {args.dataset_name} complete (run {args.run_id})\n")
+        sys.exit(1 if failures else 0)
+
+    if args.sync:
+        folder_id, output_folder_id = prepare_folders(
+            drive, args.model_name, args.dataset_name, args.main_folder, cache_path, replace=False
+        )
+        print(f"\tModel folder link: {folder_link(folder_id)}")
+        counts, failures = sync_files_to_folder(
+            pool, args.local_directory, folder_id, output_folder_id, args.delete, file_paths
+        )
+        print(
+            f"Sync finished: {counts['uploaded']} uploaded, {counts['updated']} updated, "
+            f"{counts['unchanged']} unchanged, {counts['deleted']} deleted, {counts['failed']} failed"
+        )
+        report_failures(failures, report_path)
+        sys.exit(1 if failures else 0)
+
+    # Replace the model folder and its Output subfolder
+    model_folder_id, output_folder_id = prepare_folders(
+        drive, args.model_name, args.dataset_name, args.main_folder, cache_path
     )
-    print(f"\tModel Output subfolder link: {output_folder_link}")
+    print(f"Using folder for {args.model_name} with ID: {model_folder_id}")
+    print(f"\tModel folder link: {folder_link(model_folder_id)}")
+    print(f"\tModel Output subfolder link: {folder_link(output_folder_id)}")
 
     # Upload files
-    upload_files_to_folder(
-        drive, args.local_directory, model_folder_id, output_folder_id
+    failures = upload_files_to_folder(
+        pool, args.local_directory, model_folder_id, output_folder_id, file_paths
     )
+    report_failures(failures, report_path)
+    sys.exit(1 if failures else 0)
 
 
 if __name__ == "__main__":
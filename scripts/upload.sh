@@ -18,7 +18,9 @@ dataset_name=${2// /_}
 echo "Uploading dataset: $dataset_name"
 
 MAIN_FOLDER_ID="11zBLIit-Cg7Tu5KHJXZBvaUauFr5Dtbc"
-RESEARCH_DIR="/scratch/gilbreth/ochaturv/research"
+SCRATCH_ROOT="${SCRATCH_ROOT:-/scratch/gilbreth/ochaturv}" # Exported by run.py --clusters on other clusters
+export SCRATCH_ROOT
+RESEARCH_DIR="$SCRATCH_ROOT/research"
 MODEL_DIR="$RESEARCH_DIR/$model_name"
 OUTPUT_DIR="$MODEL_DIR/research_output_${dataset_name}"
 
@@ -26,7 +28,8 @@ source /etc/profile.d/modules.sh
 module load external
 module load conda
 
-conda activate /scratch/gilbreth/ochaturv/.conda/envs/upload-env
+upload_env=$(python3 "$RESEARCH_DIR/envs.py" upload-env) || exit 1
+conda activate "$upload_env"
 
 DETAILS_FILE="$MODEL_DIR/details_${dataset_name}.txt"
 
@@ -66,6 +69,31 @@ else
     echo "No SLURM output files found for dataset: $dataset_name"
 fi
 
+# A packed log (run.py --pack) covers every dataset in its manifest: each of their uploads copies it,
+# and whichever upload finds all the copies in place removes it from research_output/
+for log in "$MODEL_DIR/research_output/packed_pack"*"_slurm_output.txt"; do
+    log_name=$(basename "$log")
+    pack_id=${log_name%_slurm_output.txt}
+    manifest="$RESEARCH_DIR/chunks/packed/${model_name//\//_}/pack_${pack_id#packed_pack}.tsv"
+    if [[ ! -f "$manifest" ]]; then
+        echo "No manifest for $log_name, moving it like a chunk log"
+        mv "$log" "$OUTPUT_DIR/"
+        continue
+    fi
+    cut -f1 "$manifest" | grep -qxF "$2" || continue
+
+    echo "Copying packed log $log_name to output directory"
+    cp "$log" "$OUTPUT_DIR/"
+    copied=1
+    while IFS= read -r pack_dataset; do
+        [[ -f "$MODEL_DIR/research_output_${pack_dataset// /_}/$log_name" ]] || copied=0
+    done < <(cut -f1 "$manifest" | sort -u)
+    if (( copied )); then
+        echo "Every dataset of $log_name has a copy, removing it from research_output/"
+        rm -f "$log"
+    fi
+done
+
 # Check if output dir exists
 if [[ ! -d "$OUTPUT_DIR" ]]; then
     echo "Error: Output directory $OUTPUT_DIR does not exist!"
@@ -73,12 +101,28 @@ if [[ ! -d "$OUTPUT_DIR" ]]; then
 fi
 
 # Perform upload
-echo "--> Uploading $OUTPUT_DIR to Google Drive"
-python "$RESEARCH_DIR/upload.py" \
-    --main-folder="$MAIN_FOLDER_ID" \
-    --model-name="$model_name" \
-    --dataset-name="$dataset_name" \
-    --local-directory="$OUTPUT_DIR"
+if [[ -n "$UPLOAD_RUN_ID" ]]; then
+    # Chunks already streamed their transcriptions; send what is left and mark the folder complete
+    echo "--> Finishing streamed upload of $OUTPUT_DIR (run $UPLOAD_RUN_ID)"
+    python "$RESEARCH_DIR/upload.py" \
+        --main-folder="$MAIN_FOLDER_ID" \
+        --model-name="$model_name" \
+        --dataset-name="$dataset_name" \
+        --local-directory="$OUTPUT_DIR" \
+        --run-id="$UPLOAD_RUN_ID" \
+        --complete \
+        ${UPLOAD_ARCHIVE:+--archive="$UPLOAD_ARCHIVE"}
+else
+    # Re-runs only send new or changed files; UPLOAD_DELETE=1 also removes remote files gone locally
+    echo "--> Syncing $OUTPUT_DIR to Google Drive"
+    python "$RESEARCH_DIR/upload.py" \
+        --main-folder="$MAIN_FOLDER_ID" \
+        --model-name="$model_name" \
+        --dataset-name="$dataset_name" \
+        --local-directory="$OUTPUT_DIR" \
+        --sync ${UPLOAD_DELETE:+--delete} \
+        ${UPLOAD_ARCHIVE:+--archive="$UPLOAD_ARCHIVE"}
+fi
 
 conda deactivate
 conda clean --all --yes -q
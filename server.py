@@ -11,10 +11,20 @@ __license__ = "MIT"
 from paramiko import SSHClient, AutoAddPolicy
 from scp import SCPClient
 import os
+import json
+import argparse
 from tqdm import tqdm
 
-hostname = "gilbreth.rcac.purdue.edu"  # or "anvil.rcac.purdue.edu"
-username = "ochaturv"  # or "x-ochaturvedi"
+CLUSTERS_FILE = "clusters.json"
+
+
+def load_cluster(name):
+    """Return (hostname, username, scratch_root, account for utility jobs) for a cluster in clusters.json."""
+    with open(CLUSTERS_FILE, "r") as f:
+        for row in json.load(f)["values"][1:]:
+            if row[0] == name:
+                return row[1], row[2], row[3], row[5] or row[4]
+    raise SystemExit(f"Unknown cluster '{name}' in {CLUSTERS_FILE}")
 
 
 def execute_cmd(client, cmd):
@@ -37,6 +47,17 @@ def execute_cmd(client, cmd):
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Deploy the research scripts to a cluster and run main.sh.")
+    parser.add_argument("--cluster", default="gilbreth", help=f"Cluster name from {CLUSTERS_FILE}")
+    parser.add_argument(
+        "--setup-only",
+        action="store_true",
+        help="Only build environments and clone models (for clusters that receive work via run.py --clusters)",
+    )
+    args = parser.parse_args()
+
+    hostname, username, scratch_root, account = load_cluster(args.cluster)
+
     client = SSHClient()
     client.load_system_host_keys()
     client.set_missing_host_key_policy(AutoAddPolicy())
@@ -44,9 +65,9 @@ def main() -> None:
 
     scp = SCPClient(client.get_transport())
 
-    remote_path = f"/scratch/gilbreth/{username}/research/"  # or f"/anvil/scratch/{username}/research/"
+    remote_path = f"{scratch_root}/research/"
 
-    # execute_cmd(client, f"rm -rf /scratch/gilbreth/{username}/.conda/")
+    # execute_cmd(client, f"rm -rf {scratch_root}/.conda/")
     execute_cmd(client, f"rm -rf {remote_path}")
     execute_cmd(client, f"mkdir -p {remote_path}")
     print("")
@@ -79,7 +100,9 @@ def main() -> None:
         scp.put(script, remote_path=remote_path)
 
     # Execute the job script
-    execute_cmd(client, f"cd {remote_path} && sbatch main.sh")
+    exports = f"ALL,SCRATCH_ROOT={scratch_root}" + (",SETUP_ONLY=1" if args.setup_only else "")
+    account_flag = f"-A {account} " if account else ""
+    execute_cmd(client, f"cd {remote_path} && sbatch {account_flag}--export={exports} main.sh")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,200 @@
+#!/opt/homebrew/bin/python3
+"""
+Name: storage_benchmark.py
+Purpose: Measure upload and details-download throughput (thread pool vs. asyncio engine) against the filesystem Drive stand-in (no Google Drive needed)
+"""
+
+__author__ = "Ojas Chaturvedi"
+__github__ = "github.com/ojas-chaturvedi"
+__license__ = "MIT"
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from storage import ClientPool, LocalDriveBackend
+import upload
+import dataframe
+
+DETAILS_TEMPLATE = """Model Name: {model}
+Dataset Name: {dataset}
+
+{entries}"""
+DETAILS_ENTRY = """song_{i}.wav
+F-measure: 0.5
+Runtime: 1.0 seconds
+"""
+
+
+def make_backend(root, args):
+    return LocalDriveBackend(
+        root,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        requests_per_second=args.rps,
+        error_rate=args.error_rate,
+        page_size=args.page_size,
+    )
+
+
+def quietly(function, *args, **kwargs):
+    """Run a transfer without its per-file progress lines."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return function(*args, **kwargs)
+
+
+def benchmark_upload(workdir, args):
+    """Upload `args.files` MIDI-sized files through upload.py's transfer path."""
+    local_directory = os.path.join(workdir, "outputs")
+    os.makedirs(local_directory)
+    for i in range(args.files):
+        with open(os.path.join(local_directory, f"song_{i}.mid"), "wb") as f:
+            f.write(os.urandom(args.size))
+
+    backend = make_backend(os.path.join(workdir, "drive_upload"), args)
+    pool = ClientPool(lambda: backend)
+    cache_path = os.path.join(workdir, upload.FOLDER_CACHE)
+    folder_id, output_folder_id = quietly(upload.prepare_folders, backend, "Benchmark", "Dataset", "root", cache_path)
+    setup_calls = backend.calls
+
+    start = time.time()
+    failures = quietly(upload.upload_files_to_folder, pool, local_directory, folder_id, output_folder_id)
+    seconds = time.time() - start
+    return {
+        "files": args.files - len(failures),
+        "bytes": (args.files - len(failures)) * args.size,
+        "seconds": seconds,
+        "calls": backend.calls,
+        "rate_limited": backend.rate_limited,
+        "failed": len(failures),
+        "setup_calls": setup_calls,
+    }
+
+
+def build_download_tree(workdir, args):
+    """Create `args.folders` model/dataset folders with a details file each; return (stand-in root, total bytes)."""
+    # Built without latency or quota; each engine then runs against a throttled view of it
+    root = os.path.join(workdir, "drive_download")
+    setup = LocalDriveBackend(root)
+    scratch = os.path.join(workdir, "details.txt")
+    total_bytes = 0
+    for i in range(args.folders):
+        folder_id = setup.create_folder(f"Model{i} - Dataset", "root")
+        with open(scratch, "w") as f:
+            f.write(
+                DETAILS_TEMPLATE.format(
+                    model=f"Model{i}", dataset="Dataset", entries="\n".join(DETAILS_ENTRY.format(i=j) for j in range(50))
+                )
+            )
+        total_bytes += os.path.getsize(scratch)
+        setup.upload_file(scratch, "details_Dataset.txt", folder_id)
+        setup.create_folder("Model Output", folder_id)
+    return root, total_bytes
+
+
+def benchmark_download(workdir, root, total_bytes, args, engine):
+    """Crawl the tree and download every details file through dataframe.py with one download engine."""
+    backend = make_backend(root, args)
+    pool = ClientPool(lambda: backend)
+    local_directory = os.path.join(workdir, f"data_{engine}")  # Fresh, so the incremental sync fetches everything
+    start = time.time()
+    try:
+        count = quietly(
+            dataframe.download_details_files, "root", local_directory, pool, engine, args.concurrency
+        )
+    except Exception as e:
+        print(f"\t- Download crawl aborted: {e}")
+        count = 0
+    seconds = time.time() - start
+    return {
+        "files": count,
+        "bytes": total_bytes,
+        "seconds": seconds,
+        "calls": backend.calls,
+        "rate_limited": backend.rate_limited,
+        "failed": args.folders - count,
+    }
+
+
+def benchmark_fetch(workdir, root, total_bytes, args, engine):
+    """Download every details file with one engine given the file list up front, so listing latency is excluded."""
+    setup = LocalDriveBackend(root)
+    files = [
+        (file, dataframe.details_filename(file, folder["title"]))
+        for folder in setup.list_children("root", folders_only=True)
+        for file in setup.list_children(folder["id"], files_only=True)
+    ]
+    backend = make_backend(root, args)
+    pool = ClientPool(lambda: backend)
+    local_directory = os.path.join(workdir, f"fetch_{engine}")
+    os.makedirs(local_directory)
+    start_downloads = dataframe.start_async_downloads if engine == "async" else dataframe.start_thread_downloads
+    width = args.concurrency or (dataframe.ASYNC_CONCURRENCY if engine == "async" else dataframe.DOWNLOAD_WORKERS)
+
+    start = time.time()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        submit, close = start_downloads(pool, local_directory, width)
+        results = [future.result() for future in [submit(file, name) for file, name in files]]
+        close()
+    seconds = time.time() - start
+    count = sum(1 for _, name in results if name)
+    return {
+        "files": count,
+        "bytes": total_bytes,
+        "seconds": seconds,
+        "calls": backend.calls,
+        "rate_limited": backend.rate_limited,
+        "failed": len(files) - count,
+    }
+
+
+def report(name, result):
+    seconds = max(result["seconds"], 1e-9)
+    print(
+        f"{name:<16} {result['files']:>7} {result['seconds']:>9.2f} {result['files'] / seconds:>9.1f} "
+        f"{result['bytes'] / seconds / 1e6:>8.2f} {result['calls']:>7} {result['rate_limited']:>7} {result['failed']:>7}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Drive transfer paths against the filesystem stand-in.")
+    parser.add_argument("--files", type=int, default=2000, help="Files to upload")
+    parser.add_argument("--size", type=int, default=8 * 1024, help="Bytes per uploaded file (a typical MIDI)")
+    parser.add_argument("--folders", type=int, default=200, help="Model/dataset folders to crawl and download")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every call")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Bytes/second per transfer (default unlimited)")
+    parser.add_argument("--rps", type=int, default=None, help="Requests/second before calls are rate limited")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls failing with a 429")
+    parser.add_argument("--page-size", type=int, default=100, help="Maximum items per listing page")
+    parser.add_argument(
+        "--concurrency", type=int, default=None, help="Downloads in flight for both engines (default: each engine's own)"
+    )
+    parser.add_argument("--keep", action="store_true", help="Keep the stand-in directories")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="storage_benchmark_")
+    try:
+        print(f"Stand-in: {args.latency * 1000:.0f} ms latency, rps={args.rps}, error rate={args.error_rate}")
+        print(f"\n{'Path':<16} {'Files':>7} {'Seconds':>9} {'Files/s':>9} {'MB/s':>8} {'Calls':>7} {'429s':>7} {'Failed':>7}")
+        upload_result = benchmark_upload(workdir, args)
+        report("upload", upload_result)
+        root, total_bytes = build_download_tree(workdir, args)
+        for engine in ("threads", "async"):
+            report(f"download/{engine}", benchmark_download(workdir, root, total_bytes, args, engine))
+        for engine in ("threads", "async"):
+            report(f"fetch/{engine}", benchmark_fetch(workdir, root, total_bytes, args, engine))
+        print(f"\nUpload folder setup took {upload_result['setup_calls']} round-trip(s) (batched)")
+    finally:
+        if args.keep:
+            print(f"\nStand-in data kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
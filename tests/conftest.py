@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The scripts are deployed flat and import each other by module name; dataframe.py sits at the root
+sys.path.append(os.path.join(ROOT, "scripts"))
+sys.path.append(ROOT)
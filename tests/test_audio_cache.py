@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+sf = pytest.importorskip("soundfile")
+pytest.importorskip("scipy")
+
+import audio_cache
+from audio_cache import build_cache, load_audio
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """A 16 kHz cache of one dataset whose list points at data/piece.wav."""
+    monkeypatch.setattr(audio_cache, "_open_caches", {})
+    monkeypatch.delenv("ORIGINAL_INPUT", raising=False)
+    data = tmp_path / "data"
+    data.mkdir()
+    source = str(data / "piece.wav")
+    sf.write(source, np.linspace(-0.5, 0.5, 16000, dtype=np.float32), 16000, subtype="FLOAT")
+    list_file = tmp_path / "Slakh.txt"
+    list_file.write_text(source + "\n")
+    cache_root = str(tmp_path / "cache")
+    build_cache(str(list_file), 16000, cache_root, workers=1)
+    return source, cache_root
+
+
+def staged_copy(source, tmp_path):
+    """Copy `source` the way staging.py does, into a node-local directory per dataset."""
+    staged_dir = tmp_path / "stage_1" / "Slakh"
+    staged_dir.mkdir(parents=True)
+    staged = str(staged_dir / os.path.basename(source))
+    with open(source, "rb") as src, open(staged, "wb") as dst:
+        dst.write(src.read())
+    return staged
+
+
+def test_load_audio_reads_the_list_path_from_the_cache(cache):
+    source, cache_root = cache
+
+    audio = load_audio(source, 16000, cache_root)
+
+    assert isinstance(audio, np.memmap)
+    assert len(audio) == 16000
+
+
+def test_load_audio_finds_staged_copies_through_original_input(cache, tmp_path, monkeypatch):
+    source, cache_root = cache
+    staged = staged_copy(source, tmp_path)
+    monkeypatch.setenv("ORIGINAL_INPUT", source)
+
+    audio = load_audio(staged, 16000, cache_root)
+
+    assert isinstance(audio, np.memmap)
+    assert np.allclose(audio, load_audio(source, 16000, cache_root))
+
+
+def test_load_audio_ignores_original_input_for_other_files(cache, tmp_path, monkeypatch):
+    source, cache_root = cache
+    other = str(tmp_path / "other.wav")
+    sf.write(other, np.zeros(800, dtype=np.float32), 16000, subtype="FLOAT")
+    monkeypatch.setenv("ORIGINAL_INPUT", source)
+
+    audio = load_audio(other, 16000, cache_root)
+
+    assert not isinstance(audio, np.memmap)
+    assert len(audio) == 800
+
+
+def test_load_audio_without_original_decodes_staged_copies(cache, tmp_path):
+    source, cache_root = cache
+
+    audio = load_audio(staged_copy(source, tmp_path), 16000, cache_root, original=None)
+
+    assert not isinstance(audio, np.memmap)
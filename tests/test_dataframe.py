@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip("pandas")
+
+import dataframe
+from storage import ClientPool, LocalDriveBackend
+from upload import OUTPUT_FOLDER, write_archive
+
+
+class RecordingDrive(LocalDriveBackend):
+    """Records every content read as (file ID, offset, size); whole-file reads have no offset."""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.reads = []
+
+    def download_file(self, file_id, local_path):
+        self.reads.append((file_id, None, None))
+        return super().download_file(file_id, local_path)
+
+    def download_bytes(self, file_id, offset=None, size=None):
+        self.reads.append((file_id, offset, size))
+        return super().download_bytes(file_id, offset, size)
+
+
+@pytest.fixture
+def drive(tmp_path):
+    return RecordingDrive(str(tmp_path / "drive"))
+
+
+def upload_bundle(drive, tmp_path, contents):
+    """A model folder with a details file and, as upload.py --archive leaves it, an archive of `contents`."""
+    folder_id = drive.create_folder("MT3 - Slakh", "main")
+    output_folder_id = drive.create_folder(OUTPUT_FOLDER, folder_id)
+    drive.upload_string("Model Name: MT3\nDataset Name: Slakh\n\n\n", "details_Slakh.txt", folder_id)
+    paths = []
+    for name, data in contents.items():
+        (tmp_path / name).write_bytes(data)
+        paths.append(str(tmp_path / name))
+    archive_path = str(tmp_path / "MT3_Slakh.zip")
+    write_archive(paths, archive_path, "zip")
+    archive_id = drive.upload_file(archive_path, "MT3_Slakh.zip", output_folder_id)
+    drive.upload_file(archive_path + dataframe.ARCHIVE_INDEX_SUFFIX, "MT3_Slakh.zip.index.json", output_folder_id)
+    return archive_id
+
+
+def test_sync_range_reads_matching_archived_outputs(drive, tmp_path):
+    contents = {"a.mid": b"MThd first", "b.mid": b"MThd second member", "a.pdf": b"%PDF"}
+    archive_id = upload_bundle(drive, tmp_path, contents)
+    local_directory = tmp_path / "data"
+
+    dataframe.download_details_files("main", str(local_directory), ClientPool(lambda: drive), outputs="b.mid")
+
+    outputs = local_directory / dataframe.OUTPUTS_DIR / "MT3_Slakh"
+    assert [path.name for path in outputs.iterdir()] == ["b.mid"]
+    assert (outputs / "b.mid").read_bytes() == contents["b.mid"]
+    assert (local_directory / "MT3_Slakh.txt").exists()
+    # The archive is only ever range-read, one member's bytes at a time
+    archive_reads = [read for read in drive.reads if read[0] == archive_id]
+    assert archive_reads and all(size == len(contents["b.mid"]) for _, offset, size in archive_reads)
+
+
+def test_sync_leaves_archives_alone_without_an_outputs_pattern(drive, tmp_path):
+    archive_id = upload_bundle(drive, tmp_path, {"a.mid": b"MThd"})
+    local_directory = tmp_path / "data"
+
+    dataframe.download_details_files("main", str(local_directory), ClientPool(lambda: drive))
+
+    assert not (local_directory / dataframe.OUTPUTS_DIR).exists()
+    assert all(read[0] != archive_id for read in drive.reads)
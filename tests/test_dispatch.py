@@ -0,0 +1,53 @@
+import math
+
+from dispatch import _replace_flag, _with_export, assign_groups
+
+
+def group_plan(sizes):
+    """Plan with `size` jobs in each group, plus a notification job outside any group."""
+    plan = [{"key": f"{group}:{i}", "group": group} for group, size in sizes.items() for i in range(size)]
+    return plan + [{"key": "notify", "group": None}]
+
+
+def test_assign_groups_balances_by_backlog_largest_first():
+    plan = group_plan({("MT3", "Slakh"): 6, ("MT3", "GuitarSet"): 4, ("Basic Pitch", "Slakh"): 3})
+
+    assignment = assign_groups(plan, {"gilbreth": 5, "anvil": 0})
+
+    # anvil (0) takes the 6-job group, gilbreth (5 < 6) the 4-job group and anvil (6 < 9) the last one
+    assert assignment == {
+        ("MT3", "Slakh"): "anvil",
+        ("MT3", "GuitarSet"): "gilbreth",
+        ("Basic Pitch", "Slakh"): "anvil",
+    }
+
+
+def test_assign_groups_skips_unreachable_clusters():
+    plan = group_plan({("MT3", "Slakh"): 2, ("MT3", "GuitarSet"): 2})
+
+    assignment = assign_groups(plan, {"gilbreth": 100, "anvil": math.inf})
+
+    assert set(assignment.values()) == {"gilbreth"}
+
+
+def test_assign_groups_without_reachable_clusters():
+    assert assign_groups(group_plan({("MT3", "Slakh"): 1}), {"anvil": math.inf}) == {}
+
+
+def test_replace_flag_short_and_long_forms():
+    command = ["sbatch", "-A", "yunglu-k", "--partition=a100", "run.sh"]
+
+    command = _replace_flag(command, "-A", "standby")
+    command = _replace_flag(command, "--partition", None)
+
+    assert command == ["sbatch", "-A", "standby", "run.sh"]
+
+
+def test_with_export_extends_an_existing_export():
+    command = ["sbatch", "--export=ALL,UPLOAD_RUN_ID=1", "run.sh"]
+
+    assert _with_export(command, "SCRATCH_ROOT", "/scratch") == [
+        "sbatch",
+        "--export=ALL,UPLOAD_RUN_ID=1,SCRATCH_ROOT=/scratch",
+        "run.sh",
+    ]
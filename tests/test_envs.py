@@ -0,0 +1,60 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+import envs
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(envs, "ENV_CACHE", str(tmp_path / "env_cache"))
+    monkeypatch.setattr(envs, "LOCAL_ROOT", str(tmp_path / "local"))
+    return tmp_path
+
+
+def add_file(tar, name, data, mode=0o644):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    tar.addfile(info, io.BytesIO(data))
+
+
+def packed_archive(path, extra=()):
+    """A stand-in for conda-pack output: a file plus a no-op bin/conda-unpack."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tarfile.open(path, "w") as tar:
+        add_file(tar, "bin/conda-unpack", b"#!/bin/sh\nexit 0\n", mode=0o755)
+        add_file(tar, "lib/module.py", b"VALUE = 1\n")
+        for name in extra:
+            add_file(tar, name, b"x")
+    return path
+
+
+def test_cached_archive_needs_no_network(cache, monkeypatch):
+    key = envs.spec_hash(["python=3.10"])
+    packed_archive(os.path.join(envs.ENV_CACHE, f"upload-env-{key}.tar"))
+    monkeypatch.setattr(envs, "has_internet", lambda: pytest.fail("checked the network for a cached archive"))
+
+    prefix = envs.ensure_env("upload-env", ["python=3.10"])
+
+    assert os.path.isfile(os.path.join(prefix, "lib", "module.py"))
+    assert os.path.exists(os.path.join(prefix, ".unpacked"))
+
+
+def test_cache_miss_without_network_fails_before_building(cache, monkeypatch):
+    monkeypatch.setattr(envs, "has_internet", lambda: False)
+    monkeypatch.setattr(envs, "create_env", lambda *args: pytest.fail("tried to build offline"))
+
+    with pytest.raises(RuntimeError, match="No internet access"):
+        envs.ensure_env("upload-env", ["python=3.10"])
+
+
+@pytest.mark.skipif(not hasattr(tarfile, "data_filter"), reason="tarfile has no extraction filters")
+def test_unpack_refuses_members_outside_the_prefix(cache):
+    archive = packed_archive(str(cache / "evil.tar"), extra=["../outside.txt"])
+
+    with pytest.raises(tarfile.TarError):
+        envs.unpack(archive, "evil", "0")
+    assert not (cache / "local" / "outside.txt").exists()
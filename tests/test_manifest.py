@@ -0,0 +1,144 @@
+import os
+import struct
+import wave
+
+import pytest
+
+import manifest
+from manifest import build_manifest, load_manifest, midi_instrument_count, read_wav_header
+
+
+def write_wav(path, sample_rate, channels, frames):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(b"\x00\x00" * channels * frames)
+
+
+def test_read_wav_header(tmp_path):
+    path = tmp_path / "a.wav"
+    write_wav(path, 44100, 2, 44100 * 3)
+
+    assert read_wav_header(str(path)) == (44100, 2, 3.0)
+
+
+def test_read_wav_header_skips_odd_sized_chunks(tmp_path):
+    path = tmp_path / "a.wav"
+    write_wav(path, 16000, 1, 8000)
+    data = path.read_bytes()
+    # An odd-sized LIST chunk (padded to even length) between the RIFF header and fmt
+    extra = b"LIST" + struct.pack("<I", 5) + b"INFOx\x00"
+    data = data[:4] + struct.pack("<I", len(data) - 8 + len(extra)) + data[8:12] + extra + data[12:]
+    path.write_bytes(data)
+
+    assert read_wav_header(str(path)) == (16000, 1, 0.5)
+
+
+def test_read_wav_header_rejects_other_files(tmp_path):
+    path = tmp_path / "a.wav"
+    path.write_bytes(b"ID3\x03" + b"\x00" * 60)
+
+    with pytest.raises(ValueError):
+        read_wav_header(str(path))
+
+
+def track(*events):
+    body = b"".join(events) + b"\x00\xff\x2f\x00"  # End of track
+    return b"MTrk" + struct.pack(">I", len(body)) + body
+
+
+def midi_file(file_type, *tracks):
+    return b"MThd" + struct.pack(">IHHH", 6, file_type, len(tracks), 480) + b"".join(tracks)
+
+
+def test_midi_instrument_count_type_0(tmp_path):
+    path = tmp_path / "a.mid"
+    # Channels 0 and 9 play notes; channel 2 only gets a note-on with velocity 0
+    path.write_bytes(midi_file(0, track(b"\x00\x90\x3c\x40", b"\x00\x99\x24\x64", b"\x00\x92\x40\x00")))
+
+    assert midi_instrument_count(str(path)) == 2
+
+
+def test_midi_instrument_count_type_1(tmp_path):
+    path = tmp_path / "a.mid"
+    tempo = track(b"\x00\xff\x51\x03\x07\xa1\x20")
+    piano = track(b"\x00\xc0\x00", b"\x00\x90\x3c\x40", b"\x60\x3e\x40")  # Running status
+    bass = track(b"\x00\xc1\x21", b"\x00\x91\x28\x50")
+    path.write_bytes(midi_file(1, tempo, piano, bass))
+
+    assert midi_instrument_count(str(path)) == 2
+
+
+def test_midi_instrument_count_rejects_truncated_files(tmp_path):
+    path = tmp_path / "a.mid"
+    path.write_bytes(midi_file(0, track(b"\x00\x90\x3c\x40"))[:-6])
+
+    with pytest.raises(ValueError):
+        midi_instrument_count(str(path))
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """A dataset of two WAVs with its {dataset_path}.txt list."""
+    paths = []
+    for name, frames in (("a.wav", 16000), ("b.wav", 8000)):
+        write_wav(tmp_path / name, 16000, 1, frames)
+        paths.append(str(tmp_path / name))
+    dataset_path = str(tmp_path / "Slakh")
+    with open(f"{dataset_path}.txt", "w") as f:
+        f.write("".join(f"{path}\n" for path in paths))
+    return dataset_path, paths
+
+
+def count_described(monkeypatch):
+    described = []
+    original = manifest.describe_file
+    monkeypatch.setattr(manifest, "describe_file", lambda path, *args: described.append(path) or original(path, *args))
+    return described
+
+
+def test_build_manifest_reuses_unchanged_rows(dataset, monkeypatch):
+    dataset_path, paths = dataset
+    build_manifest(dataset_path, workers=2)
+    manifest_mtime = os.stat(manifest.manifest_path_for(dataset_path)).st_mtime_ns
+    described = count_described(monkeypatch)
+
+    build_manifest(dataset_path, workers=2)
+
+    assert described == []
+    assert os.stat(manifest.manifest_path_for(dataset_path)).st_mtime_ns == manifest_mtime  # Not rewritten
+
+
+def test_build_manifest_rereads_modified_files(dataset, monkeypatch, tmp_path):
+    dataset_path, paths = dataset
+    build_manifest(dataset_path, workers=2)
+    write_wav(paths[1], 16000, 1, 32000)
+    os.utime(paths[1], ns=(0, 10**18))  # Coarse filesystem timestamps must not hide the rewrite
+    described = count_described(monkeypatch)
+
+    _, rows = build_manifest(dataset_path, workers=2)
+
+    assert described == [paths[1]]
+    assert [float(row["duration_seconds"]) for row in rows] == [1.0, 2.0]
+
+
+def test_load_manifest_survives_a_rewritten_but_identical_list(dataset):
+    dataset_path, paths = dataset
+    build_manifest(dataset_path, workers=2)
+    os.utime(f"{dataset_path}.txt", ns=(0, 10**18))  # Newer than the manifest
+
+    rows = load_manifest(dataset_path)
+
+    assert [row["path"] for row in rows] == paths
+    assert rows[0]["duration_seconds"] == 1.0
+
+
+def test_load_manifest_ignores_a_manifest_missing_listed_files(dataset, tmp_path):
+    dataset_path, paths = dataset
+    build_manifest(dataset_path, workers=2)
+    write_wav(tmp_path / "c.wav", 16000, 1, 100)
+    with open(f"{dataset_path}.txt", "a") as f:
+        f.write(f"{tmp_path / 'c.wav'}\n")
+
+    assert load_manifest(dataset_path) is None
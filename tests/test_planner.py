@@ -0,0 +1,87 @@
+import math
+
+import pytest
+
+from planner import _empty_stats, fit_runtime, order_plan, parse_priorities, predict_seconds
+
+
+def runtime_stats(points):
+    """Accumulate (audio seconds, runtime) points the way load_runtime_history does."""
+    stats = _empty_stats()
+    for duration, runtime in points:
+        stats["files"] += 1
+        stats["runtime"] += runtime
+        stats["audio"] += duration
+        stats["audio_sq"] += duration * duration
+        stats["cross"] += duration * runtime
+    return stats
+
+
+def test_fit_runtime_recovers_a_linear_model():
+    stats = runtime_stats([(duration, 3.0 + 0.25 * duration) for duration in (10, 30, 60, 240)])
+
+    intercept, slope = fit_runtime(stats)
+
+    assert math.isclose(intercept, 3.0)
+    assert math.isclose(slope, 0.25)
+
+
+@pytest.mark.parametrize("points", [[], [(30, 5.0)], [(30, 5.0), (30, 7.0), (30, 6.0)]])
+def test_fit_runtime_needs_files_of_different_lengths(points):
+    assert fit_runtime(runtime_stats(points)) is None
+
+
+def test_predict_seconds_falls_back_to_the_model_mean():
+    history = {"pairs": {}, "models": {"MT3": runtime_stats([(30, 5.0), (30, 7.0)])}}
+
+    # One audio length only, so no regression: mean per-file runtime across datasets
+    assert predict_seconds(history, "MT3", "Slakh 2100", 10, audio_seconds=300) == 60.0
+
+
+def test_predict_seconds_prefers_the_dataset_fit():
+    history = {
+        "pairs": {("MT3", "Slakh_2100"): runtime_stats([(10, 2.0), (20, 4.0)])},
+        "models": {"MT3": runtime_stats([(10, 50.0), (20, 50.0)])},
+    }
+
+    assert math.isclose(predict_seconds(history, "MT3", "Slakh 2100", 3, audio_seconds=90), 18.0)
+
+
+def job(key, group, expected_seconds, priority=0):
+    return {"key": key, "group": group, "expected_seconds": expected_seconds, "priority": priority}
+
+
+def test_order_plan_runs_short_groups_first():
+    plan = [
+        job("long-0", ("MT3", "Slakh"), 500),
+        job("long-1", ("MT3", "Slakh"), 500),
+        job("long-upload", ("MT3", "Slakh"), 0, priority=-1),
+        job("short-0", ("MT3", "GuitarSet"), 200),
+        job("notify", None, 0, priority=-1),
+    ]
+
+    order_plan(plan)
+
+    assert [j["key"] for j in plan] == ["short-0", "long-0", "long-1", "long-upload", "notify"]
+    assert [j["priority"] for j in plan] == [0, 1, 2, -1, -1]
+
+
+def test_order_plan_applies_user_priorities_before_cost():
+    plan = [job("short", ("Basic Pitch", "GuitarSet"), 10), job("long", ("MT3", "Slakh"), 1000)]
+
+    order_plan(plan, parse_priorities(["MT3=-1"]))
+
+    assert [j["key"] for j in plan] == ["long", "short"]
+
+
+def test_order_plan_keeps_config_order_for_ties():
+    plan = [job("first", ("A", "x"), 100), job("second", ("B", "x"), 100)]
+
+    order_plan(plan)
+
+    assert [j["key"] for j in plan] == ["first", "second"]
+
+
+def test_parse_priorities_rejects_missing_names():
+    with pytest.raises(ValueError):
+        parse_priorities(["=3"])
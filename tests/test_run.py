@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+import run
+from scheduler import LocalScheduler
+
+
+@pytest.fixture
+def scheduler(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)  # monitor_jobs writes its ledger to the working directory
+    scheduler = LocalScheduler(runtime_ticks=2)
+    monkeypatch.setattr(run, "SCHEDULER", scheduler)
+    return scheduler
+
+
+def monitored_plan(groups, chunks):
+    """Chunk jobs plus a held upload per (model, dataset), as build_plan(hold_uploads=True) plans them."""
+    plan = []
+    for g in range(groups):
+        model_name, dataset_name = f"model{g}", "MAESTRO"
+        keys = []
+        for c in range(chunks):
+            key = f"chunk:{model_name}:{dataset_name}:{c:03d}"
+            record = {
+                "model": model_name,
+                "dataset": dataset_name,
+                "chunk_id": f"{c:03d}",
+                "attempt": 0,
+                "state": "PENDING",
+                "status": "active",
+            }
+            command = ["sbatch", "-J", f"{model_name}_{dataset_name}_chunk{c:03d}", "run.sh"]
+            plan.append(run.plan_job(key, "chunk", key, command, priority=len(plan), record=record))
+            keys.append(key)
+        plan.append(
+            run.plan_job(
+                f"upload:{model_name}:{dataset_name}",
+                "upload",
+                f"upload of {model_name}",
+                run.upload_command(model_name, dataset_name, hold=True),
+                depends_on=keys,
+                priority=-1,
+                record={"model": model_name, "dataset": dataset_name},
+            )
+        )
+    return plan
+
+
+def submit_throttled(plan, max_queued):
+    return asyncio.run(asyncio.wait_for(run.submit_plan_throttled(plan, max_queued, poll_interval=0), timeout=10))
+
+
+def test_throttle_ignores_held_uploads(scheduler):
+    plan = monitored_plan(groups=4, chunks=2)
+
+    # More held uploads than the throttle allows must not stall submission
+    job_ids = submit_throttled(plan, max_queued=2)
+
+    assert set(job_ids) == {job["key"] for job in plan}
+    assert scheduler.max_depth_seen <= 2
+    uploads = [job_ids[job["key"]] for job in plan if job["kind"] == "upload"]
+    assert all(scheduler.jobs[job_id]["held"] for job_id in uploads)
+
+
+def test_throttle_submits_uploads_after_their_chunks(scheduler):
+    plan = monitored_plan(groups=2, chunks=3)
+
+    job_ids = submit_throttled(plan, max_queued=2)
+
+    for job in plan:
+        if job["kind"] == "upload":
+            command = scheduler.jobs[job_ids[job["key"]]]["command"]
+            dependency = next(arg for arg in command if arg.startswith("--dependency="))
+            assert dependency.split(":")[1:] == [job_ids[key] for key in job["depends_on"]]
+
+
+def test_monitor_releases_throttled_uploads(scheduler):
+    plan = monitored_plan(groups=3, chunks=2)
+    job_ids = submit_throttled(plan, max_queued=2)
+    ledger = run.build_ledger(plan, job_ids)
+
+    run.monitor_jobs(ledger, poll_interval=0)
+
+    assert all(record["status"] == "done" for record in ledger["chunks"])
+    assert all(group["released"] for group in ledger["groups"])
+    assert not any(job["held"] for job in scheduler.jobs.values())
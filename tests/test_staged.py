@@ -0,0 +1,138 @@
+import math
+import random
+import argparse
+
+import run
+from scheduler import LocalScheduler
+from staged import MIN_PAIRED_FILES, paired_interval, rank_models, read_fmeasures
+
+
+def noisy_scores(mean, files, seed):
+    rng = random.Random(seed)
+    return {f"file{i:03d}.wav": min(max(mean + rng.gauss(0, 0.05), 0.0), 1.0) for i in range(files)}
+
+
+def test_paired_interval_of_constant_difference():
+    a = {"x.wav": 0.9, "y.wav": 0.8, "z.wav": 0.7}
+    b = {name: score - 0.1 for name, score in a.items()}
+
+    mean, half_width, shared = paired_interval(a, b, z=1.96)
+
+    assert math.isclose(mean, 0.1)
+    assert math.isclose(half_width, 0.0, abs_tol=1e-12)
+    assert shared == 3
+
+
+def test_paired_interval_only_uses_shared_files():
+    mean, half_width, shared = paired_interval({"x.wav": 0.9, "y.wav": 0.5}, {"x.wav": 0.4}, z=1.96)
+
+    assert shared == 1
+    assert half_width == math.inf
+
+
+def test_rank_models_resolves_a_clear_gap():
+    scores = {"weak": noisy_scores(0.5, 60, seed=1), "strong": noisy_scores(0.8, 60, seed=2)}
+
+    ranking, comparisons, unresolved, failed = rank_models(scores)
+
+    assert ranking == ["strong", "weak"]
+    assert comparisons[0][5]
+    assert unresolved == set()
+    assert failed == set()
+
+
+def test_rank_models_leaves_close_models_unresolved():
+    base = noisy_scores(0.6, 60, seed=3)
+    scores = {"a": base, "b": {name: score + 0.001 for name, score in base.items()}, "c": noisy_scores(0.6, 60, seed=4)}
+
+    _, _, unresolved, _ = rank_models(scores)
+
+    assert "c" in unresolved
+
+
+def test_rank_models_needs_enough_shared_files():
+    scores = {"weak": noisy_scores(0.2, MIN_PAIRED_FILES - 1, seed=5), "strong": noisy_scores(0.9, MIN_PAIRED_FILES - 1, seed=6)}
+
+    _, _, unresolved, _ = rank_models(scores)
+
+    assert unresolved == {"weak", "strong"}
+
+
+def test_rank_models_reports_models_without_scores_as_failed():
+    scores = {"a": noisy_scores(0.5, 60, seed=7), "b": noisy_scores(0.8, 60, seed=8), "crashed": {}}
+
+    ranking, _, unresolved, failed = rank_models(scores)
+
+    assert failed == {"crashed"}
+    assert "crashed" not in ranking
+    assert "crashed" not in unresolved
+
+
+def write_details(path, scores):
+    with open(path, "w") as f:
+        f.write("Model Name: m\nDataset Name: d\n\n\n")
+        for name, score in scores.items():
+            f.write(f"{name}\nDuration: 10.0 seconds\nF-measure: {score}\nRuntime: 1.0 seconds\n\n")
+
+
+def test_read_fmeasures_skips_files_without_scores(tmp_path):
+    details = tmp_path / "details_d.txt"
+    write_details(details, {"a.wav": 0.5})
+    with open(details, "a") as f:
+        f.write("b.wav\nDuration: 3.0 seconds\nReference: MISSING\nTranscription: MISSING\n\n")
+
+    assert read_fmeasures(str(details)) == {"a.wav": 0.5}
+
+
+def test_review_stage_drops_models_without_scores(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    order = [f"/data/file{i:03d}.wav" for i in range(200)]
+    for model_name, seed in (("close_a", 11), ("close_b", 12)):
+        (tmp_path / model_name).mkdir()
+        write_details(tmp_path / model_name / "details_Slakh.txt", noisy_scores(0.6, 100, seed))
+    (tmp_path / "crashed").mkdir()
+    entry = {
+        "row": ["Slakh", "/data", "all", "wav", None],
+        "order": order,
+        "offset": 100,
+        "ran": ["close_a", "close_b", "crashed"],
+        "models": [["close_a"], ["close_b"], ["crashed"]],
+    }
+
+    run.review_stage(entry)
+
+    assert [row[0] for row in entry["models"]] == ["close_a", "close_b"]
+
+
+def test_run_staged_stops_expanding_after_max_stages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scheduler = LocalScheduler(runtime_ticks=1)
+    monkeypatch.setattr(run, "SCHEDULER", scheduler)
+    dataset_row = ["Slakh", "/data", "all", "wav", None]
+    entry = {
+        "row": dataset_row,
+        "order": [f"/data/file{i:03d}.wav" for i in range(1000)],
+        "durations": {},
+        "offset": 0,
+        "models": [["a"], ["b"]],
+        "ran": [],
+    }
+    monkeypatch.setattr(run, "staged_datasets", lambda model_data, dataset_data, seed: [entry])
+    monkeypatch.setattr(run, "review_stage", lambda entry, confidence: None)  # Rankings never settle
+    args = argparse.Namespace(
+        telemetry_dir=str(tmp_path / "telemetry"),
+        seed=0,
+        stage_size=10,
+        max_stages=3,
+        walltime_margin=0.5,
+        throttle=None,
+        poll_interval=0,
+        max_retries=0,
+        confidence=0.95,
+    )
+
+    run.run_staged([["a"], ["b"]], [dataset_row], args)
+
+    assert entry["offset"] == 10 + 20 + 40
+    uploads = [command for command in scheduler.submitted if command[-3] == run.UPLOAD_SCRIPT]
+    assert len(uploads) == 2
@@ -0,0 +1,293 @@
+import os
+import json
+
+import pytest
+
+import upload
+from storage import ClientPool, LocalDriveBackend, RateLimitError
+from upload import (
+    INDEX_SUFFIX,
+    OUTPUT_FOLDER,
+    AdaptiveLimit,
+    archive_outputs,
+    remote_files,
+    sync_files_to_folder,
+    upload_with_retries,
+    write_archive,
+)
+
+
+@pytest.fixture
+def drive(tmp_path):
+    return LocalDriveBackend(str(tmp_path / "drive"))
+
+
+@pytest.fixture
+def folders(drive):
+    folder_id = drive.create_folder("MT3_Slakh", "main")
+    return folder_id, drive.create_folder(OUTPUT_FOLDER, folder_id)
+
+
+def write_outputs(directory, files):
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, content in files.items():
+        (directory / name).write_text(content)
+
+
+def sync(drive, directory, folders, delete=False):
+    return sync_files_to_folder(ClientPool(lambda: drive), str(directory), *folders, delete=delete)
+
+
+def test_sync_uploads_only_new_and_changed_files(drive, folders, tmp_path):
+    local = tmp_path / "research_output_Slakh"
+    write_outputs(local, {"a.mid": "a", "b.mid": "b", "details_Slakh.txt": "details"})
+
+    counts, failures = sync(drive, local, folders)
+    assert (counts["uploaded"], counts["updated"], counts["unchanged"], failures) == (3, 0, 0, {})
+
+    folder_id, output_folder_id = folders
+    assert set(remote_files(drive, folder_id)) == {"details_Slakh.txt"}
+    ids = {title: entries[0]["id"] for title, entries in remote_files(drive, output_folder_id).items()}
+    assert set(ids) == {"a.mid", "b.mid"}
+
+    write_outputs(local, {"b.mid": "b, transcribed again", "c.mid": "c"})
+    counts, _ = sync(drive, local, folders)
+    assert (counts["uploaded"], counts["updated"], counts["unchanged"]) == (1, 1, 2)
+
+    remote = remote_files(drive, output_folder_id)
+    assert remote["b.mid"][0]["id"] == ids["b.mid"]  # Updated in place
+    assert drive.download_bytes(ids["b.mid"]) == b"b, transcribed again"
+
+
+def test_sync_same_size_edit_is_detected_by_md5(drive, folders, tmp_path):
+    local = tmp_path / "out"
+    write_outputs(local, {"a.mid": "aaaa"})
+    sync(drive, local, folders)
+
+    write_outputs(local, {"a.mid": "bbbb"})
+    counts, _ = sync(drive, local, folders)
+
+    assert counts["updated"] == 1
+
+
+def test_sync_deletes_remote_files_gone_locally_only_when_asked(drive, folders, tmp_path):
+    local = tmp_path / "out"
+    write_outputs(local, {"a.mid": "a", "b.mid": "b"})
+    sync(drive, local, folders)
+    (local / "b.mid").unlink()
+
+    counts, _ = sync(drive, local, folders)
+    assert counts["deleted"] == 0
+
+    counts, _ = sync(drive, local, folders, delete=True)
+    assert counts["deleted"] == 1
+    assert set(remote_files(drive, folders[1])) == {"a.mid"}
+
+
+def test_sync_delete_removes_duplicate_titles(drive, folders, tmp_path):
+    local = tmp_path / "out"
+    write_outputs(local, {"a.mid": "a"})
+    drive.upload_file(str(local / "a.mid"), "a.mid", folders[1])
+    drive.upload_file(str(local / "a.mid"), "a.mid", folders[1])
+
+    counts, _ = sync(drive, local, folders, delete=True)
+
+    assert (counts["unchanged"], counts["deleted"]) == (1, 1)
+    assert len(remote_files(drive, folders[1])["a.mid"]) == 1
+
+
+@pytest.mark.parametrize("archive_format", ["zip", "tar"])
+def test_archive_index_offsets_point_at_member_bytes(tmp_path, archive_format):
+    contents = {"a.mid": b"MThd" + bytes(range(256)) * 4, "b.mid": b"", "long name " * 20 + ".mid": b"x" * 513}
+    paths = []
+    for name, data in contents.items():
+        (tmp_path / name).write_bytes(data)
+        paths.append(str(tmp_path / name))
+    archive_path = str(tmp_path / f"chunk_000.{archive_format}")
+
+    index = write_archive(paths, archive_path, archive_format)
+
+    with open(archive_path + INDEX_SUFFIX) as f:
+        assert json.load(f) == index
+    archive = (tmp_path / f"chunk_000.{archive_format}").read_bytes()
+    assert {member["name"] for member in index["members"]} == set(contents)
+    for member in index["members"]:
+        assert archive[member["offset"] : member["offset"] + member["size"]] == contents[member["name"]]
+
+
+def test_archive_member_range_read_from_drive(drive, folders, tmp_path):
+    (tmp_path / "a.mid").write_bytes(b"first")
+    (tmp_path / "b.mid").write_bytes(b"second member")
+    archive_path = str(tmp_path / "bundle.zip")
+    index = write_archive([str(tmp_path / "a.mid"), str(tmp_path / "b.mid")], archive_path, "zip")
+    file_id = drive.upload_file(archive_path, "bundle.zip", folders[1])
+
+    member = next(member for member in index["members"] if member["name"] == "b.mid")
+
+    assert drive.download_bytes(file_id, member["offset"], member["size"]) == b"second member"
+
+
+def test_archive_outputs_skips_members_of_earlier_archives(tmp_path):
+    write_outputs(tmp_path, {"a.mid": "a", "details_Slakh.txt": "details"})
+    archive_outputs(str(tmp_path), [str(tmp_path / "a.mid")], "zip", "chunk_000")
+    write_outputs(tmp_path, {"b.mid": "b"})
+
+    paths = archive_outputs(str(tmp_path), None, "zip", "final")
+
+    with open(tmp_path / "archives" / f"final.zip{INDEX_SUFFIX}") as f:
+        assert [member["name"] for member in json.load(f)["members"]] == ["b.mid"]
+    assert sorted(os.path.basename(path) for path in paths) == [
+        "chunk_000.zip",
+        f"chunk_000.zip{INDEX_SUFFIX}",
+        "details_Slakh.txt",
+        "final.zip",
+        f"final.zip{INDEX_SUFFIX}",
+    ]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(upload.time, "monotonic", lambda: now[0])
+    return now
+
+
+def finish(limit, count, rate_limited=False):
+    for _ in range(count):
+        limit.acquire()
+        limit.release(rate_limited)
+
+
+def test_adaptive_limit_grows_by_one_per_window_of_successes(clock):
+    limit = AdaptiveLimit(initial=4, maximum=6)
+
+    finish(limit, 4)
+    assert limit.limit == 5
+    finish(limit, 5)
+    assert limit.limit == 6
+    finish(limit, 20)
+    assert (limit.limit, limit.peak) == (6, 6)
+
+
+def test_adaptive_limit_halves_once_per_rate_limit_burst(clock):
+    limit = AdaptiveLimit(initial=16)
+
+    finish(limit, 3, rate_limited=True)
+    assert limit.limit == 8
+
+    clock[0] += upload.DECREASE_INTERVAL
+    finish(limit, 1, rate_limited=True)
+    assert limit.limit == 4
+    assert limit.successes == 0
+
+
+def test_adaptive_limit_never_drops_below_one(clock):
+    limit = AdaptiveLimit(initial=2)
+    for _ in range(5):
+        finish(limit, 1, rate_limited=True)
+        clock[0] += upload.DECREASE_INTERVAL
+
+    assert limit.limit == 1
+    limit.acquire()  # Still admits one transfer
+    assert limit.active == 1
+
+
+class RateLimitedDrive(LocalDriveBackend):
+    """Rejects the first `failures` uploads with a 429."""
+
+    def __init__(self, root, failures):
+        super().__init__(root)
+        self.failures = failures
+
+    def upload_file(self, local_path, title, parent_id, file_id=None):
+        if self.failures:
+            self.failures -= 1
+            raise RateLimitError()
+        return super().upload_file(local_path, title, parent_id, file_id)
+
+
+def test_upload_with_retries_backs_off_on_rate_limits(tmp_path, monkeypatch, clock):
+    monkeypatch.setattr(upload.time, "sleep", lambda seconds: None)
+    drive = RateLimitedDrive(str(tmp_path / "drive"), failures=2)
+    (tmp_path / "a.mid").write_text("a")
+    limit = AdaptiveLimit(initial=8)
+
+    error = upload_with_retries(ClientPool(lambda: drive), limit, (str(tmp_path / "a.mid"), "a.mid", "folder", None))
+
+    assert error is None
+    assert limit.limit == 4  # Both 429s fell in one burst
+    assert set(remote_files(drive, "folder")) == {"a.mid"}
+
+
+def test_upload_with_retries_gives_up_on_permanent_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload.time, "sleep", lambda seconds: None)
+    drive = LocalDriveBackend(str(tmp_path / "drive"))
+
+    transfer = (str(tmp_path / "gone.mid"), "gone.mid", "folder", None)
+
+    error = upload_with_retries(ClientPool(lambda: drive), AdaptiveLimit(), transfer)
+
+    assert "gone.mid" in error
+
+
+class RejectingDrive(LocalDriveBackend):
+    """Refuses uploads of the titles in `rejected` with an error that is not retried."""
+
+    rejected = set()
+
+    def upload_file(self, local_path, title, parent_id, file_id=None):
+        if title in self.rejected:
+            raise PermissionError(f"403 {title} rejected")
+        return super().upload_file(local_path, title, parent_id, file_id)
+
+
+def run_upload(monkeypatch, tmp_path, *extra):
+    argv = [
+        "upload.py",
+        "--main-folder=main",
+        "--model-name=MT3",
+        "--dataset-name=Slakh",
+        f"--local-directory={tmp_path / 'MT3' / 'research_output_Slakh'}",
+        f"--local-drive={tmp_path / 'drive'}",
+        "--run-id=run1",
+        *extra,
+    ]
+    monkeypatch.setattr(upload.sys, "argv", argv)
+    with pytest.raises(SystemExit) as exit_info:
+        upload.main()
+    return exit_info.value.code
+
+
+@pytest.fixture
+def streamed_chunks(tmp_path, monkeypatch):
+    """Two streamed chunks of MT3 / Slakh: chunk_000 fails to upload a.mid, chunk_001 uploads b.mid."""
+    monkeypatch.setattr(upload, "LocalDriveBackend", RejectingDrive)
+    monkeypatch.setattr(RejectingDrive, "rejected", {"a.mid"})
+    local = tmp_path / "MT3" / "research_output_Slakh"
+    write_outputs(local, {"a.mid": "a", "b.mid": "b"})
+    for chunk, name in (("chunk_000", "a.mid"), ("chunk_001", "b.mid")):
+        (tmp_path / f"{chunk}.txt").write_text(f"{local / name}\n")
+        run_upload(monkeypatch, tmp_path, f"--files-from={tmp_path / chunk}.txt", f"--chunk-name={chunk}")
+    return tmp_path / "MT3"
+
+
+def test_chunk_failure_reports_are_kept_apart(streamed_chunks):
+    reports = sorted(path.name for path in streamed_chunks.glob("upload_failed_*"))
+
+    assert reports == ["upload_failed_Slakh.chunk_000.txt"]
+    assert "a.mid" in (streamed_chunks / reports[0]).read_text()
+
+
+def test_complete_reports_chunk_failures_it_could_not_fix(streamed_chunks, tmp_path, monkeypatch):
+    assert run_upload(monkeypatch, tmp_path, "--complete") == 1
+
+    assert sorted(path.name for path in streamed_chunks.glob("upload_failed_*")) == ["upload_failed_Slakh.txt"]
+    assert "a.mid" in (streamed_chunks / "upload_failed_Slakh.txt").read_text()
+
+
+def test_complete_clears_chunk_failures_it_retried(streamed_chunks, tmp_path, monkeypatch):
+    monkeypatch.setattr(RejectingDrive, "rejected", set())
+
+    assert run_upload(monkeypatch, tmp_path, "--complete") == 0
+
+    assert list(streamed_chunks.glob("upload_failed_*")) == []